@@ -925,7 +925,12 @@ def _deploy_clusters(client, cluster_id, host_mapping):
 
 
 def _get_installing_progress(client, cluster_id, host_mapping):
-    """get intalling progress."""
+    """get intalling progress.
+
+    The cluster and host states are got in one request, which waits
+    up to progress_update_check_interval seconds for the states to
+    change since the last response.
+    """
     action_timeout = time.time() + 60 * float(flags.OPTIONS.action_timeout)
     deployment_timeout = time.time() + 60 * float(
         flags.OPTIONS.deployment_timeout)
@@ -935,17 +940,24 @@ def _get_installing_progress(client, cluster_id, host_mapping):
     hosts_failed = {}
     install_finished = False
     deployment_failed = False
+    state_version = None
     current_time = time.time()
     while current_time < deployment_timeout:
-        status, cluster_state = client.get_cluster_state(cluster_id)
+        status, progress = client.get_cluster_progress(
+            cluster_id, since=state_version,
+            wait=int(flags.OPTIONS.progress_update_check_interval)
+        )
         logging.info(
-            'get cluster %s state status %s: %s',
-            cluster_id, status, cluster_state
+            'get cluster %s progress status %s: %s',
+            cluster_id, status, progress
         )
         if status >= 400:
             raise Exception(
-                'failed to acquire cluster %s state' % cluster_id
+                'failed to acquire cluster %s progress' % cluster_id
             )
+        state_version = progress['version']
+        cluster_state = progress['cluster']
+        current_time = time.time()
         if cluster_state['state'] in ['UNINITIALIZED', 'INITIALIZED']:
             if current_time >= action_timeout:
                 deployment_failed = True
@@ -956,20 +968,18 @@ def _get_installing_progress(client, cluster_id, host_mapping):
             cluster_installed = True
         if cluster_state['state'] == 'ERROR':
             cluster_failed = True
+        host_states = dict([
+            (clusterhost_state['host_id'], clusterhost_state)
+            for clusterhost_state in progress['clusterhosts']
+        ])
         for hostname, host_id in host_mapping.items():
-            status, host_state = client.get_cluster_host_state(
-                cluster_id, host_id
-            )
-            logging.info(
-                'get cluster %s host %s state status %s: %s',
-                cluster_id, host_id, status, host_state
-            )
-            if status >= 400:
+            if host_id not in host_states:
                 raise Exception(
                     'failed to acquire cluster %s host %s state' % (
                         cluster_id, host_id
                     )
                 )
+            host_state = host_states[host_id]
             if host_state['state'] in ['UNINITIALIZED', 'INITIALIZED']:
                 raise Exception(
                     'unintended status for host %s: %s' % (
@@ -1003,9 +1013,7 @@ def _get_installing_progress(client, cluster_id, host_mapping):
         else:
             logging.info(
                 'there are some clusters/hosts in installing.'
-                'sleep %s seconds and retry',
-                flags.OPTIONS.progress_update_check_interval)
-            time.sleep(float(flags.OPTIONS.progress_update_check_interval))
+                'wait for state changes and retry')
         current_time = time.time()
 
     if deployment_failed:
@@ -38,5 +38,4 @@ logsetting.init()
 from compass.api import api as compass_api
 
 
-compass_api.init()
-application = compass_api.app
+application = compass_api.create_app()
@@ -32,8 +32,10 @@ from compass.actions import deploy
 from compass.actions import reinstall
 from compass.api import app
 from compass.db.api import database
+from compass.db.api import machine as machine_api
 from compass.db.api import switch as switch_api
 from compass.db.api import user as user_api
+from compass.db.api import user_log as user_log_api
 from compass.tasks.client import celery
 from compass.utils import flags
 from compass.utils import logsetting
@@ -124,6 +126,62 @@ def dropdb():
     database.drop_db()
 
 
+@app_manager.command
+def clean_user_tokens():
+    """Delete expired user tokens."""
+    database.init()
+    user_api.clean_expired_user_tokens()
+
+
+@app_manager.command
+def migrate_user_permission_version():
+    """Add the permission version column of users."""
+    database.init()
+    user_api.migrate_user_permission_version()
+
+
+@app_manager.command
+def clean_user_logs():
+    """Delete user logs older than the retention."""
+    database.init()
+    user_log_api.clean_user_logs()
+
+
+@app_manager.command
+def update_switch_machines_filtered():
+    """Recompute the filtered flag of all the switch machines."""
+    database.init()
+    switch_api.update_switch_machines_filtered()
+
+
+@app_manager.command
+def migrate_switch_machines_filtered():
+    """Add the filtered column of switch machines and fill it."""
+    database.init()
+    switch_api.migrate_switch_machines_filtered()
+
+
+@app_manager.command
+def migrate_machine_macs():
+    """Add the mac int column of machines and convert existing macs."""
+    database.init()
+    machine_api.migrate_machine_macs()
+
+
+@app_manager.command
+def migrate_switch_sync_columns():
+    """Add the switch error and machine missing since columns."""
+    database.init()
+    switch_api.migrate_switch_sync_columns()
+
+
+@app_manager.command
+def migrate_switch_machine_ports():
+    """Add the port part table of switch machines and split ports."""
+    database.init()
+    switch_api.migrate_switch_machine_ports()
+
+
 @app_manager.command
 def set_switch_machines():
     """Set switches and machines.
@@ -15,8 +15,7 @@
 """Base class for Compass Health Check."""
 from compass.actions.health_check import utils as health_check_utils
 from compass.db.api import database
-from compass.db.api import utils
-from compass.db import models
+from compass.db.api import reference_cache
 from compass.utils import setting_wrapper as setting
 
 
@@ -32,26 +31,22 @@ class BaseCheck(object):
         self.package_installer = self._get_package_installer()
 
     def _get_os_installer(self):
-        with database.session() as session:
-            installer = utils.get_db_object(
-                session, models.OSInstaller
-            )
+        with database.session(read_only=True) as session:
+            installer = reference_cache.OS_INSTALLER_CACHE.get(session)
             os_installer = {}
             os_installer['name'] = health_check_utils.strip_name(
-                installer.name)
-            os_installer.update(installer.settings)
+                installer['name'])
+            os_installer.update(installer['settings'])
         return os_installer
 
     def _get_package_installer(self):
         package_installer = {}
-        with database.session() as session:
-            installer = session.query(
-                models.PackageInstaller
-            ).first()
+        with database.session(read_only=True) as session:
+            installer = reference_cache.PACKAGE_INSTALLER_CACHE.get(session)
             package_installer = {}
             package_installer['name'] = health_check_utils.strip_name(
-                installer.name)
-            package_installer.update(installer.settings)
+                installer['name'])
+            package_installer.update(installer['settings'])
         return package_installer
 
     def _set_status(self, code, message):
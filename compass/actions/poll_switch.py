@@ -101,8 +101,10 @@ def poll_switch(poller_email, ip_addr, credentials,
     """Query switch and update switch machines.
 
     .. note::
-       When polling switch succeeds, for each mac it got from polling switch,
-       A Machine record associated with the switch is added to the database.
+       When polling switch succeeds, the machines of the switch are
+       reconciled with the polled macs in one transaction per switch:
+       new macs are added, moved ports and changed vlans are updated
+       and the machines no longer polled are marked missing.
 
     :param ip_addr: switch ip address.
     :type ip_addr: str
@@ -112,6 +114,7 @@ def poll_switch(poller_email, ip_addr, credentials,
     :type req_obj: str
     :param oper: the operation to query the switch.
     :type oper: str, should be one of ['SCAN', 'GET', 'SET']
+    :returns: dict of switch id to the change counts of its machines.
 
     .. note::
        The function should be called out of database session scope.
@@ -133,14 +136,24 @@ def poll_switch(poller_email, ip_addr, credentials,
             logging.error('no switch found for %s', ip_addr)
             return
 
+        if switch_dict['state'] == 'under_monitoring':
+            machines = machine_dicts
+        else:
+            # keep the machines of the switch when the poll failed.
+            machines = None
+        if switch_dict['err_msg']:
+            logging.error(
+                'poll switch %s error: %s', ip_addr, switch_dict['err_msg']
+            )
+        switch_counts = {}
         for switch in switches:
-            for machine_dict in machine_dicts:
-                logging.debug('add machine: %s', machine_dict)
-                switch_api.add_switch_machine(
-                    switch['id'], False, user=poller, **machine_dict
-                )
-                switch_api.update_switch(
-                    switch['id'],
-                    user=poller,
-                    **switch_dict
-                )
+            switch_counts[switch['id']] = switch_api.sync_switch_machines(
+                switch['id'], machines=machines, user=poller,
+                vendor=switch_dict['vendor'], state=switch_dict['state'],
+                err_msg=switch_dict['err_msg']
+            )
+            logging.info(
+                'poll switch %s machine changes: %s',
+                ip_addr, switch_counts[switch['id']]
+            )
+        return switch_counts
@@ -36,6 +36,13 @@ app.config['REMEMBER_COOKIE_DURATION'] = (
         seconds=util.parse_time_interval(setting.USER_TOKEN_DURATION)
     )
 )
+app.config['USER_TOKEN_REFRESH_THRESHOLD'] = (
+    datetime.timedelta(
+        seconds=util.parse_time_interval(
+            setting.USER_TOKEN_REFRESH_THRESHOLD
+        )
+    )
+)
 
 login_manager = LoginManager()
 login_manager.login_view = 'login'
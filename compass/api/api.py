@@ -19,14 +19,21 @@ import datetime
 import functools
 import logging
 import netaddr
+import os
 import requests
 import simplejson as json
+import threading
+import time
 
 from flask.ext.login import current_user
 from flask.ext.login import login_required
 from flask.ext.login import login_user
 from flask.ext.login import logout_user
+from flask import g
 from flask import request
+from flask import Response
+from werkzeug.test import EnvironBuilder
+from werkzeug.urls import url_encode
 
 from compass.api import app
 from compass.api import auth_handler
@@ -41,33 +48,55 @@ from compass.db.api import machine as machine_api
 from compass.db.api import metadata_holder as metadata_api
 from compass.db.api import network as network_api
 from compass.db.api import permission as permission_api
+from compass.db.api import reference_cache
+from compass.db.api import statement_stats
+from compass.db.api import utils as db_utils
 from compass.db.api import switch as switch_api
 from compass.db.api import user as user_api
 from compass.db.api import user_log as user_log_api
 from compass.utils import flags
 from compass.utils import logsetting
+from compass.utils import metrics
 from compass.utils import setting_wrapper as setting
 from compass.utils import util
 
 
+READY = False
+WARMING_UP = False
+WARM_UP_TIME = None
+PROXY_SESSION = None
+PROXY_SESSION_PID = None
+PROXY_SESSION_LOCK = threading.Lock()
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+])
+
+
 def log_user_action(func):
     @functools.wraps(func)
     def decorated_api(*args, **kwargs):
-        user_log_api.log_user_action(current_user.id, request.path)
+        user_log_api.log_user_action_async(current_user.id, request.path)
         return func(*args, **kwargs)
     return decorated_api
 
 
 def update_user_token(func):
+    """Extend the token expiry once it is close to expire."""
     @functools.wraps(func)
     def decorated_api(*args, **kwargs):
         response = func(*args, **kwargs)
-        expire_timestamp = (
-            datetime.datetime.now() + app.config['REMEMBER_COOKIE_DURATION']
-        )
-        user_api.record_user_token(
-            current_user.token, expire_timestamp, user=current_user
-        )
+        now = datetime.datetime.now()
+        if (
+            not current_user.expire_timestamp or
+            current_user.expire_timestamp - now <
+            app.config['USER_TOKEN_REFRESH_THRESHOLD']
+        ):
+            user_api.record_user_token(
+                current_user.token,
+                now + app.config['REMEMBER_COOKIE_DURATION'],
+                user=current_user
+            )
         return response
     return decorated_api
 
@@ -156,9 +185,21 @@ def _int_converter(value):
         )
 
 
+def _fields_converter(value):
+    """Convert fields=a,b&fields=c to [a, b, c]."""
+    if not isinstance(value, list):
+        value = [value]
+    fields = []
+    for item in value:
+        fields.extend([field for field in item.split(',') if field])
+    return fields
+
+
 def _get_request_args(**kwargs):
     args = dict(request.args)
     logging.debug('origin request args: %s', args)
+    # pretty only changes the json format of the response.
+    args.pop('pretty', None)
     for key, value in args.items():
         if key in kwargs:
             converter = kwargs[key]
@@ -166,6 +207,8 @@ def _get_request_args(**kwargs):
                 args[key] = [converter(item) for item in value]
             else:
                 args[key] = converter(value)
+    if 'fields' in args:
+        args['fields'] = _fields_converter(args['fields'])
     logging.debug('request args: %s', args)
     return args
 
@@ -204,6 +247,77 @@ def _wrap_response(func, response_code):
     return wrapped_func
 
 
+def _get_pagination_args(data):
+    """Pop limit and marker from request args."""
+    pagination = {}
+    for key in ['limit', 'marker']:
+        value = _get_data(data, key)
+        _clean_data(data, [key])
+        if value is not None:
+            pagination[key] = _int_converter(value)
+    return pagination
+
+
+def _get_next_page_url(marker):
+    args = request.args.copy()
+    args['marker'] = marker
+    return '%s?%s' % (request.base_url, url_encode(args))
+
+
+def _iter_list_pages(list_func, data, marker_key, format_func, page):
+    """Iterate the list api page by page from the given first page."""
+    limit = data['limit']
+    while True:
+        if format_func:
+            page = format_func(page)
+        for item in page:
+            yield item
+        if len(page) < limit:
+            break
+        data['marker'] = page[-1][marker_key]
+        page = list_func(**data)
+
+
+def _make_list_response(list_func, data, marker_key='id', format_func=None):
+    """Make response of a list api.
+
+    If limit is in request args, the response is one page of the list,
+    ordered by marker_key, with a Link header to the next page.
+    If stream is in request args, the whole list is written as a chunked
+    json array, fetched one page at a time.
+    When pages are fetched, marker_key is always in the response fields.
+    """
+    stream = 'stream' in data and _bool_converter(_get_data(data, 'stream'))
+    _clean_data(data, ['stream'])
+    data.update(_get_pagination_args(data))
+    if stream:
+        data.setdefault('limit', setting.LIST_STREAM_PAGE_SIZE)
+    if (
+        data.get('fields') and 'limit' in data and
+        marker_key not in data['fields']
+    ):
+        data['fields'] = data['fields'] + [marker_key]
+    if stream:
+        # the first page is fetched here so that errors are still
+        # reported with their own status code.
+        first_page = list_func(**data)
+        return utils.make_json_stream_response(
+            200,
+            _iter_list_pages(
+                list_func, data, marker_key, format_func, first_page
+            )
+        )
+    items = list_func(**data)
+    if format_func:
+        items = format_func(items)
+    response = utils.make_json_response(200, items)
+    if 'limit' in data and len(items) >= data['limit']:
+        response.headers['Link'] = '<%s>; rel="next"' % (
+            _get_next_page_url(items[-1][marker_key])
+        )
+    return response
+
+
 def _reformat_host_networks(networks):
     network_mapping = {}
     for network in networks:
@@ -220,6 +334,154 @@ def _reformat_host(host):
     return host
 
 
+@app.before_request
+def _check_ready():
+    if WARMING_UP and not READY and request.endpoint != 'show_readiness':
+        raise exception_handler.ServiceUnavailable('server is warming up')
+
+
+@app.route("/ready", methods=['GET'])
+def show_readiness():
+    """Show if the server has completed its warm up."""
+    return utils.make_json_response(
+        200 if READY else 503,
+        {'ready': READY, 'warm_up_time': WARM_UP_TIME}
+    )
+
+
+@app.before_request
+def _start_statement_stats():
+    if setting.SQL_STATS_ENABLED:
+        g.statement_stats = statement_stats.start(
+            'request %s %s' % (request.method, request.path),
+            logging.INFO
+        )
+
+
+@app.after_request
+def _stop_statement_stats(response):
+    stats = getattr(g, 'statement_stats', None)
+    if stats:
+        statement_stats.stop(stats)
+        if setting.SQL_STATS_HEADER_ENABLED:
+            response.headers['X-Sql-Stats'] = stats.summary()
+    return response
+
+
+@app.teardown_request
+def _clean_statement_stats(error=None):
+    stats = getattr(g, 'statement_stats', None)
+    if stats:
+        statement_stats.stop(stats)
+
+
+def _get_request_route():
+    if request.url_rule:
+        return request.url_rule.rule
+    return 'unmatched'
+
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_start_time = time.time()
+    metrics.REGISTRY.add(
+        'compass_api_requests_in_flight', 'Requests being processed.', 1
+    )
+
+
+@app.after_request
+def _record_request_metrics(response):
+    start_time = getattr(g, 'metrics_start_time', None)
+    if start_time is None:
+        return response
+    route = _get_request_route()
+    metrics.REGISTRY.observe(
+        'compass_api_request_duration_seconds',
+        'Time to build the response of requests.',
+        time.time() - start_time, method=request.method, route=route
+    )
+    metrics.REGISTRY.inc(
+        'compass_api_requests_total', 'Requests by response status.',
+        method=request.method, route=route, status=response.status_code
+    )
+    if response.content_length is not None:
+        metrics.REGISTRY.inc(
+            'compass_api_response_bytes_total',
+            'Bytes of the response bodies with known length.',
+            response.content_length, method=request.method, route=route
+        )
+    stats = getattr(g, 'statement_stats', None)
+    if stats:
+        metrics.REGISTRY.observe(
+            'compass_api_request_sql_statements',
+            'Sql statements executed by requests.',
+            stats.count, setting.METRICS_SQL_COUNT_BUCKETS,
+            method=request.method, route=route
+        )
+    return response
+
+
+@app.teardown_request
+def _stop_request_metrics(error=None):
+    if getattr(g, 'metrics_start_time', None) is not None:
+        g.metrics_start_time = None
+        metrics.REGISTRY.add(
+            'compass_api_requests_in_flight', 'Requests being processed.',
+            -1
+        )
+
+
+def _render_component_metrics():
+    """Render the metrics of db pools, caches and the user log writer."""
+    pool_samples = []
+    for engine, pool_metrics in database.pool_metrics().items():
+        for key, value in pool_metrics.items():
+            if key != 'pool':
+                pool_samples.append(
+                    ({'engine': engine, 'metric': key}, value)
+                )
+    cache_samples = []
+    for cache, cache_stats in reference_cache.cache_stats().items():
+        for key, value in cache_stats.items():
+            cache_samples.append(({'cache': cache, 'metric': key}, value))
+    writer_samples = []
+    if user_log_api.WRITER:
+        writer_samples = [
+            ({'metric': key}, value)
+            for key, value in user_log_api.WRITER.stats().items()
+        ]
+    return ''.join([
+        metrics.render_gauges(
+            'compass_db_pool', 'Database connection pool metrics.',
+            pool_samples
+        ),
+        metrics.render_gauges(
+            'compass_reference_cache', 'Reference cache metrics.',
+            cache_samples
+        ),
+        metrics.render_gauges(
+            'compass_user_log_writer', 'User log writer metrics.',
+            writer_samples
+        )
+    ])
+
+
+@app.route("/metrics", methods=['GET'])
+def show_metrics():
+    """Show the metrics of this process in prometheus text format.
+
+    Only allowed from setting.METRICS_ALLOWED_ADDRESSES.
+    """
+    if request.remote_addr not in setting.METRICS_ALLOWED_ADDRESSES:
+        raise exception_handler.Forbidden(
+            'metrics are not allowed from %s' % request.remote_addr
+        )
+    return Response(
+        metrics.REGISTRY.render() + _render_component_metrics(), 200,
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
 def _login(use_cookie):
     """User login helper function."""
     data = _get_request_data()
@@ -235,7 +497,7 @@ def _login(use_cookie):
     if not login_user(user, remember=data.get('remember', False)):
         raise exception_handler.UserDisabled('failed to login: %s' % user)
 
-    user_log_api.log_user_action(user.id, request.path)
+    user_log_api.log_user_action_async(user.id, request.path)
     response_data = user_api.record_user_token(
         user.token, user.expire_timestamp, user=user
     )
@@ -258,7 +520,7 @@ def login():
 @login_required
 def logout():
     """User logout."""
-    user_log_api.log_user_action(current_user.id, request.path)
+    user_log_api.log_user_action_async(current_user.id, request.path)
     response_data = user_api.clean_user_token(
         current_user.token, user=current_user
     )
@@ -276,8 +538,8 @@ def list_users():
         is_admin=_bool_converter,
         active=_bool_converter
     )
-    return utils.make_json_response(
-        200, user_api.list_users(user=current_user, **data)
+    return _make_list_response(
+        functools.partial(user_api.list_users, user=current_user), data
     )
 
 
@@ -466,9 +728,11 @@ def delete_user_permission(user_id, permission_id):
 def list_permissions():
     """List permissions."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        permission_api.list_permissions(user=current_user, **data)
+    return _make_list_response(
+        functools.partial(
+            permission_api.list_permissions, user=current_user
+        ),
+        data
     )
 
 
@@ -523,11 +787,9 @@ def list_all_user_actions():
     """List all users actions."""
     data = _get_request_args()
     _filter_timestamp(data)
-    return utils.make_json_response(
-        200,
-        user_log_api.list_actions(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(user_log_api.list_actions, user=current_user),
+        data
     )
 
 
@@ -539,11 +801,11 @@ def list_user_actions(user_id):
     """List user actions."""
     data = _get_request_args()
     _filter_timestamp(data)
-    return utils.make_json_response(
-        200,
-        user_log_api.list_user_actions(
-            user_id, user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(
+            user_log_api.list_user_actions, user_id, user=current_user
+        ),
+        data
     )
 
 
@@ -845,11 +1107,11 @@ def list_switch_machines(switch_id):
     _filter_general(data, 'vlans')
     _filter_tag(data)
     _filter_location(data)
-    return utils.make_json_response(
-        200,
-        switch_api.list_switch_machines(
-            switch_id, user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(
+            switch_api.list_switch_machines, switch_id, user=current_user
+        ),
+        data, marker_key='switch_machine_id'
     )
 
 
@@ -866,11 +1128,12 @@ def list_switch_machines_hosts(switch_id):
     _filter_location(data)
     _filter_general(data, 'os_name')
     _filter_general(data, 'os_id')
-    return utils.make_json_response(
-        200,
-        switch_api.list_switch_machines_hosts(
-            switch_id, user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(
+            switch_api.list_switch_machines_hosts, switch_id,
+            user=current_user
+        ),
+        data, marker_key='switch_machine_id'
     )
 
 
@@ -1053,11 +1316,11 @@ def list_switchmachines():
     _filter_general(data, 'vlans')
     _filter_tag(data)
     _filter_location(data)
-    return utils.make_json_response(
-        200,
-        switch_api.list_switchmachines(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(
+            switch_api.list_switchmachines, user=current_user
+        ),
+        data, marker_key='switch_machine_id'
     )
 
 
@@ -1075,11 +1338,11 @@ def list_switchmachines_hosts():
     _filter_location(data)
     _filter_general(data, 'os_name')
     _filter_general(data, 'os_id')
-    return utils.make_json_response(
-        200,
-        switch_api.list_switchmachines_hosts(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(
+            switch_api.list_switchmachines_hosts, user=current_user
+        ),
+        data, marker_key='switch_machine_id'
     )
 
 
@@ -1158,11 +1421,9 @@ def list_machines():
     data = _get_request_args()
     _filter_tag(data)
     _filter_location(data)
-    return utils.make_json_response(
-        200,
-        machine_api.list_machines(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(machine_api.list_machines, user=current_user),
+        data
     )
 
 
@@ -1233,11 +1494,9 @@ def delete_machine(machine_id):
 def list_subnets():
     """List subnets."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        network_api.list_subnets(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(network_api.list_subnets, user=current_user),
+        data
     )
 
 
@@ -1369,18 +1628,10 @@ def show_os_metadata(os_id):
 @update_user_token
 def convert_os_metadata(os_id):
     """Convert os metadata to ui os metadata."""
-    metadatas = metadata_api.get_os_metadata(
+    ui_metadata, ui_metadata_json = metadata_api.get_os_ui_metadata(
         os_id, user=current_user
     )
-    configs = util.load_configs(setting.OS_MAPPING_DIR)
-    metadata = metadatas['os_config']
-    config = configs[0]['OS_CONFIG_MAPPING']
-    return utils.make_json_response(
-        200,
-        metadata_api.get_ui_metadata(
-            metadata, config
-        )
-    )
+    return utils.make_json_response(200, ui_metadata, ui_metadata_json)
 
 
 @app.route("/flavors/<int:flavor_id>/metadata", methods=['GET'])
@@ -1404,25 +1655,10 @@ def show_flavor_metadata(flavor_id):
 @update_user_token
 def convert_flavor_metadata(flavor_id):
     """Convert flavor metadat to ui flavor metadata."""
-    metadatas = metadata_api.get_flavor_metadata(
+    ui_metadata, ui_metadata_json = metadata_api.get_flavor_ui_metadata(
         flavor_id, user=current_user
     )
-    metadata = metadatas['flavor_config']
-    flavor = metadata_api.get_flavor(
-        flavor_id,
-        user=current_user
-    )
-    flavor_name = flavor['name'].replace('-', '_')
-    configs = util.load_configs(setting.FLAVOR_MAPPING_DIR)
-    for item in configs:
-        if flavor_name in item.keys():
-            config = item[flavor_name]
-    return utils.make_json_response(
-        200,
-        metadata_api.get_ui_metadata(
-            metadata, config
-        )
-    )
+    return utils.make_json_response(200, ui_metadata, ui_metadata_json)
 
 
 @app.route(
@@ -1450,11 +1686,9 @@ def show_adapter_os_metadata(adapter_id, os_id):
 def list_clusters():
     """List clusters."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        cluster_api.list_clusters(
-            user=current_user, **data
-        )
+    return _make_list_response(
+        functools.partial(cluster_api.list_clusters, user=current_user),
+        data
     )
 
 
@@ -1647,11 +1881,48 @@ def take_cluster_action(cluster_id):
 def get_cluster_state(cluster_id):
     """Get cluster state."""
     data = _get_request_args()
+    etag = cluster_api.get_cluster_state_tag(cluster_id, user=current_user)
+    resp = utils.make_not_modified_response(etag)
+    if resp is not None:
+        return resp
     return utils.make_json_response(
         200,
         cluster_api.get_cluster_state(
             cluster_id, user=current_user, **data
-        )
+        ),
+        etag=etag
+    )
+
+
+@app.route("/clusters/<int:cluster_id>/progress", methods=['GET'])
+@log_user_action
+@login_required
+@update_user_token
+def get_cluster_progress(cluster_id):
+    """Get states of cluster and all its hosts.
+
+    With since=<version>&wait=<seconds> in request args, the response
+    waits until the state version of the cluster is greater than since.
+    If the states are not modified after the wait, the response is a
+    304 without loading them.
+    """
+    data = _get_request_args(
+        since=_int_converter,
+        wait=_int_converter
+    )
+    for key in ['since', 'wait']:
+        if key in data:
+            data[key] = _get_data(data, key)
+    etag = cluster_api.wait_cluster_state(
+        cluster_id, user=current_user, **data
+    )
+    resp = utils.make_not_modified_response(etag)
+    if resp is not None:
+        return resp
+    return utils.make_json_response(
+        200,
+        cluster_api.get_cluster_progress(cluster_id, user=current_user),
+        etag=etag
     )
 
 
@@ -1729,11 +2000,11 @@ def get_health_report(cluster_id, name):
 def list_cluster_hosts(cluster_id):
     """Get cluster hosts."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        _reformat_host(cluster_api.list_cluster_hosts(
-            cluster_id, user=current_user, **data
-        ))
+    return _make_list_response(
+        functools.partial(
+            cluster_api.list_cluster_hosts, cluster_id, user=current_user
+        ),
+        data, marker_key='clusterhost_id', format_func=_reformat_host
     )
 
 
@@ -1744,11 +2015,11 @@ def list_cluster_hosts(cluster_id):
 def list_clusterhosts():
     """Get cluster hosts."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        _reformat_host(cluster_api.list_clusterhosts(
-            user=current_user, **data
-        ))
+    return _make_list_response(
+        functools.partial(
+            cluster_api.list_clusterhosts, user=current_user
+        ),
+        data, marker_key='clusterhost_id', format_func=_reformat_host
     )
 
 
@@ -2151,11 +2422,9 @@ def update_clusterhost_state_internal(clusterhost_name):
 def list_hosts():
     """List hosts."""
     data = _get_request_args()
-    return utils.make_json_response(
-        200,
-        _reformat_host(host_api.list_hosts(
-            user=current_user, **data
-        ))
+    return _make_list_response(
+        functools.partial(host_api.list_hosts, user=current_user),
+        data, format_func=_reformat_host
     )
 
 
@@ -2597,11 +2866,80 @@ def _get_headers(*keys):
     return headers
 
 
-def _get_response_json(response):
+def _get_proxy_session():
+    """Get the keep-alive http session shared by proxy requests.
+
+    The session is recreated in a forked process so that the pooled
+    connections are not shared with the parent process.
+    """
+    global PROXY_SESSION, PROXY_SESSION_PID
+    with PROXY_SESSION_LOCK:
+        if PROXY_SESSION is None or PROXY_SESSION_PID != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=setting.PROXY_POOL_CONNECTIONS,
+                pool_maxsize=setting.PROXY_POOL_MAXSIZE
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            PROXY_SESSION = session
+            PROXY_SESSION_PID = os.getpid()
+        return PROXY_SESSION
+
+
+def _proxy_request(url, headers, **kwargs):
+    """Forward the request to url and stream back the raw response.
+
+    The body is passed through chunk by chunk as received, without
+    decoding its content encoding, and only its prefix is logged.
+    The upstream connection goes back to the pool only once the body
+    is fully consumed, callers must read or close the response.
+    """
     try:
-        return response.json()
-    except ValueError:
-        return response.text
+        response = _get_proxy_session().request(
+            request.method, '%s/%s' % (setting.PROXY_URL_PREFIX, url),
+            headers=headers, stream=True,
+            timeout=(
+                setting.PROXY_CONNECT_TIMEOUT, setting.PROXY_READ_TIMEOUT
+            ),
+            **kwargs
+        )
+    except requests.exceptions.Timeout as error:
+        raise exception_handler.GatewayTimeout(
+            'proxy %s timeout: %s' % (url, error)
+        )
+    except requests.exceptions.RequestException as error:
+        raise exception_handler.BadGateway(
+            'proxy %s failed: %s' % (url, error)
+        )
+
+    def generate():
+        completed = False
+        try:
+            for index, chunk in enumerate(response.raw.stream(
+                setting.PROXY_CHUNK_SIZE, decode_content=False
+            )):
+                if not index:
+                    logging.debug(
+                        'proxy %s response: %r',
+                        url, chunk[:setting.PROXY_LOG_BODY_SIZE]
+                    )
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                response.raw.release_conn()
+            else:
+                response.close()
+
+    return Response(
+        generate(), response.status_code,
+        headers=[
+            (key, value) for key, value in response.raw.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        ],
+        direct_passthrough=True
+    )
 
 
 @app.route("/proxy/<path:url>", methods=['GET'])
@@ -2616,19 +2954,7 @@ def proxy_get(url):
         'Content-MD5', 'Transfer-Encoding', app.config['AUTH_HEADER_NAME'],
         'Cookie'
     )
-    response = requests.get(
-        '%s/%s' % (setting.PROXY_URL_PREFIX, url),
-        params=_get_request_args(),
-        headers=headers,
-        stream=True
-    )
-    logging.debug(
-        'proxy %s response: %s',
-        url, response.text
-    )
-    return utils.make_json_response(
-        response.status_code, _get_response_json(response)
-    )
+    return _proxy_request(url, headers, params=_get_request_args())
 
 
 @app.route("/proxy/<path:url>", methods=['POST'])
@@ -2643,18 +2969,7 @@ def proxy_post(url):
         'Content-MD5', 'Transfer-Encoding',
         'Cookie'
     )
-    response = requests.post(
-        '%s/%s' % (setting.PROXY_URL_PREFIX, url),
-        data=request.data,
-        headers=headers
-    )
-    logging.debug(
-        'proxy %s response: %s',
-        url, response.text
-    )
-    return utils.make_json_response(
-        response.status_code, _get_response_json(response)
-    )
+    return _proxy_request(url, headers, data=request.data)
 
 
 @app.route("/proxy/<path:url>", methods=['PUT'])
@@ -2669,18 +2984,7 @@ def proxy_put(url):
         'Content-MD5', 'Transfer-Encoding',
         'Cookie'
     )
-    response = requests.put(
-        '%s/%s' % (setting.PROXY_URL_PREFIX, url),
-        data=request.data,
-        headers=headers
-    )
-    logging.debug(
-        'proxy %s response: %s',
-        url, response.text
-    )
-    return utils.make_json_response(
-        response.status_code, _get_response_json(response)
-    )
+    return _proxy_request(url, headers, data=request.data)
 
 
 @app.route("/proxy/<path:url>", methods=['PATCH'])
@@ -2695,18 +2999,7 @@ def proxy_patch(url):
         'Content-MD5', 'Transfer-Encoding',
         'Cookie'
     )
-    response = requests.patch(
-        '%s/%s' % (setting.PROXY_URL_PREFIX, url),
-        data=request.data,
-        headers=headers
-    )
-    logging.debug(
-        'proxy %s response: %s',
-        url, response.text
-    )
-    return utils.make_json_response(
-        response.status_code, _get_response_json(response)
-    )
+    return _proxy_request(url, headers, data=request.data)
 
 
 @app.route("/proxy/<path:url>", methods=['DELETE'])
@@ -2721,26 +3014,173 @@ def proxy_delete(url):
         'Content-MD5', 'Transfer-Encoding',
         'Cookie'
     )
-    response = requests.delete(
-        '%s/%s' % (setting.PROXY_URL_PREFIX, url),
-        headers=headers
-    )
-    logging.debug(
-        'proxy %s response: %s',
-        url, response.text
+    return _proxy_request(url, headers)
+
+
+BATCH_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+
+
+def _check_batch_request(item):
+    if not isinstance(item, dict) or 'path' not in item:
+        raise exception_handler.BadRequest(
+            'batch request %s does not have path' % item
+        )
+    method = item.get('method', 'GET').upper()
+    if method not in BATCH_METHODS:
+        raise exception_handler.BadRequest(
+            'batch request method %s is not supported' % method
+        )
+    if item['path'].split('?')[0].rstrip('/') == '/batch':
+        raise exception_handler.BadRequest('batch request cannot be nested')
+    item['method'] = method
+
+
+def _run_batch_request(item, user):
+    """Dispatch a sub request of a batch to its route handler.
+
+    The sub request runs in its own request and app context with the
+    already authenticated user of the batch request.
+    """
+    method = item['method']
+    path = item['path']
+    builder = EnvironBuilder(
+        path=path, base_url=request.host_url, method=method,
+        data=json.dumps(item['body']) if 'body' in item else None,
+        content_type='application/json',
+        environ_base={'REMOTE_ADDR': request.remote_addr}
     )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    with app.app_context():
+        with app.request_context(environ) as ctx:
+            ctx.user = user
+            response = app.full_dispatch_request()
+            data = response.get_data()
+    try:
+        body = json.loads(data)
+    except ValueError:
+        body = data
+    return {
+        'method': method,
+        'path': path,
+        'status': response.status_code,
+        'body': body
+    }
+
+
+@app.route("/batch", methods=['POST'])
+@log_user_action
+@login_required
+@update_user_token
+def batch():
+    """Run a list of sub requests in one request.
+
+    Each sub request is a dict of method, path and body. In atomic
+    mode they share one database transaction which is rolled back
+    and the remaining sub requests are skipped once one of them
+    fails. In best_effort mode each sub request commits on its own.
+    """
+    data = _get_request_data()
+    mode = data.get('mode', 'atomic')
+    if mode not in ['atomic', 'best_effort']:
+        raise exception_handler.BadRequest(
+            'batch mode %s is not supported' % mode
+        )
+    items = data.get('requests', [])
+    if not isinstance(items, list):
+        raise exception_handler.BadRequest('batch requests is not a list')
+    if len(items) > setting.BATCH_MAX_REQUESTS:
+        raise exception_handler.BadRequest(
+            'batch requests exceed %s' % setting.BATCH_MAX_REQUESTS
+        )
+    for item in items:
+        _check_batch_request(item)
+    user = current_user._get_current_object()
+    responses = []
+    committed = True
+    if mode == 'best_effort':
+        for item in items:
+            responses.append(_run_batch_request(item, user))
+    else:
+        with database.shared_session() as session:
+            for item in items:
+                responses.append(_run_batch_request(item, user))
+                if responses[-1]['status'] >= 400:
+                    session.rollback()
+                    committed = False
+                    break
     return utils.make_json_response(
-        response.status_code, _get_response_json(response)
+        200, {'mode': mode, 'committed': committed, 'responses': responses}
     )
 
 
+def check_setting():
+    """Refuse to serve the api with an unsafe setting."""
+    if not setting.USER_TOKEN_SECRET_KEY:
+        raise Exception(
+            'USER_TOKEN_SECRET_KEY is not set in compass setting'
+        )
+
+
 def init():
     logging.info('init flask')
+    check_setting()
     database.init()
     adapter_api.load_adapters()
     metadata_api.load_metadatas()
 
 
+def warm_up():
+    """Load everything the first requests would otherwise load lazily."""
+    global READY, WARM_UP_TIME
+    start_time = time.time()
+    if not database.ENGINE:
+        database.init()
+    adapter_api.load_adapters()
+    metadata_api.load_metadatas()
+    loading_profiles = db_utils.compile_loading_profiles()
+    app.url_map.update()
+    WARM_UP_TIME = time.time() - start_time
+    READY = True
+    logging.info(
+        'warm up done in %.3f seconds, %s loading profiles compiled',
+        WARM_UP_TIME, loading_profiles
+    )
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except Exception as error:
+        logging.error('failed to warm up')
+        logging.exception(error)
+
+
+def create_app():
+    """Create the app for production wsgi servers.
+
+    Debug is turned off and the app is warmed up before it is returned.
+    When setting.API_WARM_UP_IN_BACKGROUND is set, the warm up runs in
+    a thread instead and requests are answered with 503 until it
+    completes.
+    """
+    global WARMING_UP
+    check_setting()
+    app.debug = False
+    if setting.API_WARM_UP_IN_BACKGROUND:
+        WARMING_UP = True
+        thread = threading.Thread(
+            target=_warm_up_in_background, name='warm_up'
+        )
+        thread.daemon = True
+        thread.start()
+    else:
+        warm_up()
+    return app
+
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
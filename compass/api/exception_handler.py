@@ -76,6 +76,24 @@ class ConflictObject(HTTPException):
         super(ConflictObject, self).__init__(message, 409)
 
 
+class BadGateway(HTTPException):
+    """Define the exception for failures of the proxied server."""
+    def __init__(self, message):
+        super(BadGateway, self).__init__(message, 502)
+
+
+class ServiceUnavailable(HTTPException):
+    """Define the exception for a server not ready to serve."""
+    def __init__(self, message):
+        super(ServiceUnavailable, self).__init__(message, 503)
+
+
+class GatewayTimeout(HTTPException):
+    """Define the exception for timeouts of the proxied server."""
+    def __init__(self, message):
+        super(GatewayTimeout, self).__init__(message, 504)
+
+
 @app.errorhandler(Exception)
 def handle_exception(error):
     if hasattr(error, 'to_dict'):
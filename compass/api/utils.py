@@ -13,19 +13,131 @@
 # limitations under the License.
 
 """Utils for API usage."""
-from flask import make_response
+import gzip
+import hashlib
 import simplejson as json
 
+from cStringIO import StringIO
+from flask import make_response
+from flask import request
+from flask import Response
+from flask import stream_with_context
+
+from compass.utils import setting_wrapper as setting
+
+
+def _dumps(data, data_json=None):
+    """Dump data to compact json, or indented json if pretty is in args.
+
+    data_json is the compact json of data if it is already dumped.
+    """
+    if 'pretty' in request.args:
+        return json.dumps(data, indent=4)
+    if data_json is not None:
+        return data_json
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _gzip(body):
+    buf = StringIO()
+    gzip_file = gzip.GzipFile(
+        mode='wb', fileobj=buf, compresslevel=setting.API_GZIP_LEVEL
+    )
+    try:
+        gzip_file.write(body)
+    finally:
+        gzip_file.close()
+    return buf.getvalue()
+
+
+def _etag_matched(etag):
+    """Check if none match header has the etag of any content coding."""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return bool(
+        set([etag, etag + '-gzip']) & if_none_match.as_set()
+    )
+
 
-def make_json_response(status_code, data):
-    """Wrap json format to the reponse object."""
+def _request_etag(etag):
+    """Get the etag of a resource in the format requested by args."""
+    if 'pretty' in request.args:
+        return etag + '-pretty'
+    return etag
 
-    result = json.dumps(data, indent=4) + '\r\n'
+
+def make_not_modified_response(etag):
+    """Get a 304 response if If-None-Match has etag, or None.
+
+    etag is a tag of the resource state which is cheaper to get than
+    the resource, e.g. from a version column, so a resource which is
+    not modified is not loaded at all. Its 200 response is made by
+    make_json_response with the same etag.
+    """
+    if request.method not in ['GET', 'HEAD']:
+        return None
+    etag = _request_etag(etag)
+    if not _etag_matched(etag):
+        return None
+    resp = make_response('', 304)
+    resp.set_etag(etag)
+    return resp
+
+
+def make_json_response(status_code, data, data_json=None, etag=None):
+    """Wrap json format to the reponse object.
+
+    Successful GET responses get a strong etag, and a 304 response
+    is returned if the etag matches If-None-Match. The etag is the
+    given etag of the resource state, or a hash of the body.
+    Bodies larger than setting.API_GZIP_MIN_SIZE are gzipped if the
+    client accepts gzip. data_json is the compact json of data if it
+    is already dumped.
+    """
+    result = _dumps(data, data_json) + '\r\n'
+    if status_code == 200 and request.method in ['GET', 'HEAD']:
+        if etag is None:
+            etag = hashlib.sha1(result).hexdigest()
+        resp = make_not_modified_response(etag)
+        if resp is not None:
+            return resp
+        etag = _request_etag(etag)
+    else:
+        etag = None
+    compressed = (
+        len(result) >= setting.API_GZIP_MIN_SIZE and
+        request.accept_encodings['gzip']
+    )
+    if compressed:
+        result = _gzip(result)
     resp = make_response(result, status_code)
     resp.headers['Content-type'] = 'application/json'
+    resp.vary.add('Accept-Encoding')
+    if compressed:
+        resp.headers['Content-Encoding'] = 'gzip'
+    if etag:
+        resp.set_etag(etag + '-gzip' if compressed else etag)
     return resp
 
 
+def make_json_stream_response(status_code, items):
+    """Wrap an iterable of items to a chunked json array response."""
+
+    def generate():
+        yield '['
+        for index, item in enumerate(items):
+            if index:
+                yield ','
+            yield '\r\n' + _dumps(item)
+        yield '\r\n]\r\n'
+
+    return Response(
+        stream_with_context(generate()), status_code,
+        mimetype='application/json'
+    )
+
+
 def make_csv_response(status_code, csv_data, fname):
     """Wrap CSV format to the reponse object."""
     fname = '.'.join((fname, 'csv'))
@@ -23,9 +23,11 @@ import requests
 class Client(object):
     """compass restful api wrapper"""
 
-    def __init__(self, url, headers=None, proxies=None, stream=None):
+    def __init__(self, url, headers=None, proxies=None, stream=None,
+                 page_size=None):
         logging.info('create api client %s', url)
         self.url_ = url
+        self.page_size_ = page_size
         self.session_ = requests.Session()
 
         if headers:
@@ -65,7 +67,26 @@ class Client(object):
         else:
             resp = self.session_.get(url)
 
-        return self._get_response(resp)
+        status_code, response_object = self._get_response(resp)
+        while (
+            status_code == 200 and isinstance(response_object, list) and
+            'next' in resp.links
+        ):
+            next_url = resp.links['next']['url']
+            logging.debug('get next page %s', next_url)
+            resp = self.session_.get(next_url)
+            next_status_code, next_object = self._get_response(resp)
+            if next_status_code != 200:
+                return next_status_code, next_object
+            response_object.extend(next_object)
+
+        return status_code, response_object
+
+    def _list(self, req_url, data=None):
+        """get all items of a list api, page by page if page_size is set."""
+        if self.page_size_:
+            data = dict(data or {}, limit=self.page_size_)
+        return self._get(req_url, data=data)
 
     def _post(self, req_url, data=None):
         url = '%s%s' % (self.url_, req_url)
@@ -197,7 +218,7 @@ class Client(object):
         if location:
             data['location'] = location
 
-        return self._get('/switches/%s/machines' % switch_id, data=data)
+        return self._list('/switches/%s/machines' % switch_id, data=data)
 
     def get_switch_machine(self, switch_id, machine_id):
         return self._get('/switches/%s/machines/%s' % (switch_id, machine_id))
@@ -228,7 +249,7 @@ class Client(object):
         if os_id:
             data['os_id'] = os_id
 
-        return self._get('/switches/%s/machines-hosts' % switch_id, data=data)
+        return self._list('/switches/%s/machines-hosts' % switch_id, data=data)
 
     def add_switch_machine(self, switch_id, mac=None, port=None,
                            vlans=None, ipmi_credentials=None,
@@ -329,7 +350,7 @@ class Client(object):
         if location:
             data['location'] = location
 
-        return self._get('/switch-machines', data=data)
+        return self._list('/switch-machines', data=data)
 
     def list_switchmachines_hosts(self, switch_ip_int=None, port=None,
                                   vlans=None, mac=None, tag=None,
@@ -360,7 +381,7 @@ class Client(object):
         if os_id:
             data['os_id'] = os_id
 
-        return self._get('/switches-machines-hosts', data=data)
+        return self._list('/switches-machines-hosts', data=data)
 
     def show_switchmachine(self, switchmachine_id):
         return self._get('/switch-machines/%s' % switchmachine_id)
@@ -403,7 +424,7 @@ class Client(object):
         if location:
             data['location'] = location
 
-        return self._get('/machines', data=data)
+        return self._list('/machines', data=data)
 
     def get_machine(self, machine_id):
         data = {}
@@ -458,7 +479,7 @@ class Client(object):
         if name:
             data['name'] = name
 
-        return self._get('/subnets', data=data)
+        return self._list('/subnets', data=data)
 
     def get_subnet(self, subnet_id):
         return self._get('/subnets/%s' % subnet_id)
@@ -538,7 +559,7 @@ class Client(object):
         if adapter_id:
             data['adapter_id'] = adapter_id
 
-        return self._get('/clusters', data=data)
+        return self._list('/clusters', data=data)
 
     def get_cluster(self, cluster_id):
         return self._get('/clusters/%s' % cluster_id)
@@ -650,11 +671,19 @@ class Client(object):
     def get_cluster_state(self, cluster_id):
         return self._get('/clusters/%s/state' % cluster_id)
 
+    def get_cluster_progress(self, cluster_id, since=None, wait=None):
+        data = {}
+        if since is not None:
+            data['since'] = since
+        if wait:
+            data['wait'] = wait
+        return self._get('/clusters/%s/progress' % cluster_id, data=data)
+
     def list_cluster_hosts(self, cluster_id):
-        return self._get('/clusters/%s/hosts' % cluster_id)
+        return self._list('/clusters/%s/hosts' % cluster_id)
 
     def list_clusterhosts(self):
-        return self._get('/clusterhosts')
+        return self._list('/clusterhosts')
 
     def get_cluster_host(self, cluster_id, host_id):
         return self._get('/clusters/%s/hosts/%s' % (cluster_id, host_id))
@@ -868,7 +897,7 @@ class Client(object):
         if mac:
             data['mac'] = mac
 
-        return self._get('/hosts', data=data)
+        return self._list('/hosts', data=data)
 
     def get_host(self, host_id):
         return self._get('/hosts/%s' % host_id)
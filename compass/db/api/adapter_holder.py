@@ -79,7 +79,7 @@ def _filter_adapters(adapter_config, filter_name, filter_value):
 
 
 @utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_ADAPTERS
 )
@@ -115,7 +115,7 @@ def get_adapter_internal(session, adapter_id):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_ADAPTERS
 )
@@ -16,15 +16,23 @@
 """Cluster database operations."""
 import copy
 import functools
+import hashlib
 import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 from compass.db.api import database
+from compass.db.api import host as host_api
 from compass.db.api import metadata_holder as metadata_api
 from compass.db.api import permission
 from compass.db.api import user as user_api
 from compass.db.api import utils
 from compass.db import exception
 from compass.db import models
+from compass.utils import setting_wrapper as setting
 from compass.utils import util
 
 
@@ -92,6 +100,12 @@ RESP_CLUSTERHOST_STATE_FIELDS = [
     'id', 'state', 'percentage', 'message', 'severity',
     'ready', 'created_at', 'updated_at'
 ]
+RESP_PROGRESS_FIELDS = [
+    'version', 'cluster', 'clusterhosts'
+]
+RESP_CLUSTERHOST_PROGRESS_FIELDS = RESP_CLUSTERHOST_STATE_FIELDS + [
+    'clusterhost_id', 'host_id', 'name'
+]
 RESP_REVIEW_FIELDS = [
     'cluster', 'hosts'
 ]
@@ -149,23 +163,49 @@ UPDATED_CLUSTERHOST_LOG_FIELDS = [
     'position', 'partial_line', 'percentage',
     'message', 'severity', 'line_matcher_name'
 ]
+CLUSTER_LOADING_PROFILE = utils.LoadingProfile(
+    models.Cluster,
+    state={},
+    flavor={'flavor_roles': {'role': {}}}
+)
+CLUSTERHOST_LOADING_PROFILE = utils.LoadingProfile(
+    models.ClusterHost,
+    state={},
+    cluster=CLUSTER_LOADING_PROFILE,
+    host=host_api.HOST_LOADING_PROFILE
+)
+CLUSTER_PROGRESS_LOADING_PROFILE = utils.LoadingProfile(
+    models.Cluster,
+    state={},
+    clusterhosts={'state': {}, 'host': {'state': {}}}
+)
+# notified when a session changing cluster state versions commits.
+CLUSTER_STATE_CONDITION = threading.Condition()
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERS
 )
 @utils.wrap_to_dict(RESP_FIELDS)
-def list_clusters(user=None, session=None, **filters):
+def list_clusters(user=None, session=None, fields=None, **filters):
     """List clusters."""
     return utils.list_db_objects(
-        session, models.Cluster, **filters
+        session, models.Cluster,
+        loading_profile=CLUSTER_LOADING_PROFILE, fields=fields, **filters
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERS
 )
@@ -176,7 +216,8 @@ def get_cluster(
 ):
     """Get cluster info."""
     return utils.get_db_object(
-        session, models.Cluster, exception_when_missing, id=cluster_id
+        session, models.Cluster, exception_when_missing,
+        loading_profile=CLUSTER_LOADING_PROFILE, id=cluster_id
     )
 
 
@@ -320,7 +361,6 @@ def del_cluster(
     )
 
     for clusterhost in cluster.clusterhosts:
-        from compass.db.api import host as host_api
         host = clusterhost.host
         host_api.is_host_editable(
             session, host, user, reinstall_os_set=True
@@ -356,7 +396,7 @@ def del_cluster(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTER_CONFIG
 )
@@ -369,7 +409,7 @@ def get_cluster_config(cluster_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTER_CONFIG
 )
@@ -382,7 +422,7 @@ def get_cluster_deployed_config(cluster_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -634,35 +674,52 @@ def _set_clusterhosts(session, cluster, machines):
         )
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_CLUSTERHOST_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_CLUSTERHOST_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOSTS
 )
 @utils.wrap_to_dict(RESP_CLUSTERHOST_FIELDS)
-def list_cluster_hosts(cluster_id, user=None, session=None, **filters):
+def list_cluster_hosts(
+    cluster_id, user=None, session=None, fields=None, **filters
+):
     """Get cluster host info."""
     return utils.list_db_objects(
         session, models.ClusterHost, cluster_id=cluster_id,
+        loading_profile=CLUSTERHOST_LOADING_PROFILE, fields=fields,
         **filters
     )
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_CLUSTERHOST_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_CLUSTERHOST_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOSTS
 )
 @utils.wrap_to_dict(RESP_CLUSTERHOST_FIELDS)
-def list_clusterhosts(user=None, session=None, **filters):
+def list_clusterhosts(user=None, session=None, fields=None, **filters):
     """Get cluster host info."""
     return utils.list_db_objects(
-        session, models.ClusterHost, **filters
+        session, models.ClusterHost,
+        loading_profile=CLUSTERHOST_LOADING_PROFILE, fields=fields,
+        **filters
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOSTS
 )
@@ -675,12 +732,15 @@ def get_cluster_host(
     return utils.get_db_object(
         session, models.ClusterHost,
         exception_when_missing,
+        loading_profile=CLUSTERHOST_LOADING_PROFILE,
         cluster_id=cluster_id, host_id=host_id
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOSTS
 )
@@ -693,6 +753,7 @@ def get_clusterhost(
     return utils.get_db_object(
         session, models.ClusterHost,
         exception_when_missing,
+        loading_profile=CLUSTERHOST_LOADING_PROFILE,
         clusterhost_id=clusterhost_id
     )
 
@@ -1003,7 +1064,7 @@ def del_clusterhost(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOST_CONFIG
 )
@@ -1020,7 +1081,7 @@ def get_cluster_host_config(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOST_CONFIG
 )
@@ -1036,7 +1097,7 @@ def get_cluster_host_deployed_config(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOST_CONFIG
 )
@@ -1049,7 +1110,7 @@ def get_clusterhost_config(clusterhost_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_CLUSTERHOST_CONFIG
 )
@@ -1595,6 +1656,7 @@ def deploy_cluster(
     is_cluster_editable(session, cluster, user)
     is_cluster_validated(session, cluster)
     utils.update_db_object(session, cluster.state, state='INITIALIZED')
+    bump_cluster_state_versions(session, [cluster.id])
     for clusterhost in clusterhosts:
         host = clusterhost.host
         if host_api.is_host_editable(
@@ -1626,7 +1688,7 @@ def deploy_cluster(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_CLUSTER_STATE
 )
@@ -1639,7 +1701,7 @@ def get_cluster_state(cluster_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_CLUSTERHOST_STATE
 )
@@ -1655,7 +1717,7 @@ def get_cluster_host_state(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_CLUSTERHOST_STATE
 )
@@ -1675,7 +1737,7 @@ def get_cluster_host_self_state(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_CLUSTERHOST_STATE
 )
@@ -1691,7 +1753,7 @@ def get_clusterhost_state(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_CLUSTERHOST_STATE
 )
@@ -1706,6 +1768,139 @@ def get_clusterhost_self_state(
     ).state
 
 
+def bump_cluster_state_versions(session, cluster_ids):
+    """Bump the state version of clusters to wake up their watchers."""
+    cluster_ids = list(set(cluster_ids))
+    if not cluster_ids:
+        return
+    session.query(models.ClusterState).filter(
+        models.ClusterState.id.in_(cluster_ids)
+    ).update(
+        {models.ClusterState.version: models.ClusterState.version + 1},
+        synchronize_session=False
+    )
+    session.info['cluster_state_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_cluster_state_watchers(session):
+    if session.info.pop('cluster_state_changed', False):
+        with CLUSTER_STATE_CONDITION:
+            CLUSTER_STATE_CONDITION.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cluster_state_changed(session):
+    session.info.pop('cluster_state_changed', None)
+
+
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_GET_CLUSTER_STATE
+)
+def _get_cluster_state_version(cluster_id, user=None, session=None):
+    cluster_state = session.query(
+        models.ClusterState.version
+    ).filter_by(id=cluster_id).first()
+    if not cluster_state:
+        raise exception.RecordNotExists(
+            'Cannot find the state of cluster %s' % cluster_id
+        )
+    return cluster_state.version or 0
+
+
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_GET_CLUSTER_STATE
+)
+def get_cluster_state_tag(cluster_id, user=None, session=None):
+    """Get a tag which changes with the states of a cluster.
+
+    It is read from the version and updated_at of the cluster state
+    without loading the states, so it can validate the responses of
+    cluster state and progress before they are built.
+    """
+    cluster_state = session.query(
+        models.ClusterState.version, models.ClusterState.updated_at
+    ).filter_by(id=cluster_id).first()
+    if not cluster_state:
+        raise exception.RecordNotExists(
+            'Cannot find the state of cluster %s' % cluster_id
+        )
+    return hashlib.sha1('%s %s' % (
+        cluster_state.version or 0, cluster_state.updated_at
+    )).hexdigest()
+
+
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_GET_CLUSTER_STATE
+)
+@utils.wrap_to_dict(
+    RESP_PROGRESS_FIELDS,
+    cluster=RESP_STATE_FIELDS,
+    clusterhosts=RESP_CLUSTERHOST_PROGRESS_FIELDS
+)
+def _get_cluster_progress(cluster_id, user=None, session=None):
+    cluster = utils.get_db_object(
+        session, models.Cluster,
+        loading_profile=CLUSTER_PROGRESS_LOADING_PROFILE, id=cluster_id
+    )
+    clusterhosts = []
+    for clusterhost in cluster.clusterhosts:
+        clusterhost_state = clusterhost.state_dict()
+        clusterhost_state.update({
+            'clusterhost_id': clusterhost.clusterhost_id,
+            'host_id': clusterhost.host_id,
+            'name': clusterhost.name
+        })
+        clusterhosts.append(clusterhost_state)
+    return {
+        'version': cluster.state.version or 0,
+        'cluster': cluster.state_dict(),
+        'clusterhosts': clusterhosts
+    }
+
+
+@utils.supported_filters(optional_support_keys=['since', 'wait'])
+def wait_cluster_state(
+    cluster_id, since=None, wait=0, user=None, **kwargs
+):
+    """Wait for the states of a cluster to change and get their tag.
+
+    If since is given, wait up to wait seconds until the state version
+    of the cluster is greater than since. No session is held while
+    waiting. Returns get_cluster_state_tag.
+    """
+    if since is not None and wait:
+        deadline = time.time() + min(
+            wait, setting.CLUSTER_PROGRESS_MAX_WAIT
+        )
+        while _get_cluster_state_version(cluster_id, user=user) <= since:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            # versions bumped by other processes are found by polling.
+            with CLUSTER_STATE_CONDITION:
+                CLUSTER_STATE_CONDITION.wait(
+                    min(timeout, setting.CLUSTER_PROGRESS_POLL_INTERVAL)
+                )
+    return get_cluster_state_tag(cluster_id, user=user)
+
+
+@utils.supported_filters(optional_support_keys=['since', 'wait'])
+def get_cluster_progress(
+    cluster_id, since=None, wait=0, user=None, **kwargs
+):
+    """Get the states of a cluster and all its clusterhosts.
+
+    If since is given, wait up to wait seconds until the state version
+    of the cluster is greater than since, see wait_cluster_state.
+    """
+    wait_cluster_state(cluster_id, since=since, wait=wait, user=user)
+    return _get_cluster_progress(cluster_id, user=user)
+
+
 @utils.supported_filters(
     optional_support_keys=UPDATED_CLUSTERHOST_STATE_FIELDS,
     ignore_support_keys=IGNORE_FIELDS
@@ -1724,6 +1919,7 @@ def update_cluster_host_state(
         cluster_id=cluster_id, host_id=host_id
     )
     utils.update_db_object(session, clusterhost.state, **kwargs)
+    bump_cluster_state_versions(session, [clusterhost.cluster_id])
     return clusterhost.state_dict()
 
 
@@ -1790,6 +1986,7 @@ def update_cluster_host_state_internal(
         if not clusterhost.state.ready:
             logging.info('%s state ready is set to False', cluster.name)
             utils.update_db_object(session, cluster.state, ready=False)
+        bump_cluster_state_versions(session, [cluster.id])
         status = '%s state is updated' % clusterhost.name
     else:
         from compass.tasks import client as celery_client
@@ -1828,6 +2025,7 @@ def update_clusterhost_state(
         clusterhost_id=clusterhost_id
     )
     utils.update_db_object(session, clusterhost.state, **kwargs)
+    bump_cluster_state_versions(session, [clusterhost.cluster_id])
     return clusterhost.state_dict()
 
 
@@ -1893,6 +2091,7 @@ def update_clusterhost_state_internal(
         if not clusterhost.state.ready:
             logging.info('%s state ready is to False', cluster.name)
             utils.update_db_object(session, cluster.state, ready=False)
+        bump_cluster_state_versions(session, [cluster.id])
         status = '%s state is updated' % clusterhost.name
     else:
         from compass.tasks import client as celery_client
@@ -1930,6 +2129,7 @@ def update_cluster_state(
         session, models.Cluster, id=cluster_id
     )
     utils.update_db_object(session, cluster.state, **kwargs)
+    bump_cluster_state_versions(session, [cluster.id])
     return cluster.state_dict()
 
 
@@ -1978,6 +2178,7 @@ def update_cluster_state_internal(
                 utils.update_db_object(
                     session, clusterhost.state, ready=False
                 )
+        bump_cluster_state_versions(session, [cluster.id])
         status = '%s state is updated' % cluster.name
     else:
         from compass.tasks import client as celery_client
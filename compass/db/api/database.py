@@ -16,11 +16,17 @@
 import functools
 import logging
 import netaddr
+import os
+import threading
+import time
 
 from contextlib import contextmanager
 from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import OperationalError
+from sqlalchemy import inspect
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
@@ -29,6 +35,8 @@ from sqlalchemy.pool import SingletonThreadPool
 from sqlalchemy.pool import StaticPool
 from threading import local
 
+from compass.db.api import reference_cache
+from compass.db.api import statement_stats
 from compass.db import exception
 from compass.db import models
 from compass.utils import logsetting
@@ -36,9 +44,17 @@ from compass.utils import setting_wrapper as setting
 
 
 ENGINE = None
+READ_ENGINE = None
+ENGINE_PID = None
 SESSION = sessionmaker(autocommit=False, autoflush=False)
+READ_SESSION = sessionmaker(autocommit=False, autoflush=False)
 SCOPED_SESSION = None
+READ_SCOPED_SESSION = None
 SESSION_HOLDER = local()
+POOL_METRICS = {}
+# pools replaced after fork are kept referenced, so the connections
+# they share with the parent process are never closed by the child.
+FORKED_POOLS = []
 
 POOL_MAPPING = {
     'instant': NullPool,
@@ -48,15 +64,141 @@ POOL_MAPPING = {
 }
 
 
-def init(database_url=None):
+class PoolMetrics(object):
+    """Connection pool counters of an engine."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.disconnects = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record_wait(self, wait_time):
+        with self.lock:
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def increase(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self, pool):
+        metrics = {
+            'pool': pool.__class__.__name__,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'checked_out': self.checkouts - self.checkins,
+            'disconnects': self.disconnects,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time
+        }
+        if isinstance(pool, QueuePool):
+            metrics['size'] = pool.size()
+            metrics['overflow'] = pool.overflow()
+        return metrics
+
+
+def _get_metered_pool_class(poolclass, metrics):
+    """Get a subclass of poolclass recording checkout wait time."""
+    def _do_get(self):
+        start = time.time()
+        try:
+            return poolclass._do_get(self)
+        finally:
+            metrics.record_wait(time.time() - start)
+
+    return type(
+        'Metered%s' % poolclass.__name__, (poolclass,),
+        {'_do_get': _do_get}
+    )
+
+
+def _listen_pool_events(engine, metrics, pre_ping=False):
+    """Count pool events and drop connections not usable any more.
+
+    A connection made before fork, or failing a ping if pre_ping,
+    is invalidated on checkout and the pool retries with a new one.
+    """
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        metrics.increase('connects')
+
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increase('checkouts')
+        pid = os.getpid()
+        if connection_record.info.get('pid', pid) != pid:
+            connection_record.connection = None
+            connection_proxy.connection = None
+            metrics.increase('disconnects')
+            raise DisconnectionError(
+                'connection belongs to process %s' % (
+                    connection_record.info['pid']
+                )
+            )
+        if pre_ping:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            except Exception as error:
+                metrics.increase('disconnects')
+                raise DisconnectionError(str(error))
+            finally:
+                cursor.close()
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        metrics.increase('checkins')
+
+
+def _create_engine(name, database_url):
+    metrics = PoolMetrics()
+    POOL_METRICS[name] = metrics
+    poolclass = POOL_MAPPING[setting.SQLALCHEMY_DATABASE_POOL_TYPE]
+    if poolclass is StaticPool:
+        # the static connection is often an in memory database.
+        pool_recycle = -1
+    else:
+        pool_recycle = setting.SQLALCHEMY_DATABASE_POOL_RECYCLE
+    engine = create_engine(
+        database_url, convert_unicode=True,
+        poolclass=_get_metered_pool_class(poolclass, metrics),
+        pool_recycle=pool_recycle
+    )
+    # connections of NullPool are always new.
+    _listen_pool_events(
+        engine, metrics,
+        pre_ping=(
+            setting.SQLALCHEMY_DATABASE_POOL_PRE_PING and
+            poolclass is not NullPool
+        )
+    )
+    if setting.SQL_STATS_ENABLED:
+        statement_stats.instrument(engine)
+    return engine
+
+
+def init(database_url=None, replica_url=None):
     """Initialize database.
 
     :param database_url: string, database url.
+    :param replica_url: string, url of the replica read only
+                        sessions use. The database is used if not set.
     """
     global ENGINE
+    global READ_ENGINE
+    global ENGINE_PID
     global SCOPED_SESSION
+    global READ_SCOPED_SESSION
     if not database_url:
         database_url = setting.SQLALCHEMY_DATABASE_URI
+    if not replica_url:
+        replica_url = setting.SQLALCHEMY_DATABASE_REPLICA_URI
     logging.info('init database %s', database_url)
     root_logger = logging.getLogger()
     fine_debug = root_logger.isEnabledFor(logsetting.LOGLEVEL_MAPPING['fine'])
@@ -69,16 +211,50 @@ def init(database_url=None):
         logging.getLogger('sqlalchemy.dialects').setLevel(logging.INFO)
         logging.getLogger('sqlalchemy.pool').setLevel(logging.INFO)
         logging.getLogger('sqlalchemy.orm').setLevel(logging.INFO)
-    poolclass = POOL_MAPPING[setting.SQLALCHEMY_DATABASE_POOL_TYPE]
-    ENGINE = create_engine(
-        database_url, convert_unicode=True,
-        poolclass=poolclass
-    )
+    POOL_METRICS.clear()
+    reference_cache.invalidate_all()
+    ENGINE = _create_engine('default', database_url)
+    if replica_url:
+        logging.info('init database replica %s', replica_url)
+        READ_ENGINE = _create_engine('replica', replica_url)
+    else:
+        READ_ENGINE = ENGINE
+    ENGINE_PID = os.getpid()
     SESSION.configure(bind=ENGINE)
+    READ_SESSION.configure(bind=READ_ENGINE)
     SCOPED_SESSION = scoped_session(SESSION)
+    READ_SCOPED_SESSION = scoped_session(READ_SESSION)
     models.BASE.query = SCOPED_SESSION.query_property()
 
 
+def _recreate_pools_after_fork():
+    """Give a forked process its own connection pools."""
+    global ENGINE_PID
+    pid = os.getpid()
+    if ENGINE_PID == pid:
+        return
+    logging.info(
+        'recreate database pools of process %s forked from %s',
+        pid, ENGINE_PID
+    )
+    engines = [ENGINE]
+    if READ_ENGINE is not ENGINE:
+        engines.append(READ_ENGINE)
+    for engine in engines:
+        FORKED_POOLS.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+    ENGINE_PID = pid
+
+
+def pool_metrics():
+    """Get connection pool metrics of each engine."""
+    metrics = {}
+    engines = {'default': ENGINE, 'replica': READ_ENGINE}
+    for name, engine_metrics in POOL_METRICS.items():
+        metrics[name] = engine_metrics.to_dict(engines[name].pool)
+    return metrics
+
+
 def in_session():
     """check if in database session scope."""
     if hasattr(SESSION_HOLDER, 'session'):
@@ -88,25 +264,38 @@ def in_session():
 
 
 @contextmanager
-def session():
+def session(read_only=False):
     """database session scope.
 
        .. note::
        To operate database, it should be called in database session.
+       A read only session runs on the replica if there is one, and
+       is rolled back instead of flushed and committed.
     """
     if not ENGINE:
         init()
+    _recreate_pools_after_fork()
 
     if hasattr(SESSION_HOLDER, 'session'):
         logging.error('we are already in session')
         raise exception.DatabaseException('session already exist')
+    elif read_only:
+        session_registry = READ_SCOPED_SESSION
     else:
-        new_session = SCOPED_SESSION()
-        setattr(SESSION_HOLDER, 'session', new_session)
+        session_registry = SCOPED_SESSION
+    new_session = session_registry()
+    setattr(SESSION_HOLDER, 'session', new_session)
+    if setting.SQL_STATS_ENABLED:
+        stats = statement_stats.start('session %s' % id(new_session))
+    else:
+        stats = None
 
     try:
         yield new_session
-        new_session.commit()
+        if read_only:
+            new_session.rollback()
+        else:
+            new_session.commit()
     except Exception as error:
         new_session.rollback()
         logging.error('failed to commit session')
@@ -129,8 +318,27 @@ def session():
             raise exception.DatabaseException(str(error))
     finally:
         new_session.close()
-        SCOPED_SESSION.remove()
+        session_registry.remove()
         delattr(SESSION_HOLDER, 'session')
+        if stats:
+            statement_stats.stop(stats)
+
+
+@contextmanager
+def shared_session():
+    """database session shared by the functions run in the block.
+
+       .. note::
+       Functions decorated by run_in_session join the session instead
+       of opening their own, so all their changes are committed or
+       rolled back together when the block exits.
+    """
+    with session() as my_session:
+        SESSION_HOLDER.shared = True
+        try:
+            yield my_session
+        finally:
+            SESSION_HOLDER.shared = False
 
 
 def current_session():
@@ -149,14 +357,17 @@ def current_session():
             raise exception.DatabaseException(str(error))
 
 
-def run_in_session():
+def run_in_session(read_only=False):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             if 'session' in kwargs.keys():
                 return func(*args, **kwargs)
+            elif getattr(SESSION_HOLDER, 'shared', False):
+                kwargs['session'] = SESSION_HOLDER.session
+                return func(*args, **kwargs)
             else:
-                with session() as my_session:
+                with session(read_only=read_only) as my_session:
                     kwargs['session'] = my_session
                     return func(*args, **kwargs)
         return wrapper
@@ -336,3 +547,42 @@ def create_db(session):
 def drop_db():
     """Drop database."""
     models.BASE.metadata.drop_all(bind=ENGINE)
+
+
+def add_missing_column(table, column_name):
+    """Add a column of table to the database if it is missing.
+
+    The column is added nullable without default. A unique or indexed
+    column gets an index. Returns if the column was added.
+    """
+    column = table.columns[column_name]
+    existing_column_names = [
+        existing_column['name']
+        for existing_column in inspect(ENGINE).get_columns(table.name)
+    ]
+    if column.name in existing_column_names:
+        return False
+    logging.info('add column %s to table %s', column.name, table.name)
+    with ENGINE.begin() as connection:
+        connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+            table.name, column.name,
+            column.type.compile(dialect=ENGINE.dialect)
+        ))
+        if column.unique or column.index:
+            connection.execute('CREATE %sINDEX ix_%s_%s ON %s (%s)' % (
+                'UNIQUE ' if column.unique else '',
+                table.name, column.name, table.name, column.name
+            ))
+    return True
+
+
+def add_missing_table(table):
+    """Create a table and its indexes in the database if it is missing.
+
+    Returns if the table was created.
+    """
+    if table.name in inspect(ENGINE).get_table_names():
+        return False
+    logging.info('add table %s', table.name)
+    table.create(bind=ENGINE)
+    return True
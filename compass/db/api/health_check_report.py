@@ -95,7 +95,7 @@ def set_error(cluster_id, report={}, session=None,
         return reports
 
 
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HEALTH_REPORT
 )
@@ -107,7 +107,7 @@ def list_health_reports(user, cluster_id, session=None):
     )
 
 
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_HEALTH_REPORT
 )
@@ -18,6 +18,7 @@ import logging
 import netaddr
 
 from compass.db.api import database
+from compass.db.api import machine as machine_api
 from compass.db.api import metadata_holder as metadata_api
 from compass.db.api import permission
 from compass.db.api import user as user_api
@@ -34,7 +35,7 @@ SUPPORTED_NETOWORK_FIELDS = [
 RESP_FIELDS = [
     'id', 'name', 'hostname', 'os_name', 'os_id', 'owner', 'mac',
     'switch_ip', 'port', 'switches', 'os_installer', 'ip',
-    'reinstall_os', 'os_installed', 'tag', 'location', 'networks',
+    'reinstall_os', 'os_installed', 'tag', 'location', 'networks', 'state',
     'created_at', 'updated_at'
 ]
 RESP_CLUSTER_FIELDS = [
@@ -102,24 +103,53 @@ UPDATED_LOG_FIELDS = [
     'position', 'partial_line', 'percentage',
     'message', 'severity', 'line_matcher_name'
 ]
+HOST_LOADING_PROFILE = utils.LoadingProfile(
+    models.Host,
+    machine=machine_api.MACHINE_LOADING_PROFILE,
+    state={},
+    host_networks={'subnet': {}},
+    os_installer={},
+    clusterhosts={
+        'cluster': {'state': {}, 'flavor': {'flavor_roles': {'role': {}}}}
+    }
+)
+MACHINE_OR_HOST_LOADING_PROFILE = utils.LoadingProfile(
+    models.Machine,
+    host=HOST_LOADING_PROFILE.without('machine'),
+    **machine_api.MACHINE_LOADING_PROFILE.tree
+)
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOSTS
 )
 @utils.wrap_to_dict(RESP_FIELDS)
-def list_hosts(user=None, session=None, **filters):
+def list_hosts(user=None, session=None, fields=None, **filters):
     """List hosts."""
+    query_plan = utils.plan_query(
+        models.Host, filters,
+        mac=machine_api.machine_mac_query_condition(models.Host.id)
+    )
     return utils.list_db_objects(
-        session, models.Host, **filters
+        session, models.Host, conditions=query_plan.conditions,
+        loading_profile=HOST_LOADING_PROFILE, fields=fields,
+        **query_plan.filters
     )
 
 
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_MACHINE_HOST_FIELDS)
-@database.run_in_session()
+    optional_support_keys=(
+        SUPPORTED_MACHINE_HOST_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOSTS
 )
@@ -133,8 +163,13 @@ def list_hosts(user=None, session=None, **filters):
 @utils.wrap_to_dict(RESP_FIELDS)
 def list_machines_or_hosts(user=None, session=None, **filters):
     """List hosts."""
+    query_plan = utils.plan_query(
+        models.Machine, filters, mac=machine_api.mac_query_condition
+    )
     machines = utils.list_db_objects(
-        session, models.Machine, **filters
+        session, models.Machine, conditions=query_plan.conditions,
+        loading_profile=MACHINE_OR_HOST_LOADING_PROFILE,
+        **query_plan.filters
     )
     machines_or_hosts = []
     for machine in machines:
@@ -146,8 +181,10 @@ def list_machines_or_hosts(user=None, session=None, **filters):
     return machines_or_hosts
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOSTS
 )
@@ -159,12 +196,15 @@ def get_host(
     """get host info."""
     return utils.get_db_object(
         session, models.Host,
-        exception_when_missing, id=host_id
+        exception_when_missing,
+        loading_profile=HOST_LOADING_PROFILE, id=host_id
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOSTS
 )
@@ -176,7 +216,8 @@ def get_machine_or_host(
     """get host info."""
     machine = utils.get_db_object(
         session, models.Machine,
-        exception_when_missing, id=host_id
+        exception_when_missing,
+        loading_profile=MACHINE_OR_HOST_LOADING_PROFILE, id=host_id
     )
     if not machine:
         return None
@@ -188,7 +229,7 @@ def get_machine_or_host(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_CLUSTERS
 )
@@ -305,10 +346,41 @@ def update_host(host_id, user=None, session=None, **kwargs):
     permission.PERMISSION_UPDATE_HOST
 )
 def update_hosts(data=[], user=None, session=None):
-    hosts = []
-    for host_data in data:
-        hosts.append(_update_host(session, user, **host_data))
-    return hosts
+    """Update hosts in batch."""
+    host_updates = [_check_host_update(**host_data) for host_data in data]
+    hosts = utils.get_db_objects_by_keys(
+        session, models.Host, ['id'],
+        [(host_id,) for host_id, _ in host_updates]
+    )
+    updates = []
+    for host_id, values in host_updates:
+        host = hosts.get((host_id,))
+        if not host:
+            raise exception.RecordNotExists(
+                'Cannot find the record in table Host: %s' % {
+                    'id': host_id
+                }
+            )
+        is_host_editable(
+            session, host, user,
+            reinstall_os_set=values.get('reinstall_os', False)
+        )
+        updates.append((host, values))
+    return _update_hosts(session, updates)
+
+
+@utils.supported_filters(
+    optional_support_keys=UPDATED_FIELDS,
+    ignore_support_keys=IGNORE_FIELDS
+)
+@utils.input_validates(name=utils.check_name)
+def _check_host_update(host_id=None, **kwargs):
+    return host_id, kwargs
+
+
+@utils.wrap_to_dict(RESP_FIELDS)
+def _update_hosts(session, updates):
+    return utils.bulk_update_db_objects(session, updates)
 
 
 @utils.supported_filters([])
@@ -365,7 +437,7 @@ def del_host(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_CONFIG
 )
@@ -378,7 +450,7 @@ def get_host_config(host_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_CONFIG
 )
@@ -507,7 +579,7 @@ def del_host_config(host_id, user=None, session=None):
 @utils.supported_filters(
     optional_support_keys=SUPPORTED_NETOWORK_FIELDS
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_NETWORKS
 )
@@ -523,7 +595,7 @@ def list_host_networks(host_id, user=None, session=None, **filters):
 @utils.supported_filters(
     optional_support_keys=SUPPORTED_NETOWORK_FIELDS
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_NETWORKS
 )
@@ -536,7 +608,7 @@ def list_hostnetworks(user=None, session=None, **filters):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_NETWORKS
 )
@@ -560,7 +632,7 @@ def get_host_network(
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_HOST_NETWORKS
 )
@@ -620,47 +692,96 @@ def add_host_networks(
     exception_when_existing=False,
     data=[], user=None, session=None
 ):
-    """Create host networks."""
-    hosts = []
+    """Create host networks.
+
+    Hosts and host networks of all data are queried and added in batch.
+    """
+    hosts = utils.get_db_objects_by_keys(
+        session, models.Host, ['id'],
+        [(host_data['host_id'],) for host_data in data]
+    )
+    ip_ints = {}
+    for host_data in data:
+        for network in host_data['networks']:
+            ip_ints[network['ip']] = long(netaddr.IPAddress(network['ip']))
+    # (host id, interface) of each ip, including the ones added below.
+    ip_locations = dict([
+        (ip_int, (host_network.host_id, host_network.interface))
+        for (ip_int,), host_network in utils.get_db_objects_by_keys(
+            session, models.HostNetwork, ['ip_int'],
+            [(ip_int,) for ip_int in ip_ints.values()]
+        ).items()
+    ])
+    host_networks_data = []
+    host_networks_count = []
     failed_hosts = []
     for host_data in data:
         host_id = host_data['host_id']
-        networks = host_data['networks']
-        host_networks = []
-        failed_host_networks = []
-        for network in networks:
-            ip_int = long(netaddr.IPAddress(network['ip']))
-            host_network = utils.get_db_object(
-                session, models.HostNetwork, False,
-                ip_int=ip_int
+        host = hosts.get((host_id,))
+        if not host:
+            raise exception.RecordNotExists(
+                'Cannot find the record in table Host: %s' % {
+                    'id': host_id
+                }
             )
-            if (
-                host_network and not (
-                    host_network.host_id == host_id and
-                    host_network.interface == network['interface']
-                )
-            ):
-                logging.error('ip %s exists in host network %s' % (
-                    network['ip'], host_network.id
+        host_networks_count.append(0)
+        failed_host_networks = []
+        for network in host_data['networks']:
+            ip_int = ip_ints[network['ip']]
+            location = (host_id, network['interface'])
+            if ip_locations.get(ip_int, location) != location:
+                logging.error('ip %s exists in host %s interface %s' % (
+                    network['ip'], ip_locations[ip_int][0],
+                    ip_locations[ip_int][1]
                 ))
                 failed_host_networks.append(network)
             else:
-                host_networks.append(_add_host_network(
-                    session, user, host_id, exception_when_existing,
-                    **network
-                ))
-        if host_networks:
-            hosts.append({'host_id': host_id, 'networks': host_networks})
+                is_host_editable(session, host, user)
+                network_data = _check_host_network_data(**network)
+                network_data['host_id'] = host_id
+                host_networks_data.append(network_data)
+                host_networks_count[-1] += 1
+                ip_locations[ip_int] = location
         if failed_host_networks:
             failed_hosts.append({
                 'host_id': host_id, 'networks': failed_host_networks
             })
+    host_networks = _add_host_networks(
+        session, exception_when_existing, host_networks_data
+    )
+    added_hosts = []
+    for host_data, count in zip(data, host_networks_count):
+        if count:
+            added_hosts.append({
+                'host_id': host_data['host_id'],
+                'networks': host_networks[:count]
+            })
+            host_networks = host_networks[count:]
     return {
-        'hosts': hosts,
+        'hosts': added_hosts,
         'failed_hosts': failed_hosts
     }
 
 
+@utils.supported_filters(
+    ADDED_NETWORK_FIELDS,
+    optional_support_keys=OPTIONAL_ADDED_NETWORK_FIELDS,
+    ignore_support_keys=IGNORE_FIELDS
+)
+@utils.input_validates(
+    ip=utils.check_ip
+)
+def _check_host_network_data(**kwargs):
+    return kwargs
+
+
+@utils.wrap_to_dict(RESP_NETWORK_FIELDS)
+def _add_host_networks(session, exception_when_existing, data):
+    return utils.add_db_objects(
+        session, models.HostNetwork, exception_when_existing, data=data
+    )
+
+
 @utils.wrap_to_dict(RESP_NETWORK_FIELDS)
 def _update_host_network(
     session, user, host_network, **kwargs
@@ -761,7 +882,7 @@ def del_hostnetwork(host_network_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_GET_HOST_STATE
 )
@@ -784,10 +905,14 @@ def get_host_state(host_id, user=None, session=None, **kwargs):
 @utils.wrap_to_dict(RESP_STATE_FIELDS)
 def update_host_state(host_id, user=None, session=None, **kwargs):
     """Update a host state."""
+    from compass.db.api import cluster as cluster_api
     host = utils.get_db_object(
         session, models.Host, id=host_id
     )
     utils.update_db_object(session, host.state, **kwargs)
+    cluster_api.bump_cluster_state_versions(
+        session, [clusterhost.cluster_id for clusterhost in host.clusterhosts]
+    )
     return host.state_dict()
 
 
@@ -805,6 +930,7 @@ def update_host_state_internal(
     user=None, session=None, **kwargs
 ):
     """Update a host state."""
+    from compass.db.api import cluster as cluster_api
     if isinstance(hostname, (int, long)):
         host = utils.get_db_object(
             session, models.Host, id=hostname
@@ -849,6 +975,10 @@ def update_host_state_internal(
                 utils.update_db_object(
                     session, clusterhost.cluster.state, ready=False
                 )
+        cluster_api.bump_cluster_state_versions(
+            session,
+            [clusterhost.cluster_id for clusterhost in host.clusterhosts]
+        )
         status = '%s state is updated' % host.name
     else:
         from compass.tasks import client as celery_client
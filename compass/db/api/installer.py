@@ -26,15 +26,14 @@ from compass.utils import util
 
 
 def _add_installers(session, model, configs, exception_when_existing=True):
-    installers = []
-    for config in configs:
-        installers.append(utils.add_db_object(
-            session, model,
-            exception_when_existing, config['INSTANCE_NAME'],
-            name=config['NAME'],
-            settings=config.get('SETTINGS', {})
-        ))
-    return installers
+    return utils.add_db_objects(
+        session, model, exception_when_existing,
+        data=[{
+            'alias': config['INSTANCE_NAME'],
+            'name': config['NAME'],
+            'settings': config.get('SETTINGS', {})
+        } for config in configs]
+    )
 
 
 def add_os_installers_internal(session, exception_when_existing=True):
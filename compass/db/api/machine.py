@@ -15,6 +15,8 @@
 """Switch database operations."""
 import logging
 
+from sqlalchemy import select
+
 from compass.db.api import database
 from compass.db.api import permission
 from compass.db.api import user as user_api
@@ -41,10 +43,39 @@ RESP_FIELDS = [
 RESP_DEPLOY_FIELDS = [
     'status', 'machine'
 ]
+MACHINE_LOADING_PROFILE = utils.LoadingProfile(
+    models.Machine,
+    switch_machines={'switch': {}}
+)
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+def mac_query_condition(col_attr, mac_filter):
+    """Translate a mac filter of machines into sql on the mac int."""
+    return utils.mac_condition(
+        models.Machine._mac, models.Machine.mac_int, mac_filter
+    ), None
+
+
+def machine_mac_query_condition(machine_id_attr):
+    """Get the mac filter translator of a table referring to machines.
+
+    The machines matching the mac filter are selected by the indexed
+    mac int and the rows are matched by machine_id_attr.
+    """
+    def translator(col_attr, mac_filter):
+        condition, _ = mac_query_condition(col_attr, mac_filter)
+        if condition is None:
+            return None, None
+        return machine_id_attr.in_(
+            select([models.Machine.id]).where(condition)
+        ), None
+    return translator
+
+
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_MACHINES
 )
@@ -56,27 +87,44 @@ def get_machine(
     """get field dict of a machine."""
     return utils.get_db_object(
         session, models.Machine,
-        exception_when_missing, id=machine_id
+        exception_when_missing,
+        loading_profile=MACHINE_LOADING_PROFILE, id=machine_id
     )
 
 
-@utils.supported_filters(
-    optional_support_keys=SUPPORTED_FIELDS
-)
-@database.run_in_session()
-@user_api.check_user_permission_in_session(
-    permission.PERMISSION_LIST_MACHINES
-)
 @utils.output_filters(
     tag=utils.general_filter_callback,
     location=utils.general_filter_callback
 )
 @utils.wrap_to_dict(RESP_FIELDS)
+def _filter_machines(session, machines, **filters):
+    return machines
+
+
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_LIST_MACHINES
+)
 def list_machines(user=None, session=None, **filters):
     """List machines."""
-    return utils.list_db_objects(
-        session, models.Machine, **filters
+    query_plan = utils.plan_query(
+        models.Machine, filters, mac=mac_query_condition
+    )
+    machines = utils.list_db_objects(
+        session, models.Machine,
+        conditions=query_plan.conditions,
+        loading_profile=MACHINE_LOADING_PROFILE, **query_plan.filters
     )
+    return _filter_machines(
+        session, machines, fields=query_plan.fields,
+        **query_plan.output_filters
+    )[:query_plan.limit]
 
 
 @utils.wrap_to_dict(RESP_FIELDS)
@@ -219,3 +267,26 @@ def reset_machine(
         'status': 'reset %s action sent' % machine.mac,
         'machine': machine
     }
+
+
+@database.run_in_session()
+def migrate_machine_macs(session=None):
+    """Convert the macs of the machines added before mac_int existed.
+
+    The mac_int column and its unique index are created if missing,
+    then the macs are normalized and converted in chunks.
+    """
+    database.add_missing_column(models.Machine.__table__, 'mac_int')
+    converted = 0
+    while True:
+        machines = session.query(models.Machine).filter(
+            models.Machine.mac_int.is_(None)
+        ).limit(setting.MACHINE_MAC_MIGRATION_CHUNK_SIZE).all()
+        if not machines:
+            break
+        for machine in machines:
+            machine.mac = machine.mac
+        session.flush()
+        converted += len(machines)
+        logging.info('converted macs of %s machines', converted)
+    return converted
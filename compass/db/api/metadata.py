@@ -30,22 +30,21 @@ from compass.utils import util
 
 
 def _add_field_internal(session, model, configs):
-    fields = []
+    fields_data = []
     for config in configs:
         if not isinstance(config, dict):
             raise exception.InvalidParameter(
                 'config %s is not dict' % config
             )
-        fields.append(utils.add_db_object(
-            session, model, False,
-            config['NAME'],
-            field_type=config.get('FIELD_TYPE', basestring),
-            display_type=config.get('DISPLAY_TYPE', 'text'),
-            validator=config.get('VALIDATOR', None),
-            js_validator=config.get('JS_VALIDATOR', None),
-            description=config.get('DESCRIPTION', None)
-        ))
-    return fields
+        fields_data.append({
+            'field': config['NAME'],
+            'field_type': config.get('FIELD_TYPE', basestring),
+            'display_type': config.get('DISPLAY_TYPE', 'text'),
+            'validator': config.get('VALIDATOR', None),
+            'js_validator': config.get('JS_VALIDATOR', None),
+            'description': config.get('DESCRIPTION', None)
+        })
+    return utils.upsert_db_objects(session, model, data=fields_data)
 
 
 def add_os_field_internal(session):
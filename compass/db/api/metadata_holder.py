@@ -14,10 +14,12 @@
 
 """Metadata related object holder."""
 import logging
+import simplejson as json
 
 from compass.db.api import database
 from compass.db.api import metadata as metadata_api
 from compass.db.api import permission
+from compass.db.api import reference_cache
 from compass.db.api import user as user_api
 from compass.db.api import utils
 from compass.db import exception
@@ -39,12 +41,15 @@ def load_metadatas(session):
     load_os_metadatas_internal(session)
     load_package_metadatas_internal(session)
     load_flavor_metadatas_internal(session)
+    load_ui_metadatas_internal(session)
 
 
 def load_os_metadatas_internal(session):
     global OS_METADATA_MAPPING
+    global OS_METADATA_VERSION
     logging.info('load os metadatas into memory')
     OS_METADATA_MAPPING = metadata_api.get_os_metadatas_internal(session)
+    OS_METADATA_VERSION += 1
 
 
 def load_package_metadatas_internal(session):
@@ -57,15 +62,40 @@ def load_package_metadatas_internal(session):
 
 def load_flavor_metadatas_internal(session):
     global FLAVOR_METADATA_MAPPING
+    global FLAVOR_METADATA_VERSION
     logging.info('load flavor metadatas into memory')
     FLAVOR_METADATA_MAPPING = (
         metadata_api.get_flavor_metadatas_internal(session)
     )
+    FLAVOR_METADATA_VERSION += 1
+
+
+def load_ui_metadatas_internal(session):
+    """Build ui metadata snapshots of all oses and flavors."""
+    logging.info('load ui metadatas into memory')
+    UI_METADATA_CONFIGS.clear()
+    for os_id in OS_METADATA_MAPPING.keys():
+        try:
+            get_os_ui_metadata_internal(session, os_id)
+        except Exception as error:
+            logging.exception(error)
+    for flavor_id in FLAVOR_METADATA_MAPPING.keys():
+        try:
+            get_flavor_ui_metadata_internal(session, flavor_id)
+        except Exception as error:
+            logging.exception(error)
 
 
 OS_METADATA_MAPPING = {}
 PACKAGE_METADATA_MAPPING = {}
 FLAVOR_METADATA_MAPPING = {}
+OS_METADATA_VERSION = 0
+FLAVOR_METADATA_VERSION = 0
+# ui metadata snapshots of each os or flavor id, as
+# (metadata version, ui metadata, compact json of ui metadata).
+OS_UI_METADATA_SNAPSHOTS = {}
+FLAVOR_UI_METADATA_SNAPSHOTS = {}
+UI_METADATA_CONFIGS = {}
 
 
 def _validate_config(
@@ -155,7 +185,7 @@ def get_package_metadata_internal(session, adapter_id):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -180,7 +210,7 @@ def get_flavor_metadata_internal(session, flavor_id):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -192,7 +222,7 @@ def get_flavor_metadata(flavor_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -205,7 +235,7 @@ def list_flavors(user=None, session=None, **filters):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -231,7 +261,7 @@ def get_os_metadata_internal(session, os_id):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
@@ -259,6 +289,87 @@ def get_ui_metadata(metadata, config):
     return result_config
 
 
+def _get_ui_metadata_configs(config_dir):
+    config_dir = str(config_dir)
+    if config_dir not in UI_METADATA_CONFIGS:
+        UI_METADATA_CONFIGS[config_dir] = util.load_configs(config_dir)
+    return UI_METADATA_CONFIGS[config_dir]
+
+
+def _get_ui_metadata_snapshot(snapshots, id, version, build_ui_metadata):
+    snapshot = snapshots.get(id)
+    if not snapshot or snapshot[0] != version:
+        ui_metadata = build_ui_metadata()
+        snapshot = (
+            version, ui_metadata,
+            json.dumps(ui_metadata, separators=(',', ':'))
+        )
+        snapshots[id] = snapshot
+    return snapshot[1], snapshot[2]
+
+
+def get_os_ui_metadata_internal(session, os_id):
+    """Get (ui metadata, its compact json) of an os from its snapshot."""
+    def build_ui_metadata():
+        configs = _get_ui_metadata_configs(setting.OS_MAPPING_DIR)
+        return get_ui_metadata(
+            get_os_metadata_internal(session, os_id),
+            configs[0]['OS_CONFIG_MAPPING']
+        )
+
+    return _get_ui_metadata_snapshot(
+        OS_UI_METADATA_SNAPSHOTS, os_id, OS_METADATA_VERSION,
+        build_ui_metadata
+    )
+
+
+def get_flavor_ui_metadata_internal(session, flavor_id):
+    """Get (ui metadata, its compact json) of a flavor from its snapshot."""
+    def build_ui_metadata():
+        flavor = reference_cache.ADAPTER_FLAVOR_CACHE.get(
+            session, id=flavor_id
+        )
+        flavor_name = flavor['name'].replace('-', '_')
+        config = None
+        for item in _get_ui_metadata_configs(setting.FLAVOR_MAPPING_DIR):
+            if flavor_name in item.keys():
+                config = item[flavor_name]
+        if not config:
+            raise exception.RecordNotExists(
+                'ui metadata mapping of flavor %s does not exist' % (
+                    flavor['name']
+                )
+            )
+        return get_ui_metadata(
+            get_flavor_metadata_internal(session, flavor_id), config
+        )
+
+    return _get_ui_metadata_snapshot(
+        FLAVOR_UI_METADATA_SNAPSHOTS, flavor_id, FLAVOR_METADATA_VERSION,
+        build_ui_metadata
+    )
+
+
+@utils.supported_filters([])
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_LIST_METADATAS
+)
+def get_os_ui_metadata(os_id, user=None, session=None, **kwargs):
+    """Get (ui metadata, its compact json) of an os."""
+    return get_os_ui_metadata_internal(session, os_id)
+
+
+@utils.supported_filters([])
+@database.run_in_session(read_only=True)
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_LIST_METADATAS
+)
+def get_flavor_ui_metadata(flavor_id, user=None, session=None, **kwargs):
+    """Get (ui metadata, its compact json) of a flavor."""
+    return get_flavor_ui_metadata_internal(session, flavor_id)
+
+
 def _get_data(metadata, config, result_data):
     data_dict = {}
     for key, config_value in config.items():
@@ -286,7 +397,7 @@ def _get_data(metadata, config, result_data):
 
 
 @utils.supported_filters([])
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_METADATAS
 )
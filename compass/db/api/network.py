@@ -45,8 +45,13 @@ def _check_subnet(subnet):
             'subnet %s format unrecognized' % subnet)
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SUBNETS
 )
@@ -58,8 +63,10 @@ def list_subnets(user=None, session=None, **filters):
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SUBNETS
 )
@@ -0,0 +1,326 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process local read-through cache of small reference tables.
+
+Rows are cached as dicts of their column values. The cache of a
+model is invalidated when a session changing its rows commits or
+rolls back, and cached rows expire after setting.REFERENCE_CACHE_TTL
+seconds to bound staleness against other processes. The permission
+names of each user are cached as a frozenset validated by the
+permission version column of the user, and valid user tokens are
+cached with their user.
+"""
+import collections
+import copy
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from compass.db.api import utils
+from compass.db import exception
+from compass.db import models
+from compass.utils import setting_wrapper as setting
+
+
+CACHES = {}
+
+
+class ReferenceCache(object):
+    """LRU cache of the rows of a model.
+
+    Rows are looked up by no key (the first row), the primary key or
+    one of unique_keys, as get_db_object would find them.
+    """
+
+    def __init__(self, model, unique_keys=[]):
+        self.model = model
+        self.lookup_keys = set([
+            (),
+            tuple(sorted([
+                column.key for column in model.__mapper__.primary_key
+            ]))
+        ])
+        for keys in unique_keys:
+            self.lookup_keys.add(tuple(sorted(keys)))
+        self.lock = threading.Lock()
+        self.rows = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _to_row(self, db_object):
+        return dict([
+            (key, getattr(db_object, key))
+            for key in self.model.__mapper__.columns.keys()
+        ])
+
+    def get(self, session, exception_when_missing=True, **filters):
+        """Get the column values of a row as a dict."""
+        keys = tuple(sorted(filters.keys()))
+        if keys not in self.lookup_keys:
+            raise exception.InvalidParameter(
+                '%s are not cached keys of table %s' % (
+                    list(keys), self.model.__name__
+                )
+            )
+        cache_key = (keys, tuple([filters[key] for key in keys]))
+        now = time.time()
+        with self.lock:
+            cached = self.rows.pop(cache_key, None)
+            if cached and cached[0] > now:
+                self.rows[cache_key] = cached
+                self.hits += 1
+                row = cached[1]
+            else:
+                self.misses += 1
+                row = None
+                cached = None
+        if not cached:
+            db_object = utils.get_db_object(
+                session, self.model, False, **filters
+            )
+            if db_object:
+                row = self._to_row(db_object)
+            with self.lock:
+                self.rows[cache_key] = (
+                    now + setting.REFERENCE_CACHE_TTL, row
+                )
+                while len(self.rows) > setting.REFERENCE_CACHE_SIZE:
+                    self.rows.popitem(last=False)
+                    self.evictions += 1
+        if row:
+            return copy.deepcopy(row)
+        if not exception_when_missing:
+            return None
+        raise exception.RecordNotExists(
+            'Cannot find the record in table %s: %s' % (
+                self.model.__name__, filters
+            )
+        )
+
+    def invalidate(self):
+        with self.lock:
+            self.rows.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.rows),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class PermissionSetCache(object):
+    """TTL cache of the permission names of each user.
+
+    The permission version column of a user is bumped in the
+    transaction which changes the permissions of the user. A cached set
+    is only used while it is not expired and was loaded at the version
+    read from the database, so changes made by any process are seen.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.permissions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, session, user_id):
+        """Get the permission version of a user from the database."""
+        return session.query(
+            models.User.permission_version
+        ).filter_by(id=user_id).scalar() or 0
+
+    def get(self, session, user_id, version):
+        """Get the frozenset of permission names of a user at version."""
+        now = time.time()
+        with self.lock:
+            cached = self.permissions.get(user_id)
+            if cached and cached[0] > now and cached[1] == version:
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+        permissions = frozenset([
+            name for name, in session.query(
+                models.Permission.name
+            ).join(
+                models.UserPermission,
+                models.UserPermission.permission_id == models.Permission.id
+            ).filter(
+                models.UserPermission.user_id == user_id
+            )
+        ])
+        with self.lock:
+            self.permissions[user_id] = (
+                now + setting.USER_PERMISSION_CACHE_TTL,
+                version, permissions
+            )
+        return permissions
+
+    def bump(self, session, user_id):
+        """Bump the permission version of a user in the session."""
+        session.query(models.User).filter_by(id=user_id).update(
+            {
+                models.User.permission_version: func.coalesce(
+                    models.User.permission_version, 0
+                ) + 1
+            },
+            synchronize_session=False
+        )
+
+    def invalidate(self):
+        with self.lock:
+            self.permissions.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.permissions),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class UserTokenCache(object):
+    """LRU cache of the user dict and expire timestamp of tokens.
+
+    Entries are dropped after setting.USER_TOKEN_CACHE_TTL seconds so
+    a token cleaned by another process, e.g. by a logout handled by
+    another api worker, is not used for longer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        """Get (user dict, expire timestamp) of a token."""
+        now = time.time()
+        with self.lock:
+            cached = self.tokens.pop(token, None)
+            if not cached or cached[0] <= now:
+                self.misses += 1
+                return None
+            self.tokens[token] = cached
+            self.hits += 1
+            return copy.deepcopy(cached[1]), cached[2]
+
+    def set(self, token, user_dict, expire_timestamp):
+        with self.lock:
+            self.tokens.pop(token, None)
+            self.tokens[token] = (
+                time.time() + setting.USER_TOKEN_CACHE_TTL,
+                copy.deepcopy(user_dict), expire_timestamp
+            )
+            while len(self.tokens) > setting.USER_TOKEN_CACHE_SIZE:
+                self.tokens.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, token):
+        with self.lock:
+            self.tokens.pop(token, None)
+
+    def discard_user(self, user_id):
+        """Drop all the cached tokens of a user."""
+        with self.lock:
+            for token, (_, user_dict, _) in self.tokens.items():
+                if user_dict['id'] == user_id:
+                    del self.tokens[token]
+
+    def invalidate(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.tokens),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+def register(model, unique_keys=[]):
+    """Register the reference cache of model."""
+    CACHES[model] = ReferenceCache(model, unique_keys)
+    return CACHES[model]
+
+
+def cache_stats():
+    """Get hit and miss counters of each reference cache."""
+    stats = dict([
+        (model.__name__, cache.stats())
+        for model, cache in CACHES.items()
+    ])
+    stats['user_permissions'] = PERMISSION_SET_CACHE.stats()
+    stats['user_tokens'] = USER_TOKEN_CACHE.stats()
+    return stats
+
+
+def invalidate_all():
+    for cache in CACHES.values():
+        cache.invalidate()
+    PERMISSION_SET_CACHE.invalidate()
+    USER_TOKEN_CACHE.invalidate()
+
+
+def _get_changed_models(session):
+    return session.info.setdefault('reference_cache_changed_models', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_models(session, flush_context):
+    changed_models = _get_changed_models(session)
+    for objects in [session.new, session.dirty, session.deleted]:
+        for db_object in objects:
+            if db_object.__class__ in CACHES:
+                changed_models.add(db_object.__class__)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _record_bulk_changed_models(session, query, query_context, result):
+    for column_description in query.column_descriptions:
+        if column_description['type'] in CACHES:
+            _get_changed_models(session).add(column_description['type'])
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_changed_models(session):
+    changed_models = session.info.pop('reference_cache_changed_models', ())
+    for model in changed_models:
+        logging.debug('invalidate reference cache of %s', model.__name__)
+        CACHES[model].invalidate()
+
+
+PERMISSION_CACHE = register(models.Permission, [['name']])
+OS_INSTALLER_CACHE = register(models.OSInstaller, [['alias']])
+PACKAGE_INSTALLER_CACHE = register(models.PackageInstaller, [['alias']])
+OS_CACHE = register(models.OperatingSystem, [['name']])
+ADAPTER_ROLE_CACHE = register(models.AdapterRole)
+ADAPTER_FLAVOR_CACHE = register(models.AdapterFlavor)
+PERMISSION_SET_CACHE = PermissionSetCache()
+USER_TOKEN_CACHE = UserTokenCache()
@@ -0,0 +1,143 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sql statement statistics of database sessions, requests and tasks.
+
+Statistics are collected only when setting.SQL_STATS_ENABLED is set
+before the database is initialized. Every statement executed in a
+thread is recorded into all the statistics started in that thread.
+"""
+import logging
+import simplejson as json
+import time
+
+from contextlib import contextmanager
+from sqlalchemy import event
+from threading import local
+
+from compass.utils import setting_wrapper as setting
+
+
+STATS_HOLDER = local()
+
+
+class StatementStats(object):
+    """Statements executed in a session, request or task."""
+
+    def __init__(self, name, log_level=logging.DEBUG):
+        self.name = name
+        self.log_level = log_level
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = []
+        self.signatures = {}
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.signatures[statement] = self.signatures.get(statement, 0) + 1
+        self.slowest.append((duration, statement))
+        self.slowest.sort(reverse=True)
+        del self.slowest[setting.SQL_STATS_SLOWEST_COUNT:]
+
+    def repeated(self):
+        """Get (count, statement) of statements repeated like n+1 queries."""
+        return sorted([
+            (count, statement)
+            for statement, count in self.signatures.items()
+            if count >= setting.SQL_STATS_REPEATED_THRESHOLD
+        ], reverse=True)
+
+    def summary(self):
+        return 'count=%s; time=%.6f; repeated=%s' % (
+            self.count, self.total_time, len(self.repeated())
+        )
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'count': self.count,
+            'time': self.total_time,
+            'slowest': [
+                {'time': duration, 'statement': statement}
+                for duration, statement in self.slowest
+            ],
+            'repeated': [
+                {'count': count, 'statement': statement}
+                for count, statement in self.repeated()
+            ]
+        }
+
+
+def _get_active_stats():
+    if not hasattr(STATS_HOLDER, 'active_stats'):
+        STATS_HOLDER.active_stats = []
+    return STATS_HOLDER.active_stats
+
+
+def start(name, log_level=logging.DEBUG):
+    """Start collecting statement statistics in this thread."""
+    stats = StatementStats(name, log_level)
+    _get_active_stats().append(stats)
+    return stats
+
+
+def stop(stats):
+    """Stop collecting stats and log them as a json line."""
+    active_stats = _get_active_stats()
+    if stats not in active_stats:
+        return stats
+    active_stats.remove(stats)
+    logging.log(
+        stats.log_level, 'sql stats: %s', json.dumps(stats.to_dict())
+    )
+    return stats
+
+
+@contextmanager
+def collect(name, log_level=logging.DEBUG):
+    """Collect statement statistics in the block."""
+    stats = start(name, log_level)
+    try:
+        yield stats
+    finally:
+        stop(stats)
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    # the start time is kept on the execution context of the statement
+    # so a statement which raises leaves nothing behind on the
+    # connection.
+    if context is not None and _get_active_stats():
+        context.statement_start_time = time.time()
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    active_stats = _get_active_stats()
+    start_time = getattr(context, 'statement_start_time', None)
+    if not active_stats or start_time is None:
+        return
+    duration = time.time() - start_time
+    for stats in active_stats:
+        stats.record(statement, duration)
+
+
+def instrument(engine):
+    """Record the statements executed by engine."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
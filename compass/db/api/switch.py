@@ -13,17 +13,29 @@
 # limitations under the License.
 
 """Switch database operations."""
+import collections
+import datetime
 import logging
 import netaddr
 import re
 
+from sqlalchemy import and_
+from sqlalchemy import cast
+from sqlalchemy import false
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import or_
+
 from compass.db.api import database
+from compass.db.api import host as host_api
+from compass.db.api import machine as machine_api
 from compass.db.api import permission
 from compass.db.api import user as user_api
 from compass.db.api import utils
 from compass.db import exception
 from compass.db import models
 from compass.utils import setting_wrapper as setting
+from compass.utils import util
 
 
 SUPPORTED_FIELDS = ['ip_int', 'vendor', 'state']
@@ -54,6 +66,9 @@ UPDATED_FIELDS = [
 PATCHED_FIELDS = ['patched_credentials', 'patched_filters']
 UPDATED_FILTERS_FIELDS = ['put_filters']
 PATCHED_FILTERS_FIELDS = ['patched_filters']
+SYNCED_SWITCH_FIELDS = ['vendor', 'state', 'err_msg']
+# synced switch fields which are cleared when the poll gives None.
+CLEARED_SWITCH_FIELDS = ['err_msg']
 ADDED_MACHINES_FIELDS = ['mac', 'port']
 OPTIONAL_ADDED_MACHINES_FIELDS = [
     'vlans', 'ipmi_credentials', 'tag', 'location'
@@ -82,13 +97,13 @@ RESP_ACTION_FIELDS = [
 RESP_MACHINES_FIELDS = [
     'id', 'switch_id', 'switch_ip', 'machine_id', 'switch_machine_id',
     'port', 'vlans', 'mac',
-    'ipmi_credentials', 'tag', 'location',
+    'ipmi_credentials', 'tag', 'location', 'missing_since',
     'created_at', 'updated_at'
 ]
 RESP_MACHINES_HOSTS_FIELDS = [
     'id', 'switch_id', 'switch_ip', 'machine_id', 'switch_machine_id',
     'port', 'vlans', 'mac',
-    'ipmi_credentials', 'tag', 'location', 'ip',
+    'ipmi_credentials', 'tag', 'location', 'missing_since', 'ip',
     'name', 'hostname', 'os_name', 'os_id', 'owner',
     'os_installer', 'reinstall_os', 'os_installed',
     'clusters', 'created_at', 'updated_at'
@@ -96,6 +111,16 @@ RESP_MACHINES_HOSTS_FIELDS = [
 RESP_CLUSTER_FIELDS = [
     'name', 'id'
 ]
+SWITCH_MACHINE_LOADING_PROFILE = utils.LoadingProfile(
+    models.SwitchMachine,
+    switch={},
+    machine=machine_api.MACHINE_LOADING_PROFILE
+)
+SWITCH_MACHINE_HOST_LOADING_PROFILE = utils.LoadingProfile(
+    models.SwitchMachine,
+    switch={},
+    machine=host_api.MACHINE_OR_HOST_LOADING_PROFILE
+)
 
 
 def _check_filters(switch_filters):
@@ -144,8 +169,10 @@ def get_switch_internal(
         )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCHES
 )
@@ -161,8 +188,10 @@ def get_switch(
     )
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=SUPPORTED_FIELDS + utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCHES
 )
@@ -319,7 +348,7 @@ def patch_switch(switch_id, user=None, session=None, **kwargs):
 
 
 @utils.supported_filters(optional_support_keys=SUPPORTED_FILTER_FIELDS)
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_FILTERS
 )
@@ -332,7 +361,7 @@ def list_switch_filters(user=None, session=None, **filters):
 
 
 @utils.supported_filters()
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_FILTERS
 )
@@ -384,12 +413,188 @@ def patch_switch_filter(switch_id, user=None, session=None, **kwargs):
     return utils.update_db_object(session, switch, **kwargs)
 
 
+@database.run_in_session()
+def update_switch_machines_filtered(session=None):
+    """Recompute the filtered flag of the machines of all the switches."""
+    switches = utils.list_db_objects(session, models.Switch)
+    for switch in switches:
+        switch.update_switch_machines_filtered()
+    return len(switches)
+
+
+def migrate_switch_machines_filtered():
+    """Add the filtered column of switch machines and fill it.
+
+    The column is added empty, and list_switchmachines does not list
+    switch machines with an empty flag, so the flags of all the switch
+    machines are recomputed in the same migration.
+    """
+    database.add_missing_column(models.SwitchMachine.__table__, 'filtered')
+    return update_switch_machines_filtered()
+
+
+def migrate_switch_sync_columns():
+    """Add the columns written by sync_switch_machines if missing.
+
+    Both are nullable and empty until the next poll of each switch.
+    """
+    database.add_missing_column(models.Switch.__table__, 'err_msg')
+    database.add_missing_column(
+        models.SwitchMachine.__table__, 'missing_since'
+    )
+
+
+@database.run_in_session()
+def migrate_switch_machine_ports(session=None):
+    """Split the ports of the switch machines added before port parts.
+
+    The port part table is created if missing, then the ports without
+    parts are split in chunks of switch machine ids. Returns the number
+    of port parts added.
+    """
+    database.add_missing_table(models.SwitchMachinePortPart.__table__)
+    converted = 0
+    last_id = 0
+    while True:
+        switch_machines = session.query(models.SwitchMachine).filter(
+            models.SwitchMachine.switch_machine_id > last_id,
+            models.SwitchMachine.port.isnot(None),
+            ~models.SwitchMachine.port_parts.any()
+        ).order_by(models.SwitchMachine.switch_machine_id).limit(
+            setting.SWITCH_MACHINE_PORT_MIGRATION_CHUNK_SIZE
+        ).all()
+        if not switch_machines:
+            break
+        for switch_machine in switch_machines:
+            switch_machine.split_port(switch_machine.port)
+            converted += len(switch_machine.port_parts)
+        session.flush()
+        last_id = switch_machines[-1].switch_machine_id
+        logging.info('split ports up to switch machine %s', last_id)
+    return converted
+
+
 def get_switch_machines_internal(session, **filters):
     return utils.list_db_objects(
         session, models.SwitchMachine, **filters
     )
 
 
+PORT_NUMBER_FILTER_KEYS = [
+    'resp_lt', 'resp_le', 'resp_gt', 'resp_ge', 'resp_range'
+]
+
+
+def _port_number_conditions(port_number, port_filter):
+    conditions = []
+    if 'resp_lt' in port_filter:
+        conditions.append(port_number < port_filter['resp_lt'])
+    if 'resp_le' in port_filter:
+        conditions.append(port_number <= port_filter['resp_le'])
+    if 'resp_gt' in port_filter:
+        conditions.append(port_number > port_filter['resp_gt'])
+    if 'resp_ge' in port_filter:
+        conditions.append(port_number >= port_filter['resp_ge'])
+    if 'resp_range' in port_filter:
+        conditions.append(or_(*[
+            port_number.between(port_start, port_end)
+            for port_start, port_end in port_filter['resp_range']
+        ]))
+    return conditions
+
+
+PORT_PATTERN_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _is_port_pattern_literal(pattern):
+    """Check if a port filter prefix or suffix matches only itself."""
+    return not PORT_PATTERN_METACHARACTERS.intersection(pattern)
+
+
+def _is_port_parts_filter(port_prefix, port_suffix):
+    """Check if the port number of a filter is a split port number.
+
+    It is when neither the prefix nor the suffix are regex patterns and
+    the number can not run into them, i.e. the prefix does not end and
+    the suffix does not start with a digit.
+    """
+    return (
+        _is_port_pattern_literal(port_prefix + port_suffix) and
+        not port_prefix[-1:].isdigit() and
+        not port_suffix[:1].isdigit()
+    )
+
+
+def _port_query_condition(col_attr, port_filter):
+    """Translate a port filter into sql.
+
+    eq, startswith and endswith map to sql directly. The numeric
+    resp_* predicates are indexed conditions on the port parts when
+    the filter prefix and suffix allow it. Otherwise they compare
+    the number between the port prefix and suffix, cast in sql. The
+    cast is looser than the regex used by _filter_port, so the python
+    check is kept as residual for them.
+    """
+    if not isinstance(port_filter, dict):
+        return utils.model_condition(col_attr, port_filter), None
+    sql_filter = dict([
+        (key, value) for key, value in port_filter.items()
+        if key in utils.SQL_FILTER_KEYS
+    ])
+    conditions = []
+    sql_condition = utils.model_condition(col_attr, sql_filter)
+    if sql_condition is not None:
+        conditions.append(sql_condition)
+    number_keys = [
+        key for key in PORT_NUMBER_FILTER_KEYS if key in port_filter
+    ]
+    if not number_keys:
+        return and_(*conditions) if conditions else None, None
+    port_prefix = port_filter.get('startswith', '')
+    port_suffix = port_filter.get('endswith', '')
+    if _is_port_parts_filter(port_prefix, port_suffix):
+        part_conditions = [
+            models.SwitchMachinePortPart.port_head == port_prefix
+        ]
+        part_conditions.extend(_port_number_conditions(
+            models.SwitchMachinePortPart.port_number, port_filter
+        ))
+        if port_suffix:
+            part_conditions.append(func.substr(
+                models.SwitchMachinePortPart.port_tail, 1, len(port_suffix)
+            ) == port_suffix)
+        conditions.append(
+            models.SwitchMachine.port_parts.any(and_(*part_conditions))
+        )
+        return and_(*conditions), None
+    if _is_port_pattern_literal(port_prefix + port_suffix):
+        port_number = cast(
+            func.substr(
+                col_attr, len(port_prefix) + 1,
+                func.length(col_attr) - len(port_prefix) - len(port_suffix)
+            ),
+            Integer
+        )
+        conditions.extend(_port_number_conditions(port_number, port_filter))
+    if not conditions:
+        return None, port_filter
+    return and_(*conditions), port_filter
+
+
+def _plan_switch_machines_query(filters):
+    query_plan = utils.plan_query(
+        models.SwitchMachine, filters,
+        port=_port_query_condition,
+        mac=machine_api.machine_mac_query_condition(
+            models.SwitchMachine.machine_id
+        )
+    )
+    query_plan.conditions.append(
+        models.SwitchMachine.filtered == false()
+    )
+    return query_plan
+
+
 def _filter_port(port_filter, obj):
     port_prefix = port_filter.get('startswith', '')
     port_suffix = port_filter.get('endswith', '')
@@ -444,11 +649,8 @@ def _filter_vlans(vlan_filter, obj):
     location=utils.general_filter_callback
 )
 @utils.wrap_to_dict(RESP_MACHINES_FIELDS)
-def _filter_switch_machines(session, switch_machines):
-    return [
-        switch_machine for switch_machine in switch_machines
-        if not switch_machine.filtered
-    ]
+def _filter_switch_machines(session, switch_machines, **filters):
+    return switch_machines
 
 
 @utils.output_filters(
@@ -463,102 +665,138 @@ def _filter_switch_machines(session, switch_machines):
     RESP_MACHINES_HOSTS_FIELDS,
     clusters=RESP_CLUSTER_FIELDS
 )
-def _filter_switch_machines_hosts(session, switch_machines):
-    filtered_switch_machines = [
-        switch_machine for switch_machine in switch_machines
-        if not switch_machine.filtered
-    ]
+def _filter_switch_machines_hosts(
+    session, switch_machines, fields=None, **filters
+):
     switch_machines_hosts = []
-    for switch_machine in filtered_switch_machines:
+    for switch_machine in switch_machines:
         machine = switch_machine.machine
         host = machine.host
         if host:
-            switch_machine_host_dict = host.to_dict()
+            switch_machine_host_dict = host.to_dict(fields)
         else:
-            switch_machine_host_dict = machine.to_dict()
+            switch_machine_host_dict = machine.to_dict(fields)
         switch_machine_host_dict.update(
-            switch_machine.to_dict()
+            switch_machine.to_dict(fields)
         )
         switch_machines_hosts.append(switch_machine_host_dict)
     return switch_machines_hosts
 
 
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_MACHINES_FIELDS
+    optional_support_keys=(
+        SUPPORTED_MACHINES_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
 def list_switch_machines(switch_id, user=None, session=None, **filters):
     """Get switch machines."""
+    filters['switch_id'] = switch_id
+    query_plan = _plan_switch_machines_query(filters)
     switch_machines = get_switch_machines_internal(
-        session, switch_id=switch_id, **filters
+        session, conditions=query_plan.conditions,
+        loading_profile=SWITCH_MACHINE_LOADING_PROFILE,
+        **query_plan.filters
     )
-    return _filter_switch_machines(session, switch_machines)
+    return _filter_switch_machines(
+        session, switch_machines, fields=query_plan.fields,
+        **query_plan.output_filters
+    )[:query_plan.limit]
 
 
 @utils.replace_filters(
     ip_int='switch_ip_int'
 )
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_SWITCH_MACHINES_FIELDS
+    optional_support_keys=(
+        SUPPORTED_SWITCH_MACHINES_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
 def list_switchmachines(user=None, session=None, **filters):
     """List switch machines."""
+    query_plan = _plan_switch_machines_query(filters)
     switch_machines = get_switch_machines_internal(
-        session, **filters
+        session, conditions=query_plan.conditions,
+        loading_profile=SWITCH_MACHINE_LOADING_PROFILE,
+        **query_plan.filters
     )
     return _filter_switch_machines(
-        session, switch_machines
-    )
+        session, switch_machines, fields=query_plan.fields,
+        **query_plan.output_filters
+    )[:query_plan.limit]
 
 
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_MACHINES_HOSTS_FIELDS
+    optional_support_keys=(
+        SUPPORTED_MACHINES_HOSTS_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
 def list_switch_machines_hosts(switch_id, user=None, session=None, **filters):
     """Get switch machines hosts."""
+    filters['switch_id'] = switch_id
+    query_plan = _plan_switch_machines_query(filters)
     switch_machines = get_switch_machines_internal(
-        session, switch_id=switch_id, **filters
+        session, conditions=query_plan.conditions,
+        loading_profile=SWITCH_MACHINE_HOST_LOADING_PROFILE,
+        **query_plan.filters
     )
     return _filter_switch_machines_hosts(
-        session, switch_machines
-    )
+        session, switch_machines, fields=query_plan.fields,
+        **query_plan.output_filters
+    )[:query_plan.limit]
 
 
 @utils.replace_filters(
     ip_int='switch_ip_int'
 )
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_SWITCH_MACHINES_HOSTS_FIELDS
+    optional_support_keys=(
+        SUPPORTED_SWITCH_MACHINES_HOSTS_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
 )
-@database.run_in_session()
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
 def list_switchmachines_hosts(user=None, session=None, **filters):
     """List switch machines hosts."""
+    query_plan = _plan_switch_machines_query(filters)
     switch_machines = get_switch_machines_internal(
-        session, **filters
+        session, conditions=query_plan.conditions,
+        loading_profile=SWITCH_MACHINE_HOST_LOADING_PROFILE,
+        **query_plan.filters
     )
-    if 'ip_int' in filters:
-        filtered_switch_machines = switch_machines
-    else:
-        filtered_switch_machines = [
-            switch_machine for switch_machine in switch_machines
-        ]
     return _filter_switch_machines_hosts(
-        session, filtered_switch_machines
-    )
+        session, switch_machines, fields=query_plan.fields,
+        **query_plan.output_filters
+    )[:query_plan.limit]
+
+
+def _split_switch_machine_data(**kwargs):
+    """Split switch machine data into switch machine and machine data."""
+    switch_machine_dict = {}
+    machine_dict = {}
+    for key, value in kwargs.items():
+        if key in ADDED_SWITCH_MACHINES_FIELDS:
+            switch_machine_dict[key] = value
+        else:
+            machine_dict[key] = value
+    return switch_machine_dict, machine_dict
 
 
 @utils.supported_filters(
@@ -567,6 +805,7 @@ def list_switchmachines_hosts(user=None, session=None, **filters):
     ignore_support_keys=IGNORE_FIELDS
 )
 @utils.input_validates(mac=utils.check_mac, vlans=_check_vlans)
+@utils.replace_input_types(mac=utils.normalize_mac)
 @utils.wrap_to_dict(RESP_MACHINES_FIELDS)
 def _add_switch_machine(
     session, user, switch_id, exception_when_existing=True,
@@ -574,13 +813,9 @@ def _add_switch_machine(
 ):
     switch = utils.get_db_object(
         session, models.Switch, id=switch_id)
-    switch_machine_dict = {}
-    machine_dict = {}
-    for key, value in kwargs.items():
-        if key in ADDED_SWITCH_MACHINES_FIELDS:
-            switch_machine_dict[key] = value
-        else:
-            machine_dict[key] = value
+    switch_machine_dict, machine_dict = _split_switch_machine_data(
+        **kwargs
+    )
     machine = utils.add_db_object(
         session, models.Machine, False,
         mac, **machine_dict)
@@ -608,6 +843,46 @@ def add_switch_machine(
     )
 
 
+@utils.supported_filters(
+    ADDED_MACHINES_FIELDS,
+    optional_support_keys=OPTIONAL_ADDED_MACHINES_FIELDS,
+    ignore_support_keys=IGNORE_FIELDS
+)
+@utils.input_validates(mac=utils.check_mac, vlans=_check_vlans)
+@utils.replace_input_types(mac=utils.normalize_mac)
+def _check_switch_machine_data(**kwargs):
+    return kwargs
+
+
+def _add_switch_machine_objects(session, exception_when_existing, data):
+    """Add switch machines of (switch_id, switch machine data) pairs."""
+    machines_data = []
+    switch_machines_data = []
+    for switch_id, machine_data in data:
+        switch_machine_dict, machine_dict = _split_switch_machine_data(
+            **machine_data
+        )
+        machines_data.append(machine_dict)
+        switch_machine_dict['switch_id'] = switch_id
+        switch_machines_data.append(switch_machine_dict)
+    machines = utils.upsert_db_objects(
+        session, models.Machine, data=machines_data
+    )
+    for machine, switch_machine_dict in zip(machines, switch_machines_data):
+        switch_machine_dict['machine_id'] = machine.id
+    return utils.add_db_objects(
+        session, models.SwitchMachine, exception_when_existing,
+        data=switch_machines_data
+    )
+
+
+@utils.wrap_to_dict(RESP_MACHINES_FIELDS)
+def _add_switch_machines(session, exception_when_existing, data):
+    return _add_switch_machine_objects(
+        session, exception_when_existing, data
+    )
+
+
 @database.run_in_session()
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_ADD_SWITCH_MACHINE
@@ -616,90 +891,187 @@ def add_switch_machines(
     exception_when_existing=False,
     data=[], user=None, session=None
 ):
-    """Add switch machines."""
-    switch_machines = []
+    """Add switch machines.
+
+    Switches, machines and switch machines of all data are queried
+    and added in batch.
+    """
     duplicate_switch_machines = []
     failed_switch_machines = []
-    switch_ip_list = []
-    switch_datas = []
+    switch_ip_ints = {}
     for item_data in data:
         switch_ip = item_data['switch_ip']
-        switch_ip_int = long(netaddr.IPAddress(item_data['switch_ip']))
-        if switch_ip not in switch_ip_list:
-            switch_object = utils.get_db_object(
-                session, models.Switch, False,
-                ip_int=switch_ip_int
+        if switch_ip not in switch_ip_ints:
+            switch_ip_ints[switch_ip] = long(netaddr.IPAddress(switch_ip))
+    switches = utils.get_db_objects_by_keys(
+        session, models.Switch, ['ip_int'],
+        [(switch_ip_int,) for switch_ip_int in switch_ip_ints.values()]
+    )
+    for item_data in data:
+        item_data['mac'] = utils.normalize_mac(item_data['mac'])
+    machines = utils.get_db_objects_by_keys(
+        session, models.Machine, ['mac_int'],
+        [(util.parse_mac(item_data['mac']),) for item_data in data]
+    )
+    existing_switch_machines = utils.get_db_objects_by_keys(
+        session, models.SwitchMachine, ['machine_id'],
+        [(machine.id,) for machine in machines.values()]
+    )
+    # (switch id, port) of each mac, including the ones added below.
+    mac_locations = {}
+    for machine in machines.values():
+        switch_machine = existing_switch_machines.get((machine.id,))
+        if switch_machine:
+            mac_locations[machine.mac] = (
+                switch_machine.switch_id, switch_machine.port
+            )
+    # items are reported per switch in the order the switches appear,
+    # after the items of unknown switches.
+    switch_items = collections.OrderedDict()
+    for item_data in data:
+        switch_ip = item_data.pop('switch_ip')
+        switch_object = switches.get((switch_ip_ints[switch_ip],))
+        if not switch_object:
+            logging.error(
+                'switch ip %s is not existed in switch table' % switch_ip
             )
-            if switch_object:
-                switch_ip_list.append(switch_ip)
-                item_data.pop('switch_ip')
-                switch_datas.append({
-                    'switch_id': switch_object.id,
-                    'switch_ip': switch_ip,
-                    'machines': [item_data]
-                })
+            failed_switch_machines.append(item_data)
+            continue
+        switch_items.setdefault(switch_object.id, []).append(item_data)
+    switch_machines_data = []
+    for switch_id, items in switch_items.items():
+        for item_data in items:
+            mac = item_data['mac']
+            location = (switch_id, item_data['port'])
+            if mac not in mac_locations:
+                switch_machines_data.append((
+                    switch_id, _check_switch_machine_data(**item_data)
+                ))
+                mac_locations[mac] = location
+            elif mac_locations[mac] != location:
+                logging.error('machine %s exists in switch %s port %s' % (
+                    mac, mac_locations[mac][0], mac_locations[mac][1]
+                ))
+                failed_switch_machines.append(item_data)
             else:
                 logging.error(
-                    'switch ip %s is not existed in switch table' % switch_ip
+                    'machine %s is dulicate, will not be override' % mac
                 )
-                item_data.pop('switch_ip')
-                failed_switch_machines.append(item_data)
-        else:
-            for item in switch_datas:
-                if switch_ip == item['switch_ip']:
-                    item_data.pop('switch_ip')
-                    item['machines'].append(item_data)
-    for switch_data in switch_datas:
-        switch_id = switch_data['switch_id']
-        machines = switch_data['machines']
-        for machine in machines:
-            mac = machine['mac']
-            machine_object = utils.get_db_object(
-                session, models.Machine, False,
-                mac=mac
-            )
-            if machine_object:
-                switch_machine_object = utils.get_db_object(
-                    session, models.SwitchMachine, False,
-                    machine_id=machine_object.id
-                )
-                if (
-                    switch_machine_object and not(
-                        switch_machine_object.switch_id == switch_id and
-                        switch_machine_object.port == machine['port']
-                    )
-                ):
-                    logging.error('machine %s exists in switch machine %s' % (
-                        machine['mac'], switch_machine_object.switch_machine_id
-                    ))
-                    failed_switch_machines.append(machine)
-                elif (
-                    switch_machine_object and
-                    switch_machine_object.switch_id == switch_id and
-                    switch_machine_object.port == machine['port']
-                ):
-                    logging.error(
-                        'machine %s is dulicate, will not be override' %
-                        machine['mac']
-                    )
-                    duplicate_switch_machines.append(machine)
-                else:
-                    switch_machines.append(_add_switch_machine(
-                        session, user, switch_id, exception_when_existing,
-                        **machine
-                    ))
-            else:
-                switch_machines.append(_add_switch_machine(
-                    session, user, switch_id, exception_when_existing,
-                    **machine
-                ))
+                duplicate_switch_machines.append(item_data)
     return {
-        'switches_machines': switch_machines,
+        'switches_machines': _add_switch_machines(
+            session, exception_when_existing, switch_machines_data
+        ),
         'duplicate_switches_machines': duplicate_switch_machines,
         'fail_switches_machines': failed_switch_machines
     }
 
 
+def _merge_scanned_machines(machines):
+    """Merge the scanned machines of the same mac, keyed by mac."""
+    scanned_machines = {}
+    for machine_data in machines:
+        mac = utils.normalize_mac(machine_data['mac'])
+        vlans = list(machine_data.get('vlans', []))
+        if mac not in scanned_machines:
+            scanned_machines[mac] = {
+                'port': machine_data['port'], 'vlans': vlans
+            }
+        else:
+            scanned_machines[mac]['port'] = machine_data['port']
+            scanned_machines[mac]['vlans'].extend(vlans)
+    return scanned_machines
+
+
+@utils.supported_filters(
+    optional_support_keys=SYNCED_SWITCH_FIELDS + ['machines']
+)
+@database.run_in_session()
+@user_api.check_user_permission_in_session(
+    permission.PERMISSION_UPDATE_SWITCH_MACHINES
+)
+def sync_switch_machines(
+    switch_id, machines=None, user=None, session=None, **kwargs
+):
+    """Reconcile the machines of a switch with the result of a poll.
+
+    machines are the {mac, port, vlans} learned from the switch, None
+    if the poll failed and the switch machines should be kept. The
+    switch machines are queried once and only the differences are
+    written: new macs are added, changed ports and vlans are updated,
+    machines not polled are marked missing and the mark is cleared
+    when they are polled again. kwargs are switch fields written only
+    when changed, so nothing is written when nothing changed. A None
+    err_msg clears the error of a previous poll.
+    Returns the count of each kind of change.
+    """
+    switch = utils.get_db_object(session, models.Switch, id=switch_id)
+    counts = {
+        'switch_updated': 0, 'added': 0, 'updated': 0,
+        'missing': 0, 'reappeared': 0, 'unchanged': 0
+    }
+    switch_changes = dict([
+        (key, value) for key, value in kwargs.items()
+        if (
+            value is not None or key in CLEARED_SWITCH_FIELDS
+        ) and getattr(switch, key) != value
+    ])
+    if switch_changes:
+        utils.update_db_object(session, switch, **switch_changes)
+        counts['switch_updated'] = 1
+    if machines is None:
+        return counts
+    scanned_machines = _merge_scanned_machines(machines)
+    existing_switch_machines = dict([
+        (mac, switch_machine)
+        for switch_machine, mac in session.query(
+            models.SwitchMachine, models.Machine._mac
+        ).join(
+            models.Machine,
+            models.Machine.id == models.SwitchMachine.machine_id
+        ).filter(
+            models.SwitchMachine.switch_id == switch.id
+        )
+    ])
+    now = datetime.datetime.now()
+    updates = []
+    for mac, switch_machine in existing_switch_machines.items():
+        machine_data = scanned_machines.get(mac)
+        if machine_data is None:
+            if switch_machine.missing_since is None:
+                updates.append((switch_machine, {'missing_since': now}))
+                counts['missing'] += 1
+            continue
+        values = {}
+        if switch_machine.port != machine_data['port']:
+            values['port'] = machine_data['port']
+        if sorted(switch_machine.vlans or []) != sorted(
+            machine_data['vlans']
+        ):
+            values['vlans'] = machine_data['vlans']
+        if values:
+            counts['updated'] += 1
+        else:
+            counts['unchanged'] += 1
+        if switch_machine.missing_since is not None:
+            values['missing_since'] = None
+            counts['reappeared'] += 1
+        if values:
+            updates.append((switch_machine, values))
+    if updates:
+        utils.bulk_update_db_objects(session, updates)
+    added_machines = [
+        (switch.id, _check_switch_machine_data(mac=mac, **scanned_data))
+        for mac, scanned_data in scanned_machines.items()
+        if mac not in existing_switch_machines
+    ]
+    if added_machines:
+        _add_switch_machine_objects(session, False, added_machines)
+        counts['added'] = len(added_machines)
+    logging.info('sync machines of %s: %s', switch, counts)
+    return counts
+
+
 @utils.supported_filters(optional_support_keys=['find_machines'])
 @database.run_in_session()
 @user_api.check_user_permission_in_session(
@@ -721,8 +1093,10 @@ def poll_switch_machines(switch_id, user=None, session=None, **kwargs):
     }
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
@@ -735,12 +1109,15 @@ def get_switch_machine(
     return utils.get_db_object(
         session, models.SwitchMachine,
         exception_when_missing,
+        loading_profile=SWITCH_MACHINE_LOADING_PROFILE,
         switch_id=switch_id, machine_id=machine_id
     )
 
 
-@utils.supported_filters([])
-@database.run_in_session()
+@utils.supported_filters(
+    optional_support_keys=utils.PROJECTION_FIELDS
+)
+@database.run_in_session(read_only=True)
 @user_api.check_user_permission_in_session(
     permission.PERMISSION_LIST_SWITCH_MACHINES
 )
@@ -752,7 +1129,9 @@ def get_switchmachine(
     """get field dict of a switch machine."""
     return utils.get_db_object(
         session, models.SwitchMachine,
-        exception_when_missing, switch_machine_id=switch_machine_id
+        exception_when_missing,
+        loading_profile=SWITCH_MACHINE_LOADING_PROFILE,
+        switch_machine_id=switch_machine_id
     )
 
 
@@ -18,8 +18,10 @@ import functools
 import logging
 
 from flask.ext.login import UserMixin
+from itsdangerous import Signer
 
 from compass.db.api import database
+from compass.db.api import reference_cache
 from compass.db.api import utils
 from compass.db import exception
 from compass.db import models
@@ -52,6 +54,10 @@ PERMISSION_RESP_FIELDS = [
 ]
 
 
+def _get_token_signer():
+    return Signer(setting.USER_TOKEN_SECRET_KEY)
+
+
 def _check_email(email):
     if '@' not in email:
         raise exception.InvalidParameter(
@@ -82,6 +88,26 @@ def add_user_internal(
     return user
 
 
+def _get_user_permissions(session, user):
+    """Get the permission names of a user as a frozenset.
+
+    The set loaded into a UserWrapper is reused until the permission
+    version of the user in the database changes.
+    """
+    cache = reference_cache.PERMISSION_SET_CACHE
+    version = cache.version(session, user.id)
+    if (
+        isinstance(user, UserWrapper) and
+        user.permission_version == version
+    ):
+        return user.permissions
+    permissions = cache.get(session, user.id, version)
+    if isinstance(user, UserWrapper):
+        user.permission_version = version
+        user.permissions = permissions
+    return permissions
+
+
 def _check_user_permission(session, user, permission):
     """Check user has permission."""
     if not user:
@@ -90,11 +116,7 @@ def _check_user_permission(session, user, permission):
     if user.is_admin:
         return
 
-    user_permission = utils.get_db_object(
-        session, models.UserPermission,
-        False, user_id=user.id, name=permission.name
-    )
-    if not user_permission:
+    if permission.name not in _get_user_permissions(session, user):
         raise exception.Forbidden(
             'user %s does not have permission %s' % (
                 user.email, permission.name
@@ -163,13 +185,18 @@ def check_user_permission_internal(session, user, permission):
 def _add_user_permissions(session, user, **permission_filters):
     """add permissions to a user."""
     from compass.db.api import permission as permission_api
-    for api_permission in permission_api.list_permissions_internal(
-        session, **permission_filters
-    ):
-        utils.add_db_object(
-            session, models.UserPermission, False,
-            user.id, api_permission.id
-        )
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user.id)
+    if permission_filters.get('id') == []:
+        # model_filter ignores an empty id list, which means all.
+        return
+    utils.upsert_db_objects(
+        session, models.UserPermission,
+        data=[{
+            'user_id': user.id, 'permission_id': api_permission.id
+        } for api_permission in permission_api.list_permissions_internal(
+            session, **permission_filters
+        )]
+    )
 
 
 def _remove_user_permissions(session, user, **permission_filters):
@@ -181,6 +208,7 @@ def _remove_user_permissions(session, user, **permission_filters):
             session, **permission_filters
         )
     ]
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user.id)
     utils.del_db_objects(
         session, models.UserPermission,
         user_id=user.id, permission_id=permission_ids
@@ -189,6 +217,7 @@ def _remove_user_permissions(session, user, **permission_filters):
 
 def _set_user_permissions(session, user, **permission_filters):
     """set permissions to a user."""
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user.id)
     utils.del_db_objects(
         session, models.UserPermission,
         user_id=user.id
@@ -200,7 +229,8 @@ class UserWrapper(UserMixin):
     def __init__(
         self, id, email, crypted_password,
         active=True, is_admin=False,
-        expire_timestamp=None, token='', **kwargs
+        expire_timestamp=None, token='',
+        permissions=frozenset(), permission_version=None, **kwargs
     ):
         self.id = id
         self.email = email
@@ -208,6 +238,8 @@ class UserWrapper(UserMixin):
         self.active = active
         self.is_admin = is_admin
         self.expire_timestamp = expire_timestamp
+        self.permissions = permissions
+        self.permission_version = permission_version
         if not token:
             self.token = self.get_auth_token()
         else:
@@ -219,7 +251,8 @@ class UserWrapper(UserMixin):
             raise exception.Unauthorized('%s password mismatch' % self.email)
 
     def get_auth_token(self):
-        return util.encrypt(self.email)
+        """Get a signed token which can be verified without db lookup."""
+        return _get_token_signer().sign(util.encrypt(self.email))
 
     def is_active(self):
         return self.active
@@ -239,6 +272,16 @@ class UserWrapper(UserMixin):
             self.__class__.__name__, self.email, self.password)
 
 
+def _load_user_permissions(session, user_dict):
+    if user_dict['is_admin']:
+        return
+    version = user_dict.get('permission_version') or 0
+    user_dict['permission_version'] = version
+    user_dict['permissions'] = reference_cache.PERMISSION_SET_CACHE.get(
+        session, user_dict['id'], version
+    )
+
+
 @database.run_in_session()
 def get_user_object(email, session=None, **kwargs):
     user = utils.get_db_object(
@@ -250,28 +293,46 @@ def get_user_object(email, session=None, **kwargs):
         )
     user_dict = user.to_dict()
     user_dict.update(kwargs)
+    _load_user_permissions(session, user_dict)
     return UserWrapper(**user_dict)
 
 
 @database.run_in_session()
 def get_user_object_from_token(token, session=None):
-    expire_timestamp = {
-        'ge': datetime.datetime.now()
-    }
-    user_token = utils.get_db_object(
-        session, models.UserToken, False,
-        token=token, expire_timestamp=expire_timestamp
-    )
-    if not user_token:
+    """Get user object from a token.
+
+    Tokens with bad signature are rejected without db lookup, and
+    valid tokens are cached with their user.
+    """
+    if not _get_token_signer().validate(token):
         raise exception.Unauthorized(
             'invalid user token: %s' % token
         )
-    user_dict = utils.get_db_object(
-        session, models.User, id=user_token.user_id
-    ).to_dict()
+    now = datetime.datetime.now()
+    cached = reference_cache.USER_TOKEN_CACHE.get(token)
+    if cached and cached[1] >= now:
+        user_dict, expire_timestamp = cached
+    else:
+        user_token = session.query(
+            models.UserToken.expire_timestamp, models.User
+        ).join(
+            models.User, models.User.id == models.UserToken.user_id
+        ).filter(
+            models.UserToken.token == token,
+            models.UserToken.expire_timestamp >= now
+        ).first()
+        if not user_token:
+            raise exception.Unauthorized(
+                'invalid user token: %s' % token
+            )
+        expire_timestamp, user = user_token
+        user_dict = user.to_dict()
+        reference_cache.USER_TOKEN_CACHE.set(
+            token, user_dict, expire_timestamp
+        )
     user_dict['token'] = token
-    expire_timestamp = user_token.expire_timestamp
     user_dict['expire_timestamp'] = expire_timestamp
+    _load_user_permissions(session, user_dict)
     return UserWrapper(**user_dict)
 
 
@@ -282,6 +343,7 @@ def record_user_token(
     token, expire_timestamp, user=None, session=None
 ):
     """record user token in database."""
+    reference_cache.USER_TOKEN_CACHE.discard(token)
     user_token = utils.get_db_object(
         session, models.UserToken, False,
         user_id=user.id, token=token
@@ -304,12 +366,51 @@ def record_user_token(
 @utils.wrap_to_dict(RESP_TOKEN_FIELDS)
 def clean_user_token(token, user=None, session=None):
     """clean user token in database."""
+    reference_cache.USER_TOKEN_CACHE.discard(token)
     return utils.del_db_objects(
         session, models.UserToken,
         token=token, user_id=user.id
     )
 
 
+def _clean_expired_user_tokens(session, expire_timestamp, batch_size):
+    token_ids = [
+        token_id for token_id, in session.query(
+            models.UserToken.id
+        ).filter(
+            models.UserToken.expire_timestamp < expire_timestamp
+        ).limit(batch_size)
+    ]
+    if token_ids:
+        session.query(models.UserToken).filter(
+            models.UserToken.id.in_(token_ids)
+        ).delete(synchronize_session=False)
+    return len(token_ids)
+
+
+def clean_expired_user_tokens(batch_size=None):
+    """Delete expired user tokens, one transaction per batch."""
+    batch_size = batch_size or setting.USER_TOKEN_CLEAN_BATCH_SIZE
+    now = datetime.datetime.now()
+    total = 0
+    while True:
+        with database.session() as session:
+            deleted = _clean_expired_user_tokens(session, now, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            break
+    logging.info('%s expired user tokens cleaned', total)
+    return total
+
+
+def migrate_user_permission_version():
+    """Add the permission version column of users if missing.
+
+    Existing users get an empty version which is read as 0.
+    """
+    database.add_missing_column(models.User.__table__, 'permission_version')
+
+
 @utils.supported_filters()
 @check_user_admin_or_owner()
 @database.run_in_session()
@@ -338,7 +439,10 @@ def get_current_user(
 
 
 @utils.supported_filters(
-    optional_support_keys=SUPPORTED_FIELDS
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
 )
 @check_user_admin()
 @database.run_in_session()
@@ -376,6 +480,8 @@ def add_user(
 def del_user(user_id, user=None, session=None, **kwargs):
     """delete a user and return the deleted user object."""
     user = utils.get_db_object(session, models.User, id=user_id)
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user_id)
+    reference_cache.USER_TOKEN_CACHE.discard_user(user_id)
     return utils.del_db_object(session, user)
 
 
@@ -404,6 +510,7 @@ def update_user(user_id, user=None, session=None, **kwargs):
                 user.email, user.email, unsupported_fields
             )
         )
+    reference_cache.USER_TOKEN_CACHE.discard_user(user_id)
     return utils.update_db_object(session, user, **kwargs)
 
 
@@ -446,6 +553,7 @@ def del_permission(user_id, permission_id, user=None, session=None, **kwargs):
         user_id=user_id, permission_id=permission_id,
         **kwargs
     )
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user_id)
     return utils.del_db_object(session, user_permission)
 
 
@@ -461,6 +569,7 @@ def add_permission(
     permission_id=None, user=None, session=None
 ):
     """Add an user permission."""
+    reference_cache.PERMISSION_SET_CACHE.bump(session, user_id)
     return utils.add_db_object(
         session, models.UserPermission, exception_when_missing,
         user_id, permission_id
@@ -13,18 +13,28 @@
 # limitations under the License.
 
 """UserLog database operations."""
+import atexit
+import datetime
 import logging
+import os
+import Queue
+import threading
+import time
 
 from compass.db.api import database
 from compass.db.api import user as user_api
 from compass.db.api import utils
 from compass.db import exception
 from compass.db import models
+from compass.utils import setting_wrapper as setting
+from compass.utils import util
 
 
 SUPPORTED_FIELDS = ['user_email', 'timestamp']
 USER_SUPPORTED_FIELDS = ['timestamp']
-RESP_FIELDS = ['user_id', 'action', 'timestamp']
+RESP_FIELDS = ['id', 'user_id', 'action', 'timestamp']
+WRITER = None
+WRITER_LOCK = threading.Lock()
 
 
 @database.run_in_session()
@@ -35,7 +45,180 @@ def log_user_action(user_id, action, session=None):
     )
 
 
-@utils.supported_filters(optional_support_keys=USER_SUPPORTED_FIELDS)
+class UserLogWriter(object):
+    """Buffered writer of user logs.
+
+    User logs are put into a bounded queue and inserted in bulk by a
+    background thread every flush_interval seconds or batch_size logs.
+    When the queue is full, the log is dropped if overflow_policy is
+    'drop', or the caller waits up to setting.USER_LOG_BLOCK_TIMEOUT
+    seconds for space if it is 'block'.
+    """
+
+    def __init__(
+        self, queue_size=None, batch_size=None,
+        flush_interval=None, overflow_policy=None
+    ):
+        self.queue = Queue.Queue(
+            queue_size or setting.USER_LOG_QUEUE_SIZE
+        )
+        self.batch_size = batch_size or setting.USER_LOG_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval or setting.USER_LOG_FLUSH_INTERVAL
+        )
+        self.overflow_policy = (
+            overflow_policy or setting.USER_LOG_OVERFLOW_POLICY
+        )
+        if self.overflow_policy not in ['drop', 'block']:
+            raise exception.InvalidParameter(
+                'unsupported user log overflow policy %s' % (
+                    self.overflow_policy
+                )
+            )
+        self.pid = os.getpid()
+        self.thread = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name='user_log_writer'
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, user_id, action):
+        user_log = {
+            'user_id': user_id, 'action': action,
+            'timestamp': datetime.datetime.now()
+        }
+        try:
+            if self.overflow_policy == 'block':
+                self.queue.put(
+                    user_log, timeout=setting.USER_LOG_BLOCK_TIMEOUT
+                )
+            else:
+                self.queue.put_nowait(user_log)
+        except Queue.Full:
+            self.dropped += 1
+            logging.warning('user log queue full, drop %s', user_log)
+
+    def _write(self, user_logs):
+        try:
+            with database.session() as session:
+                session.execute(models.UserLog.__table__.insert(), user_logs)
+            self.written += len(user_logs)
+        except Exception as error:
+            self.failed += len(user_logs)
+            logging.exception(error)
+
+    def _run(self):
+        while True:
+            user_logs = []
+            deadline = time.time() + self.flush_interval
+            while len(user_logs) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    user_log = self.queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if user_log is None:
+                    self._write(user_logs)
+                    return
+                user_logs.append(user_log)
+            if user_logs:
+                self._write(user_logs)
+
+    def flush(self):
+        """Write all the queued user logs in the calling thread."""
+        user_logs = []
+        while True:
+            try:
+                user_log = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if user_log is not None:
+                user_logs.append(user_log)
+        for start in range(0, len(user_logs), self.batch_size):
+            self._write(user_logs[start:start + self.batch_size])
+
+    def stop(self):
+        """Stop the background thread and write the remaining logs."""
+        if self.thread and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(setting.USER_LOG_STOP_TIMEOUT)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed
+        }
+
+
+def get_user_log_writer():
+    """Get the user log writer started in this process."""
+    global WRITER
+    with WRITER_LOCK:
+        if not WRITER or WRITER.pid != os.getpid():
+            WRITER = UserLogWriter()
+            WRITER.start()
+        return WRITER
+
+
+def log_user_action_async(user_id, action):
+    """Log user action by the user log writer if USER_LOG_ASYNC is set."""
+    if not setting.USER_LOG_ASYNC:
+        log_user_action(user_id, action)
+        return
+    get_user_log_writer().put(user_id, action)
+
+
+@atexit.register
+def stop_user_log_writer():
+    if WRITER and WRITER.pid == os.getpid():
+        WRITER.stop()
+
+
+def clean_user_logs(retention=None, batch_size=None):
+    """Delete user logs older than retention, one batch a transaction."""
+    retention = retention or setting.USER_LOG_RETENTION
+    batch_size = batch_size or setting.USER_LOG_CLEAN_BATCH_SIZE
+    expire_timestamp = datetime.datetime.now() - datetime.timedelta(
+        seconds=util.parse_time_interval(retention)
+    )
+    total = 0
+    while True:
+        with database.session() as session:
+            user_log_ids = [
+                user_log_id for user_log_id, in session.query(
+                    models.UserLog.id
+                ).filter(
+                    models.UserLog.timestamp < expire_timestamp
+                ).order_by(models.UserLog.timestamp).limit(batch_size)
+            ]
+            if user_log_ids:
+                session.query(models.UserLog).filter(
+                    models.UserLog.id.in_(user_log_ids)
+                ).delete(synchronize_session=False)
+        total += len(user_log_ids)
+        if len(user_log_ids) < batch_size:
+            break
+    logging.info('%s user logs older than %s cleaned', total, retention)
+    return total
+
+
+@utils.supported_filters(
+    optional_support_keys=(
+        USER_SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
 @user_api.check_user_admin_or_owner()
 @database.run_in_session()
 @utils.wrap_to_dict(RESP_FIELDS)
@@ -47,7 +230,12 @@ def list_user_actions(user_id, user=None, session=None, **filters):
     )
 
 
-@utils.supported_filters(optional_support_keys=SUPPORTED_FIELDS)
+@utils.supported_filters(
+    optional_support_keys=(
+        SUPPORTED_FIELDS +
+        utils.PAGINATION_FIELDS + utils.PROJECTION_FIELDS
+    )
+)
 @user_api.check_user_admin()
 @database.run_in_session()
 @utils.wrap_to_dict(RESP_FIELDS)
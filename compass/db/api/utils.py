@@ -14,6 +14,7 @@
 
 """Utils for database usage."""
 
+import datetime
 import functools
 import inspect
 import logging
@@ -23,12 +24,18 @@ import re
 from inspect import isfunction
 from sqlalchemy import and_
 from sqlalchemy import or_
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import subqueryload
 
 from compass.db import exception
 from compass.db import models
 from compass.utils import util
 
 
+LOADING_PROFILES = []
+
+
 def model_query(session, model):
     """model query."""
     if not issubclass(model, models.BASE):
@@ -106,6 +113,131 @@ def model_order_by(query, model, order_by):
     return query.order_by(*order_by_cols)
 
 
+def check_pagination(limit=None, marker=None):
+    if limit is not None and (
+        not isinstance(limit, (int, long)) or limit <= 0
+    ):
+        raise exception.InvalidParameter(
+            'limit %r is not a positive integer' % limit
+        )
+    if marker is not None and not isinstance(marker, (int, long)):
+        raise exception.InvalidParameter(
+            'marker %r is not an integer' % marker
+        )
+
+
+def model_paginate(query, model, limit=None, marker=None):
+    """Page query by the primary key of model.
+
+    Only records after marker are returned, at most limit of them.
+    """
+    primary_key = model.__mapper__.primary_key[0]
+    if marker is not None:
+        query = query.filter(primary_key > marker)
+    query = query.order_by(primary_key)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+class LoadingProfile(object):
+    """Eager loading plan of the relationships a model's to_dict walks.
+
+    tree maps a relationship name of model to the tree of the related
+    model, either a dict or another LoadingProfile. Scalar relationships
+    are joined into the query and collections are loaded by one extra
+    query each. The query options are compiled on first use, when all
+    the backrefs are configured.
+    """
+
+    def __init__(self, model, **tree):
+        self.model = model
+        self.tree = tree
+        self._options = None
+        LOADING_PROFILES.append(self)
+
+    def without(self, *keys):
+        """Copy of the profile without the given relationships."""
+        tree = dict(self.tree)
+        for key in keys:
+            tree.pop(key, None)
+        return LoadingProfile(self.model, **tree)
+
+    @property
+    def options(self):
+        if self._options is None:
+            self._options = _compile_loading_options(
+                self.model.__mapper__, self.tree
+            )
+            logging.debug('%s loading options: %s', self, self._options)
+        return self._options
+
+    def __str__(self):
+        return 'LoadingProfile[%s:%s]' % (
+            self.model.__name__, sorted(self.tree.keys())
+        )
+
+
+def compile_loading_profiles():
+    """Compile the query options of all the loading profiles upfront."""
+    configure_mappers()
+    for profile in LOADING_PROFILES:
+        profile.options
+    return len(LOADING_PROFILES)
+
+
+def _compile_loading_options(mapper, tree, parent_loader=None):
+    options = []
+    for key, sub_tree in sorted(tree.items()):
+        if isinstance(sub_tree, LoadingProfile):
+            sub_tree = sub_tree.tree
+        prop = mapper.get_property(key)
+        if parent_loader is None:
+            if prop.uselist:
+                loader = subqueryload(key)
+            else:
+                loader = joinedload(key)
+        else:
+            if prop.uselist:
+                loader = parent_loader.subqueryload(key)
+            else:
+                loader = parent_loader.joinedload(key)
+        if sub_tree:
+            options.extend(
+                _compile_loading_options(prop.mapper, sub_tree, loader)
+            )
+        else:
+            options.append(loader)
+    return options
+
+
+def _get_column_keys(model, fields):
+    """Get column keys of model if all fields are plain columns."""
+    if not fields:
+        return None
+    columns = model.__mapper__.columns
+    for field in fields:
+        if field.startswith('_') or field not in columns:
+            return None
+    return sorted(fields)
+
+
+def _column_row_to_dict(keys, row):
+    dict_info = {}
+    for key, value in zip(keys, row):
+        if value is not None:
+            if isinstance(value, datetime.datetime):
+                value = util.format_datetime(value)
+            dict_info[key] = value
+    return dict_info
+
+
+def model_load(query, loading_profile=None):
+    if loading_profile is None:
+        return query
+    return query.options(*loading_profile.options)
+
+
 def _model_condition(col_attr, value):
     if isinstance(value, list):
         basetype_values = []
@@ -202,12 +334,17 @@ def _model_condition(col_attr, value):
             return None
         if len(conditions) == 1:
             return conditions[0]
-        return and_(conditions)
+        return and_(*conditions)
     else:
         condition = (col_attr == value)
         return condition
 
 
+def model_condition(col_attr, value):
+    """Get the sql condition of a model_filter style filter value."""
+    return _model_condition(col_attr, value)
+
+
 def model_filter(query, model, **filters):
     for key, value in filters.items():
         if isinstance(key, basestring):
@@ -223,6 +360,190 @@ def model_filter(query, model, **filters):
     return query
 
 
+MAC_INT_FILTER_KEYS = ['eq', 'ne', 'lt', 'le', 'gt', 'ge', 'in', 'notin']
+MAC_STR_FILTER_KEYS = ['endswith', 'like']
+
+
+def _parse_macs(macs):
+    if isinstance(macs, list):
+        return [_parse_macs(mac) for mac in macs]
+    return util.parse_mac(macs, exception.InvalidParameter)
+
+
+def _lower_macs(macs):
+    if isinstance(macs, list):
+        return [_lower_macs(mac) for mac in macs]
+    return str(macs).lower()
+
+
+def mac_condition(mac_attr, mac_int_attr, mac_filter):
+    """Get the sql condition of a mac filter.
+
+    Macs are compared as 48 bit ints, so they may be given in any
+    format util.parse_mac accepts. startswith takes mac prefixes like
+    an OUI and between takes [first, last] macs or a list of them,
+    both are int range conditions. endswith and like match the
+    canonical mac str.
+    """
+    if not isinstance(mac_filter, dict):
+        return model_condition(mac_int_attr, _parse_macs(mac_filter))
+    conditions = []
+    int_filter = dict([
+        (key, _parse_macs(value)) for key, value in mac_filter.items()
+        if key in MAC_INT_FILTER_KEYS
+    ])
+    if int_filter:
+        conditions.append(model_condition(mac_int_attr, int_filter))
+    str_filter = dict([
+        (key, _lower_macs(value)) for key, value in mac_filter.items()
+        if key in MAC_STR_FILTER_KEYS
+    ])
+    if str_filter:
+        conditions.append(model_condition(mac_attr, str_filter))
+    if 'startswith' in mac_filter:
+        mac_prefixes = mac_filter['startswith']
+        if not isinstance(mac_prefixes, list):
+            mac_prefixes = [mac_prefixes]
+        conditions.append(or_(*[
+            mac_int_attr.between(*util.parse_mac_prefix(
+                mac_prefix, exception.InvalidParameter
+            ))
+            for mac_prefix in mac_prefixes
+        ]))
+    if 'between' in mac_filter:
+        mac_ranges = mac_filter['between']
+        if mac_ranges and not isinstance(mac_ranges[0], list):
+            mac_ranges = [mac_ranges]
+        range_conditions = []
+        for mac_range in mac_ranges:
+            if len(mac_range) != 2:
+                raise exception.InvalidParameter(
+                    'mac range %s should be [first, last]' % mac_range
+                )
+            range_condition = _between_condition(mac_int_attr, [
+                None if mac is None else _parse_macs(mac)
+                for mac in mac_range
+            ])
+            if range_condition is not None:
+                range_conditions.append(range_condition)
+        if range_conditions:
+            conditions.append(or_(*range_conditions))
+    conditions = [
+        condition for condition in conditions if condition is not None
+    ]
+    if not conditions:
+        return None
+    return and_(*conditions)
+
+
+PAGINATION_FIELDS = ['limit', 'marker']
+PROJECTION_FIELDS = ['fields']
+SQL_FILTER_KEYS = frozenset([
+    'eq', 'lt', 'gt', 'le', 'ge', 'ne', 'in', 'notin',
+    'startswith', 'endswith', 'like', 'between'
+])
+
+
+class QueryPlan(object):
+    """Plan of how list filters are evaluated.
+
+    conditions are extra sql clauses, filters are passed to model_filter
+    and output_filters are left to be checked in python against the
+    response. pushed_down names the predicates translated into sql.
+    limit is set when the page size can only be applied to the response
+    after the python filters. fields are the response keys requested.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.conditions = []
+        self.filters = {}
+        self.output_filters = {}
+        self.pushed_down = []
+        self.limit = None
+        self.fields = None
+
+    def defer_limit(self):
+        """Apply limit to the response instead of the query.
+
+        The query is still ordered by primary key so that the page cut
+        from the response is the same as the one the query would return.
+        """
+        if 'limit' in self.filters:
+            self.limit = self.filters.pop('limit')
+            if 'marker' not in self.filters:
+                self.filters['order_by'] = [
+                    self.model.__mapper__.primary_key[0]
+                ]
+
+    def __str__(self):
+        return 'QueryPlan[pushed_down=%s, output_filters=%s]' % (
+            self.pushed_down, self.output_filters.keys()
+        )
+
+
+def _get_column_attr(model, key):
+    try:
+        return getattr(model, key)
+    except Exception:
+        return None
+
+
+def plan_query(model, filters, **filter_translators):
+    """Split list filters between sql and python evaluation.
+
+    Plain values and the sql operators understood by model_filter are
+    pushed down to the query. A filter translator is called as
+    translator(col_attr, value) and returns (condition, residual) where
+    condition is a sql clause or None and residual is the value still to
+    be checked in python or None. Anything else falls back to python.
+    marker always goes to the query, limit only when nothing is left to
+    be checked in python.
+    """
+    plan = QueryPlan(model)
+    pagination = {}
+    for key, value in filters.items():
+        if key in PAGINATION_FIELDS:
+            pagination[key] = value
+            continue
+        if key in PROJECTION_FIELDS:
+            plan.fields = value
+            continue
+        col_attr = _get_column_attr(model, key)
+        if key in filter_translators:
+            condition, residual = filter_translators[key](col_attr, value)
+            if condition is not None:
+                plan.conditions.append(condition)
+                plan.pushed_down.append(key)
+            if residual is not None:
+                plan.output_filters[key] = residual
+            continue
+        if col_attr is None:
+            plan.output_filters[key] = value
+            continue
+        if isinstance(value, dict):
+            sql_value = dict([
+                (filter_key, filter_value)
+                for filter_key, filter_value in value.items()
+                if filter_key in SQL_FILTER_KEYS
+            ])
+            if sql_value:
+                plan.filters[key] = sql_value
+                plan.pushed_down.extend([
+                    '%s.%s' % (key, filter_key) for filter_key in sql_value
+                ])
+            if len(sql_value) < len(value):
+                plan.output_filters[key] = value
+        else:
+            plan.filters[key] = value
+            plan.pushed_down.append(key)
+    plan.filters.update(pagination)
+    if plan.output_filters:
+        plan.defer_limit()
+    logging.debug('%s query plan: %s', model.__name__, plan)
+    return plan
+
+
 def replace_output(**output_mapping):
     def decorator(func):
         @functools.wraps(func)
@@ -267,48 +588,99 @@ def get_wrapped_func(func):
         return func
 
 
+def _compile_projection(support_keys, filters):
+    """Compile response keys and nested filters into a projection plan.
+
+    The plan is a tuple of (key, sub_plan) pairs where sub_plan is None
+    when the value is copied as is.
+    """
+    plan = []
+    for key in support_keys:
+        if key in filters:
+            filter_keys = filters[key]
+            if isinstance(filter_keys, dict):
+                sub_plan = _compile_projection(
+                    filter_keys.keys(), filter_keys
+                )
+            else:
+                sub_plan = _compile_projection(filter_keys, {})
+        else:
+            sub_plan = None
+        plan.append((key, sub_plan))
+    return tuple(plan)
+
+
+def _narrow_projection(projection, fields):
+    """Keep only the requested fields of a projection plan."""
+    unsupported_fields = [
+        field for field in fields
+        if field not in dict(projection)
+    ]
+    if unsupported_fields:
+        raise exception.InvalidParameter(
+            'fields %s are not supported' % unsupported_fields
+        )
+    return tuple([
+        (key, sub_plan) for key, sub_plan in projection
+        if key in fields
+    ])
+
+
 def wrap_to_dict(support_keys=[], **filters):
+    """Wrap the response to dicts of support_keys.
+
+    A fields keyword in the call narrows the response to those keys.
+    It is passed on as the set of response keys if the wrapped
+    function takes a fields argument.
+    """
+    projection = _compile_projection(support_keys, filters)
+    projection_fields = frozenset(support_keys)
+
     def decorator(func):
+        forward_fields = 'fields' in _get_wrapped_args(func)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            fields = kwargs.pop('fields', None)
+            if fields:
+                call_projection = _narrow_projection(projection, fields)
+                call_fields = frozenset([
+                    key for key, _ in call_projection
+                ])
+            else:
+                call_projection = projection
+                call_fields = projection_fields
+            if forward_fields:
+                kwargs['fields'] = call_fields if fields else None
             return _wrapper_dict(
-                func(*args, **kwargs), support_keys, **filters
+                func(*args, **kwargs), call_projection, call_fields
             )
         return wrapper
     return decorator
 
 
-def _wrapper_dict(data, support_keys, **filters):
-    """Helper for warpping db object into dictionary."""
-    logging.debug(
-        'wrap dict %s by support_keys=%s filters=%s',
-        data, support_keys, filters
-    )
+def _wrapper_dict(data, projection, fields=None):
+    """Helper for warpping db object into dictionary.
+
+    fields are the keys of projection, so that db objects only compute
+    what is returned.
+    """
     if isinstance(data, list):
         return [
-            _wrapper_dict(item, support_keys, **filters)
+            _wrapper_dict(item, projection, fields)
             for item in data
         ]
     if isinstance(data, models.HelperMixin):
-        data = data.to_dict()
+        data = data.to_dict(fields)
     if not isinstance(data, dict):
         raise exception.InvalidResponse(
             'response %s type is not dict' % data
         )
     info = {}
-    for key in support_keys:
+    for key, sub_projection in projection:
         if key in data:
-            if key in filters:
-                filter_keys = filters[key]
-                if isinstance(filter_keys, dict):
-                    info[key] = _wrapper_dict(
-                        data[key], filter_keys.keys(),
-                        **filter_keys
-                    )
-                else:
-                    info[key] = _wrapper_dict(
-                        data[key], filter_keys
-                    )
+            if sub_projection is not None:
+                info[key] = _wrapper_dict(data[key], sub_projection)
             else:
                 info[key] = data[key]
     return info
@@ -330,57 +702,70 @@ def replace_input_types(**kwarg_mapping):
 
 
 def replace_filters(**filter_mapping):
+    replaced_keys = frozenset(filter_mapping)
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **filters):
-            replaced_filters = {}
-            for key, value in filters.items():
-                if key in filter_mapping:
-                    replaced_filters[filter_mapping[key]] = value
-                else:
-                    replaced_filters[key] = value
-            return func(*args, **replaced_filters)
+            if replaced_keys.isdisjoint(filters):
+                return func(*args, **filters)
+            return func(*args, **dict([
+                (filter_mapping.get(key, key), value)
+                for key, value in filters.items()
+            ]))
         return wrapper
     return decorator
 
 
+def _get_wrapped_args(func):
+    """Get the argument names of the innermost wrapped function."""
+    return frozenset(inspect.getargspec(get_wrapped_func(func)).args)
+
+
 def supported_filters(
     support_keys=[],
     optional_support_keys=[],
     ignore_support_keys=[],
 ):
+    must_support_keys = frozenset(support_keys)
+    all_support_keys = must_support_keys | frozenset(optional_support_keys)
+    ignore_keys = frozenset(ignore_support_keys)
+
     def decorator(func):
+        # The argspec of the wrapped function does not change after
+        # decoration, so the accepted and required keys are computed once
+        # here instead of on every call.
+        wrapped_args = _get_wrapped_args(func)
+        accepted_keys = all_support_keys | ignore_keys | wrapped_args
+        missing_candidate_keys = must_support_keys - wrapped_args
+
         @functools.wraps(func)
         def wrapper(*args, **filters):
-            wrapped_func = get_wrapped_func(func)
-            argspec = inspect.getargspec(wrapped_func)
-            wrapped_args = argspec.args
-            must_support_keys = set(support_keys)
-            all_support_keys = must_support_keys | set(optional_support_keys)
-            filter_keys = set(filters) - set(wrapped_args)
-            wrapped_support_keys = set(filters) | set(wrapped_args)
-            unsupported_keys = (
-                filter_keys - all_support_keys - set(ignore_support_keys)
-            )
+            unsupported_keys = [
+                key for key in filters if key not in accepted_keys
+            ]
             if unsupported_keys:
                 raise exception.InvalidParameter(
                     'filter keys %s are not supported' % str(
-                        list(unsupported_keys)
+                        unsupported_keys
                     )
                 )
-            missing_keys = must_support_keys - wrapped_support_keys
+            missing_keys = [
+                key for key in missing_candidate_keys if key not in filters
+            ]
             if missing_keys:
                 raise exception.InvalidParameter(
                     'filter keys %s not found' % str(
-                        list(missing_keys)
+                        missing_keys
                     )
                 )
-            filtered_filters = dict([
-                (key, value)
-                for key, value in filters.items()
-                if key not in ignore_support_keys
-            ])
-            return func(*args, **filtered_filters)
+            if ignore_keys:
+                filters = dict([
+                    (key, value)
+                    for key, value in filters.items()
+                    if key not in ignore_keys
+                ])
+            return func(*args, **filters)
         return wrapper
     return decorator
 
@@ -456,38 +841,68 @@ def filter_output(filter_callbacks, filters, obj, missing_ok=False):
 
 
 def output_filters(missing_ok=False, **filter_callbacks):
+    """Filter the response objects by filter_callbacks.
+
+    If fields are requested, the filtered keys are added to them for
+    the wrapped function and left out of the response again. Only the
+    callbacks of the filters given in a call are run on its objects.
+    """
+    filter_keys = frozenset(filter_callbacks)
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **filters):
+            if filter_keys.isdisjoint(filters):
+                return func(*args, **filters)
+            call_callbacks = dict([
+                (key, callback)
+                for key, callback in filter_callbacks.items()
+                if key in filters
+            ])
+            fields = filters.pop('fields', None)
+            extra_fields = []
+            if fields:
+                extra_fields = [
+                    key for key in call_callbacks if key not in fields
+                ]
+                filters['fields'] = list(fields) + extra_fields
             filtered_obj_list = []
             obj_list = func(*args, **filters)
             for obj in obj_list:
                 if filter_output(
-                    filter_callbacks, filters, obj, missing_ok
+                    call_callbacks, filters, obj, missing_ok
                 ):
+                    for key in extra_fields:
+                        obj.pop(key, None)
                     filtered_obj_list.append(obj)
             return filtered_obj_list
         return wrapper
     return decorator
 
 
-def _input_validates(args_validators, kwargs_validators, *args, **kwargs):
-    for i, value in enumerate(args):
-        if i < len(args_validators) and args_validators[i]:
-            args_validators[i](value)
-    for key, value in kwargs.items():
-        if kwargs_validators.get(key):
-            kwargs_validators[key](value)
-
-
 def input_validates(*args_validators, **kwargs_validators):
+    # validators left empty are dropped once here instead of being
+    # looked up for every argument of every call.
+    indexed_args_validators = [
+        (index, validator)
+        for index, validator in enumerate(args_validators)
+        if validator
+    ]
+    kwargs_validators = [
+        (key, validator)
+        for key, validator in kwargs_validators.items()
+        if validator
+    ]
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            _input_validates(
-                args_validators, kwargs_validators,
-                *args, **kwargs
-            )
+            for index, validator in indexed_args_validators:
+                if index < len(args):
+                    validator(args[index])
+            for key, validator in kwargs_validators:
+                if key in kwargs:
+                    validator(kwargs[key])
             return func(*args, **kwargs)
         return wrapper
     return decorator
@@ -524,14 +939,39 @@ def output_validates(**kwargs_validators):
     return decorator
 
 
-def get_db_object(session, table, exception_when_missing=True, **kwargs):
-    """Get db object."""
+TABLE_INIT_ARGS = {}
+
+
+def _get_table_init_args(table):
+    """Get positional arg names and min positional args of table init."""
+    if table not in TABLE_INIT_ARGS:
+        argspec = inspect.getargspec(table.__init__)
+        arg_names = argspec.args[1:]
+        arg_defaults = argspec.defaults
+        if not arg_defaults:
+            arg_defaults = []
+        TABLE_INIT_ARGS[table] = (
+            arg_names, len(arg_names) - len(arg_defaults)
+        )
+    return TABLE_INIT_ARGS[table]
+
+
+def get_db_object(
+    session, table, exception_when_missing=True,
+    loading_profile=None, **kwargs
+):
+    """Get db object.
+
+    loading_profile is the LoadingProfile of relationships to load
+    with the object.
+    """
     with session.begin(subtransactions=True):
         logging.debug(
             'session %s get db object %s from table %s',
             id(session), kwargs, table.__name__)
         db_object = model_filter(
-            model_query(session, table), table, **kwargs
+            model_load(model_query(session, table), loading_profile),
+            table, **kwargs
         ).first()
         logging.debug(
             'session %s got db object %s', id(session), db_object
@@ -556,13 +996,9 @@ def add_db_object(session, table, exception_when_existing=True,
         logging.debug(
             'session %s add object %s atributes %s to table %s',
             id(session), args, kwargs, table.__name__)
-        argspec = inspect.getargspec(table.__init__)
-        arg_names = argspec.args[1:]
-        arg_defaults = argspec.defaults
-        if not arg_defaults:
-            arg_defaults = []
+        arg_names, min_args = _get_table_init_args(table)
         if not (
-            len(arg_names) - len(arg_defaults) <= len(args) <= len(arg_names)
+            min_args <= len(args) <= len(arg_names)
         ):
             raise exception.InvalidParameter(
                 'arg names %s does not match arg values %s' % (
@@ -601,22 +1037,185 @@ def add_db_object(session, table, exception_when_existing=True,
         return db_object
 
 
-def list_db_objects(session, table, order_by=[], **filters):
-    """List db objects."""
+BULK_QUERY_CHUNK_SIZE = 500
+
+
+def get_db_objects_by_keys(session, table, key_names, keys_list):
+    """Get existing db objects keyed by the tuple of key_names values.
+
+    One IN query on the first key is run per chunk of keys.
+    """
+    first_key_values = list(set([keys[0] for keys in keys_list]))
+    first_key_attr = getattr(table, key_names[0])
+    db_objects = {}
+    with session.begin(subtransactions=True):
+        logging.debug(
+            'session %s get %s db objects by %s from table %s',
+            id(session), len(keys_list), key_names, table.__name__
+        )
+        for start in range(
+            0, len(first_key_values), BULK_QUERY_CHUNK_SIZE
+        ):
+            query = model_query(session, table).filter(first_key_attr.in_(
+                first_key_values[start:start + BULK_QUERY_CHUNK_SIZE]
+            ))
+            for db_object in query:
+                db_objects[tuple([
+                    getattr(db_object, key_name) for key_name in key_names
+                ])] = db_object
+    return db_objects
+
+
+def add_db_objects(session, table, exception_when_existing=True, data=[]):
+    """Create db objects in batch.
+
+    Each item in data is a dict of the table init args and other
+    attributes to set. Existing objects are prefetched in one query
+    per chunk, new objects are inserted in one flush, then all
+    objects are initialized and validated. Objects are returned in
+    the order of data.
+    """
+    with session.begin(subtransactions=True):
+        logging.debug(
+            'session %s add %s objects to table %s',
+            id(session), len(data), table.__name__
+        )
+        key_names, _ = _get_table_init_args(table)
+        if not key_names:
+            raise exception.InvalidParameter(
+                'table %s has no init args to match objects' % (
+                    table.__name__
+                )
+            )
+        items = []
+        for item in data:
+            values = dict(item)
+            missing_keys = [
+                key_name for key_name in key_names
+                if key_name not in values
+            ]
+            if missing_keys:
+                raise exception.InvalidParameter(
+                    'arg names %s are missing in %s' % (
+                        missing_keys, item
+                    )
+                )
+            db_keys = tuple([values.pop(key_name) for key_name in key_names])
+            items.append((db_keys, values))
+
+        db_objects = get_db_objects_by_keys(
+            session, table, key_names,
+            [item[0] for item in items]
+        )
+        new_objects = []
+        changed_objects = []
+        changed_object_ids = set()
+        results = []
+        for db_keys, values in items:
+            db_object = db_objects.get(db_keys)
+            if db_object is not None:
+                if exception_when_existing:
+                    raise exception.DuplicatedRecord(
+                        '%s exists in table %s' % (
+                            dict(zip(key_names, db_keys)), table.__name__
+                        )
+                    )
+            else:
+                db_object = table(**dict(zip(key_names, db_keys)))
+                db_objects[db_keys] = db_object
+                new_objects.append(db_object)
+            for key, value in values.items():
+                setattr(db_object, key, value)
+            if id(db_object) not in changed_object_ids:
+                changed_object_ids.add(id(db_object))
+                changed_objects.append(db_object)
+            results.append(db_object)
+
+        session.add_all(new_objects)
+        session.flush()
+        for db_object in changed_objects:
+            db_object.initialize()
+        for db_object in changed_objects:
+            db_object.validate()
+        logging.debug(
+            'session %s added %s objects to table %s, %s are new',
+            id(session), len(changed_objects), table.__name__,
+            len(new_objects)
+        )
+        return results
+
+
+def upsert_db_objects(session, table, data=[]):
+    """Create db objects in batch or update the existing ones."""
+    return add_db_objects(session, table, False, data=data)
+
+
+def bulk_update_db_objects(session, updates):
+    """Update db objects in batch.
+
+    updates is a list of (db_object, values) pairs. All changes are
+    flushed together before the objects are updated and validated.
+    """
+    with session.begin(subtransactions=True):
+        logging.debug(
+            'session %s update %s db objects',
+            id(session), len(updates)
+        )
+        for db_object, values in updates:
+            for key, value in values.items():
+                setattr(db_object, key, value)
+        session.flush()
+        for db_object, _ in updates:
+            db_object.update()
+        for db_object, _ in updates:
+            db_object.validate()
+        return [db_object for db_object, _ in updates]
+
+
+def list_db_objects(
+    session, table, order_by=[], conditions=[],
+    limit=None, marker=None, loading_profile=None, fields=None,
+    **filters
+):
+    """List db objects.
+
+    conditions are additional sql clauses, usually from a QueryPlan.
+    If limit or marker is given, the objects are paged and ordered by
+    primary key instead of order_by. loading_profile is the
+    LoadingProfile of relationships to load with the objects.
+    If fields are all columns of table, only those columns are queried
+    and dicts are returned instead of db objects. Only pass fields when
+    table's to_dict does not compute any of its column keys.
+    """
+    check_pagination(limit, marker)
+    column_keys = _get_column_keys(table, fields)
+    if column_keys:
+        # no db objects are loaded.
+        loading_profile = None
     with session.begin(subtransactions=True):
         logging.debug(
             'session %s list db objects by filters %s in table %s',
             id(session), filters, table.__name__
         )
-        db_objects = model_order_by(
-            model_filter(
-                model_query(session, table),
-                table,
-                **filters
-            ),
+        query = model_filter(
+            model_load(model_query(session, table), loading_profile),
             table,
-            order_by
-        ).all()
+            **filters
+        )
+        for condition in conditions:
+            query = query.filter(condition)
+        if limit is not None or marker is not None:
+            query = model_paginate(query, table, limit, marker)
+        else:
+            query = model_order_by(query, table, order_by)
+        if column_keys:
+            return [
+                _column_row_to_dict(column_keys, row)
+                for row in query.with_entities(*[
+                    getattr(table, key) for key in column_keys
+                ])
+            ]
+        db_objects = query.all()
         logging.debug(
             'session %s got listed db objects: %s',
             id(session), db_objects
@@ -708,13 +1307,11 @@ def check_ip(ip):
 
 
 def check_mac(mac):
-    try:
-        netaddr.EUI(mac)
-    except Exception as error:
-        logging.exception(error)
-        raise exception.InvalidParameter(
-            'invalid mac address %s' % mac
-        )
+    util.parse_mac(mac, exception.InvalidParameter)
+
+
+def normalize_mac(mac):
+    return util.normalize_mac(mac, exception.InvalidParameter)
 
 
 NAME_PATTERN = re.compile(r'[a-zA-Z0-9][a-zA-Z0-9_-]*')
@@ -17,12 +17,13 @@ import copy
 import datetime
 import logging
 import netaddr
-import re
 import simplejson as json
 
 from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
+from sqlalchemy import case
 from sqlalchemy import Column
+from sqlalchemy.dialects import postgresql
 from sqlalchemy import ColumnDefault
 from sqlalchemy import DateTime
 from sqlalchemy import Enum
@@ -30,8 +31,14 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import Float
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import or_
+from sqlalchemy.orm import object_session
 from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import synonym
+from sqlalchemy.orm import validates
+from sqlalchemy import select
 from sqlalchemy import String
 from sqlalchemy import Table
 from sqlalchemy import Text
@@ -40,6 +47,7 @@ from sqlalchemy import UniqueConstraint
 
 from compass.db import callback as metadata_callback
 from compass.db import exception
+from compass.db import switch_filter
 from compass.db import validator as metadata_validator
 from compass.utils import util
 
@@ -48,21 +56,71 @@ BASE = declarative_base()
 
 
 class JSONEncoded(TypeDecorator):
-    """Represents an immutable structure as a json-encoded string."""
+    """Represents an immutable structure as a json-encoded string.
+
+    The dialect's native json type is used when it has one.
+    """
 
     impl = Text
 
+    @staticmethod
+    def is_native(dialect):
+        return dialect.name == 'postgresql' and hasattr(postgresql, 'JSON')
+
+    def load_dialect_impl(self, dialect):
+        if self.is_native(dialect):
+            return dialect.type_descriptor(postgresql.JSON())
+        return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value, dialect):
-        if value is not None:
+        if value is not None and not self.is_native(dialect):
             value = json.dumps(value)
         return value
 
     def process_result_value(self, value, dialect):
-        if value is not None:
+        if value is not None and not self.is_native(dialect):
             value = json.loads(value)
         return value
 
 
+class LazyJSONEncoded(JSONEncoded):
+    """JSONEncoded column whose loaded values are kept encoded.
+
+    The value is decoded on first access through json_synonym.
+    """
+
+    def process_result_value(self, value, dialect):
+        return value
+
+
+def json_synonym(column_key):
+    """Expose a LazyJSONEncoded column as its decoded value.
+
+    The decoded value is memoized per loaded string, and assigning
+    a value equal to the current one leaves the column untouched,
+    so unchanged configs are not re-serialized on flush.
+    """
+    cache_key = '%s_decoded' % column_key
+
+    def getter(self):
+        value = getattr(self, column_key)
+        if not isinstance(value, basestring):
+            return value
+        cached = self.__dict__.get(cache_key)
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        decoded = json.loads(value)
+        self.__dict__[cache_key] = (value, decoded)
+        return decoded
+
+    def setter(self, value):
+        if value == getter(self):
+            return
+        setattr(self, column_key, value)
+
+    return synonym(column_key, descriptor=property(getter, setter))
+
+
 class TimestampMixin(object):
     created_at = Column(DateTime, default=lambda: datetime.datetime.now())
     updated_at = Column(DateTime, default=lambda: datetime.datetime.now(),
@@ -106,12 +164,29 @@ class HelperMixin(object):
                     )
                 )
 
-    def to_dict(self):
-        keys = self.__mapper__.columns.keys()
+    @staticmethod
+    def dict_fields_wanted(fields, *keys):
+        """Check if any of keys is wanted in to_dict fields."""
+        if fields is None:
+            return True
+        for key in keys:
+            if key in fields:
+                return True
+        return False
+
+    def to_dict(self, fields=None):
+        """Convert to dict.
+
+        If fields is given, keys not in it may be left out.
+        """
+        mapper = self.__mapper__
+        keys = mapper.columns.keys() + mapper.synonyms.keys()
         dict_info = {}
         for key in keys:
             if key.startswith('_'):
                 continue
+            if fields is not None and key not in fields:
+                continue
             value = getattr(self, key)
             if value is not None:
                 if isinstance(value, datetime.datetime):
@@ -273,7 +348,7 @@ class MetadataMixin(HelperMixin):
                 'autofill callback %s is not callable' % value
             )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         self_dict_info = {}
         if self.field:
             self_dict_info.update(self.field.to_dict())
@@ -382,7 +457,7 @@ class FieldMixin(HelperMixin):
                 '%s is not callable' % value
             )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(FieldMixin, self).to_dict()
         dict_info['field_type'] = self.field_type
         validator = self.validator
@@ -530,12 +605,14 @@ class HostNetwork(BASE, TimestampMixin, HelperMixin):
                 )
             )
 
-    def to_dict(self):
-        dict_info = super(HostNetwork, self).to_dict()
+    def to_dict(self, fields=None):
+        dict_info = super(HostNetwork, self).to_dict(fields)
         dict_info['ip'] = self.ip
         dict_info['interface'] = self.interface
-        dict_info['netmask'] = self.netmask
-        dict_info['subnet'] = self.subnet.subnet
+        if self.dict_fields_wanted(fields, 'netmask'):
+            dict_info['netmask'] = self.netmask
+        if self.dict_fields_wanted(fields, 'subnet'):
+            dict_info['subnet'] = self.subnet.subnet
         return dict_info
 
 
@@ -647,9 +724,13 @@ class ClusterHost(BASE, TimestampMixin, HelperMixin):
     )
     _roles = Column('roles', JSONEncoded, default=[])
     config_step = Column(String(80), default='')
-    package_config = Column(JSONEncoded, default={})
+    _package_config = Column('package_config', LazyJSONEncoded, default={})
+    package_config = json_synonym('_package_config')
     config_validated = Column(Boolean, default=False)
-    deployed_package_config = Column(JSONEncoded, default={})
+    _deployed_package_config = Column(
+        'deployed_package_config', LazyJSONEncoded, default={}
+    )
+    deployed_package_config = json_synonym('_deployed_package_config')
 
     log_history = relationship(
         ClusterHostLogHistory,
@@ -864,23 +945,26 @@ class ClusterHost(BASE, TimestampMixin, HelperMixin):
             host_state['state'] = 'INSTALLING'
         return host_state
 
-    def to_dict(self):
-        dict_info = self.host.to_dict()
-        dict_info.update(super(ClusterHost, self).to_dict())
-        state_dict = self.state_dict()
-        dict_info.update({
-            'distributed_system_name': self.distributed_system_name,
-            'distributed_system_installed': self.distributed_system_installed,
-            'reinstall_distributed_system': self.reinstall_distributed_system,
-            'owner': self.owner,
-            'clustername': self.clustername,
-            'name': self.name,
-            'state': state_dict['state']
-        })
-        roles = self.roles
-        dict_info['roles'] = [
-            role.to_dict() for role in roles
-        ]
+    def to_dict(self, fields=None):
+        dict_info = self.host.to_dict(fields)
+        dict_info.update(super(ClusterHost, self).to_dict(fields))
+        dict_getters = {
+            'distributed_system_name': lambda: self.distributed_system_name,
+            'distributed_system_installed': (
+                lambda: self.distributed_system_installed
+            ),
+            'reinstall_distributed_system': (
+                lambda: self.reinstall_distributed_system
+            ),
+            'owner': lambda: self.owner,
+            'clustername': lambda: self.clustername,
+            'name': lambda: self.name,
+            'state': lambda: self.state_dict()['state'],
+            'roles': lambda: [role.to_dict() for role in self.roles]
+        }
+        for key, dict_getter in dict_getters.items():
+            if self.dict_fields_wanted(fields, key):
+                dict_info[key] = dict_getter()
         return dict_info
 
 
@@ -933,9 +1017,13 @@ class Host(BASE, TimestampMixin, HelperMixin):
     name = Column(String(80), unique=True, nullable=True)
     os_id = Column(Integer, ForeignKey('os.id'))
     config_step = Column(String(80), default='')
-    os_config = Column(JSONEncoded, default={})
+    _os_config = Column('os_config', LazyJSONEncoded, default={})
+    os_config = json_synonym('_os_config')
     config_validated = Column(Boolean, default=False)
-    deployed_os_config = Column(JSONEncoded, default={})
+    _deployed_os_config = Column(
+        'deployed_os_config', LazyJSONEncoded, default={}
+    )
+    deployed_os_config = json_synonym('_deployed_os_config')
     os_name = Column(String(80))
     creator_id = Column(Integer, ForeignKey('user.id'))
     owner = Column(String(80))
@@ -1076,27 +1164,35 @@ class Host(BASE, TimestampMixin, HelperMixin):
     def state_dict(self):
         return self.state.to_dict()
 
-    def to_dict(self):
-        dict_info = self.machine.to_dict()
-        dict_info.update(super(Host, self).to_dict())
-        state_dict = self.state_dict()
+    @property
+    def mgmt_ip(self):
         ip = None
         for host_network in self.host_networks:
             if host_network.is_mgmt:
                 ip = host_network.ip
-        dict_info.update({
-            'machine_id': self.machine.id,
-            'os_installed': self.os_installed,
-            'hostname': self.hostname,
-            'ip': ip,
-            'networks': [
+        return ip
+
+    def to_dict(self, fields=None):
+        dict_info = self.machine.to_dict(fields)
+        dict_info.update(super(Host, self).to_dict(fields))
+        dict_getters = {
+            'machine_id': lambda: self.machine.id,
+            'os_installed': lambda: self.os_installed,
+            'hostname': lambda: self.hostname,
+            'ip': lambda: self.mgmt_ip,
+            'networks': lambda: [
                 host_network.to_dict()
                 for host_network in self.host_networks
             ],
-            'os_installer': self.os_installer.to_dict(),
-            'clusters': [cluster.to_dict() for cluster in self.clusters],
-            'state': state_dict['state']
-        })
+            'os_installer': lambda: self.os_installer.to_dict(),
+            'clusters': lambda: [
+                cluster.to_dict() for cluster in self.clusters
+            ],
+            'state': lambda: self.state_dict()['state']
+        }
+        for key, dict_getter in dict_getters.items():
+            if self.dict_fields_wanted(fields, key):
+                dict_info[key] = dict_getter()
         return dict_info
 
 
@@ -1125,6 +1221,8 @@ class ClusterState(BASE, StateMixin):
         Integer,
         default=0
     )
+    # bumped whenever a state in the cluster changes.
+    version = Column(Integer, default=0)
 
     def __init__(self, **kwargs):
         super(ClusterState, self).__init__(**kwargs)
@@ -1134,7 +1232,7 @@ class ClusterState(BASE, StateMixin):
             self.id, self.state, self.percentage
         )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(ClusterState, self).to_dict()
         dict_info['status'] = {
             'total_hosts': self.total_hosts,
@@ -1226,10 +1324,18 @@ class Cluster(BASE, TimestampMixin, HelperMixin):
     distributed_system_name = Column(
         String(80), nullable=True
     )
-    os_config = Column(JSONEncoded, default={})
-    package_config = Column(JSONEncoded, default={})
-    deployed_os_config = Column(JSONEncoded, default={})
-    deployed_package_config = Column(JSONEncoded, default={})
+    _os_config = Column('os_config', LazyJSONEncoded, default={})
+    os_config = json_synonym('_os_config')
+    _package_config = Column('package_config', LazyJSONEncoded, default={})
+    package_config = json_synonym('_package_config')
+    _deployed_os_config = Column(
+        'deployed_os_config', LazyJSONEncoded, default={}
+    )
+    deployed_os_config = json_synonym('_deployed_os_config')
+    _deployed_package_config = Column(
+        'deployed_package_config', LazyJSONEncoded, default={}
+    )
+    deployed_package_config = json_synonym('_deployed_package_config')
     config_validated = Column(Boolean, default=False)
     adapter_id = Column(Integer, ForeignKey('adapter.id'))
     adapter_name = Column(String(80))
@@ -1400,12 +1506,13 @@ class Cluster(BASE, TimestampMixin, HelperMixin):
     def state_dict(self):
         return self.state.to_dict()
 
-    def to_dict(self):
-        dict_info = super(Cluster, self).to_dict()
-        dict_info['distributed_system_installed'] = (
-            self.distributed_system_installed
-        )
-        if self.flavor:
+    def to_dict(self, fields=None):
+        dict_info = super(Cluster, self).to_dict(fields)
+        if self.dict_fields_wanted(fields, 'distributed_system_installed'):
+            dict_info['distributed_system_installed'] = (
+                self.distributed_system_installed
+            )
+        if self.dict_fields_wanted(fields, 'flavor') and self.flavor:
             dict_info['flavor'] = self.flavor.to_dict()
         return dict_info
 
@@ -1438,7 +1545,7 @@ class UserPermission(BASE, HelperMixin, TimestampMixin):
     def name(self):
         return self.permission.name
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = self.permission.to_dict()
         dict_info.update(super(UserPermission, self).to_dict())
         return dict_info
@@ -1501,7 +1608,9 @@ class UserLog(BASE, HelperMixin):
         ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE')
     )
     action = Column(Text)
-    timestamp = Column(DateTime, default=lambda: datetime.datetime.now())
+    timestamp = Column(
+        DateTime, default=lambda: datetime.datetime.now(), index=True
+    )
 
     @hybrid_property
     def user_email(self):
@@ -1526,6 +1635,8 @@ class User(BASE, HelperMixin, TimestampMixin):
     lastname = Column(String(80))
     is_admin = Column(Boolean, default=False)
     active = Column(Boolean, default=True)
+    # bumped whenever the permissions of the user change.
+    permission_version = Column(Integer, default=0)
     user_permissions = relationship(
         UserPermission,
         passive_deletes=True, passive_updates=True,
@@ -1583,7 +1694,7 @@ class User(BASE, HelperMixin, TimestampMixin):
 
         return permissions
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(User, self).to_dict()
         dict_info['permissions'] = [
             permission.to_dict()
@@ -1592,6 +1703,28 @@ class User(BASE, HelperMixin, TimestampMixin):
         return dict_info
 
 
+class SwitchMachinePortPart(BASE, HelperMixin):
+    """Numeric part of a switch machine port.
+
+    A port has a part for each of its numbers, see
+    switch_filter.split_port.
+    """
+    __tablename__ = 'switch_machine_port_part'
+    id = Column(Integer, primary_key=True)
+    switch_machine_id = Column(
+        Integer,
+        ForeignKey(
+            'switch_machine.id', onupdate='CASCADE', ondelete='CASCADE'
+        )
+    )
+    port_head = Column(String(80), nullable=False)
+    port_number = Column(Integer, nullable=False)
+    port_tail = Column(String(80), nullable=False)
+    __table_args__ = (
+        Index('ix_switch_machine_port_part', 'port_head', 'port_number'),
+    )
+
+
 class SwitchMachine(BASE, HelperMixin, TimestampMixin):
     """Switch Machine table."""
     __tablename__ = 'switch_machine'
@@ -1608,6 +1741,15 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
     )
     port = Column(String(80), nullable=True)
     vlans = Column(JSONEncoded, default=[])
+    filtered = Column(Boolean, default=False, index=True)
+    # when the machine was first missing in the polls of the switch.
+    missing_since = Column(DateTime, nullable=True)
+    # port split by switch_filter.split_port when port is changed.
+    port_parts = relationship(
+        SwitchMachinePortPart,
+        passive_updates=True,
+        cascade='all, delete-orphan'
+    )
     __table_args__ = (
         UniqueConstraint('switch_id', 'machine_id', name='constraint'),
     )
@@ -1622,6 +1764,21 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
             self.switch_machine_id, self.port
         )
 
+    @validates('port')
+    def _validate_port(self, key, port):
+        if port != self.port:
+            self.split_port(port)
+        return port
+
+    def split_port(self, port):
+        """Replace the port parts by the parts of port."""
+        self.port_parts = [
+            SwitchMachinePortPart(
+                port_head=head, port_number=number, port_tail=tail
+            )
+            for head, number, tail in switch_filter.split_port(port or '')
+        ]
+
     def validate(self):
         super(SwitchMachine, self).validate()
         if not self.switch:
@@ -1641,6 +1798,14 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
     def mac(self):
         return self.machine.mac
 
+    @mac.expression
+    def mac(cls):
+        return select(
+            [Machine._mac]
+        ).where(
+            Machine.id == cls.machine_id
+        ).as_scalar()
+
     @hybrid_property
     def tag(self):
         return self.machine.tag
@@ -1655,7 +1820,11 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
 
     @switch_ip_int.expression
     def switch_ip_int(cls):
-        return Switch.ip_int
+        return select(
+            [Switch.ip_int]
+        ).where(
+            Switch.id == cls.switch_id
+        ).as_scalar()
 
     @hybrid_property
     def switch_vendor(self):
@@ -1663,7 +1832,11 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
 
     @switch_vendor.expression
     def switch_vendor(cls):
-        return Switch.vendor
+        return select(
+            [Switch.vendor]
+        ).where(
+            Switch.id == cls.switch_id
+        ).as_scalar()
 
     @property
     def patched_vlans(self):
@@ -1679,68 +1852,16 @@ class SwitchMachine(BASE, HelperMixin, TimestampMixin):
                 vlans.append(item)
         self.vlans = vlans
 
-    @property
-    def filtered(self):
-        filters = self.switch.filters
-        port = self.port
-        unmatched_allowed = True
-        ports_pattern = re.compile(r'(\D*)(\d+)-(\d+)(\D*)')
-        port_pattern = re.compile(r'(\D*)(\d+)(\D*)')
-        port_match = port_pattern.match(port)
-        if port_match:
-            port_prefix = port_match.group(1)
-            port_number = int(port_match.group(2))
-            port_suffix = port_match.group(3)
-        else:
-            port_prefix = ''
-            port_number = 0
-            port_suffix = ''
-        for port_filter in filters:
-            filter_type = port_filter.get('filter_type', 'allow')
-            denied = filter_type != 'allow'
-            unmatched_allowed = denied
-            if 'ports' in port_filter:
-                if 'all' in port_filter['ports']:
-                    return denied
-                if port in port_filter['ports']:
-                    return denied
-                if port_match:
-                    for port_or_ports in port_filter['ports']:
-                        ports_match = ports_pattern.match(port_or_ports)
-                        if ports_match:
-                            filter_port_prefix = ports_match.group(1)
-                            filter_port_start = int(ports_match.group(2))
-                            filter_port_end = int(ports_match.group(3))
-                            filter_port_suffix = ports_match.group(4)
-                            if (
-                                filter_port_prefix == port_prefix and
-                                filter_port_suffix == port_suffix and
-                                filter_port_start <= port_number and
-                                port_number <= filter_port_end
-                            ):
-                                return denied
-            else:
-                filter_port_prefix = port_filter.get('port_prefix', '')
-                filter_port_suffix = port_filter.get('port_suffix', '')
-                if (
-                    port_match and
-                    port_prefix == filter_port_prefix and
-                    port_suffix == filter_port_suffix
-                ):
-                    if (
-                        'port_start' not in port_filter or
-                        port_number >= port_filter['port_start']
-                    ) and (
-                        'port_end' not in port_filter or
-                        port_number <= port_filter['port_end']
-                    ):
-                        return denied
-        return not unmatched_allowed
-
-    def to_dict(self):
-        dict_info = self.machine.to_dict()
-        dict_info.update(super(SwitchMachine, self).to_dict())
-        dict_info['switch_ip'] = self.switch.ip
+    def update(self):
+        if self.switch:
+            self.filtered = self.switch.filter_matcher.filtered(self.port)
+        super(SwitchMachine, self).update()
+
+    def to_dict(self, fields=None):
+        dict_info = self.machine.to_dict(fields)
+        dict_info.update(super(SwitchMachine, self).to_dict(fields))
+        if self.dict_fields_wanted(fields, 'switch_ip'):
+            dict_info['switch_ip'] = self.switch.ip
         return dict_info
 
 
@@ -1748,7 +1869,8 @@ class Machine(BASE, HelperMixin, TimestampMixin):
     """Machine table."""
     __tablename__ = 'machine'
     id = Column(Integer, primary_key=True)
-    mac = Column(String(24), unique=True, nullable=False)
+    _mac = Column('mac', String(24), unique=True, nullable=False)
+    mac_int = Column(BigInteger, unique=True)
     ipmi_credentials = Column(JSONEncoded, default={})
     tag = Column(JSONEncoded, default={})
     location = Column(JSONEncoded, default={})
@@ -1767,6 +1889,16 @@ class Machine(BASE, HelperMixin, TimestampMixin):
         backref=backref('machine')
     )
 
+    def _get_mac(self):
+        return self._mac
+
+    def _set_mac(self, value):
+        """Store mac in the canonical format and as the 48 bit int."""
+        self.mac_int = util.parse_mac(value, exception.InvalidParameter)
+        self._mac = util.format_mac(self.mac_int)
+
+    mac = synonym('_mac', descriptor=property(_get_mac, _set_mac))
+
     def __init__(self, mac, **kwargs):
         self.mac = mac
         super(Machine, self).__init__(**kwargs)
@@ -1774,14 +1906,11 @@ class Machine(BASE, HelperMixin, TimestampMixin):
     def __str__(self):
         return 'Machine[%s:%s]' % (self.id, self.mac)
 
-    def validate(self):
-        super(Machine, self).validate()
-        try:
-            netaddr.EUI(self.mac)
-        except Exception:
-            raise exception.InvalidParameter(
-                'mac address %s format uncorrect' % self.mac
-            )
+    def update(self):
+        # rows added before mac_int existed are converted when changed.
+        if self.mac_int is None:
+            self.mac = self._mac
+        super(Machine, self).update()
 
     @property
     def patched_ipmi_credentials(self):
@@ -1818,20 +1947,23 @@ class Machine(BASE, HelperMixin, TimestampMixin):
         location.update(value)
         self.location = location
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = {}
-        dict_info['switches'] = [
-            {
-                'switch_ip': switch_machine.switch_ip,
-                'port': switch_machine.port,
-                'vlans': switch_machine.vlans
-            }
-            for switch_machine in self.switch_machines
-            if not switch_machine.filtered
-        ]
-        if dict_info['switches']:
-            dict_info.update(dict_info['switches'][0])
-        dict_info.update(super(Machine, self).to_dict())
+        if self.dict_fields_wanted(
+            fields, 'switches', 'switch_ip', 'port', 'vlans'
+        ):
+            dict_info['switches'] = [
+                {
+                    'switch_ip': switch_machine.switch_ip,
+                    'port': switch_machine.port,
+                    'vlans': switch_machine.vlans
+                }
+                for switch_machine in self.switch_machines
+                if not switch_machine.filtered
+            ]
+            if dict_info['switches']:
+                dict_info.update(dict_info['switches'][0])
+        dict_info.update(super(Machine, self).to_dict(fields))
         return dict_info
 
 
@@ -1846,6 +1978,7 @@ class Switch(BASE, HelperMixin, TimestampMixin):
                         'repolling', 'error', 'under_monitoring',
                         name='switch_state'),
                    ColumnDefault('initialized'))
+    err_msg = Column(Text, nullable=True)
     _filters = Column('filters', JSONEncoded, default=[])
     switch_machines = relationship(
         SwitchMachine,
@@ -1862,19 +1995,19 @@ class Switch(BASE, HelperMixin, TimestampMixin):
         if isinstance(filters, basestring):
             filters = filters.replace('\r\n', '\n').replace('\n', ';')
             filters = [
-                switch_filter for switch_filter in filters.split(';')
-                if switch_filter
+                port_filter for port_filter in filters.split(';')
+                if port_filter
             ]
         if not isinstance(filters, list):
             filters = [filters]
         switch_filters = []
-        for switch_filter in filters:
-            if not switch_filter:
+        for port_filter in filters:
+            if not port_filter:
                 continue
-            if isinstance(switch_filter, basestring):
+            if isinstance(port_filter, basestring):
                 filter_dict = {}
                 filter_items = [
-                    item for item in switch_filter.split() if item
+                    item for item in port_filter.split() if item
                 ]
                 if filter_items[0] in ['allow', 'deny']:
                     filter_dict['filter_type'] = filter_items[0]
@@ -1893,77 +2026,77 @@ class Switch(BASE, HelperMixin, TimestampMixin):
                     else:
                         filter_dict[filter_items[0]] = ''
                         filter_items = filter_items[1:]
-                switch_filter = filter_dict
-            if not isinstance(switch_filter, dict):
+                port_filter = filter_dict
+            if not isinstance(port_filter, dict):
                 raise exception.InvalidParameter(
-                    'filter %s is not dict' % switch_filter
+                    'filter %s is not dict' % port_filter
                 )
-            if 'filter_type' in switch_filter:
-                if switch_filter['filter_type'] not in ['allow', 'deny']:
+            if 'filter_type' in port_filter:
+                if port_filter['filter_type'] not in ['allow', 'deny']:
                     raise exception.InvalidParameter(
                         'filter_type should be `allow` or `deny` in %s' % (
-                            switch_filter
+                            port_filter
                         )
                     )
-            if 'ports' in switch_filter:
-                if isinstance(switch_filter['ports'], basestring):
-                    switch_filter['ports'] = [
+            if 'ports' in port_filter:
+                if isinstance(port_filter['ports'], basestring):
+                    port_filter['ports'] = [
                         port_or_ports
-                        for port_or_ports in switch_filter['ports'].split(',')
+                        for port_or_ports in port_filter['ports'].split(',')
                         if port_or_ports
                     ]
-                if not isinstance(switch_filter['ports'], list):
+                if not isinstance(port_filter['ports'], list):
                     raise exception.InvalidParameter(
-                        '`ports` type is not list in filter %s' % switch_filter
+                        '`ports` type is not list in filter %s' % port_filter
                     )
-                for port_or_ports in switch_filter['ports']:
+                for port_or_ports in port_filter['ports']:
                     if not isinstance(port_or_ports, basestring):
                         raise exception.InvalidParameter(
                             '%s type is not basestring in `ports` %s' % (
-                                port_or_ports, switch_filter['ports']
+                                port_or_ports, port_filter['ports']
                             )
                         )
             for key in ['port_start', 'port_end']:
-                if key in switch_filter:
-                    if isinstance(switch_filter[key], basestring):
-                        if switch_filter[key].isdigit():
-                            switch_filter[key] = int(switch_filter[key])
-                    if not isinstance(switch_filter[key], int):
+                if key in port_filter:
+                    if isinstance(port_filter[key], basestring):
+                        if port_filter[key].isdigit():
+                            port_filter[key] = int(port_filter[key])
+                    if not isinstance(port_filter[key], int):
                         raise exception.InvalidParameter(
                             '`%s` type is not int in filer %s' % (
-                                key, switch_filter
+                                key, port_filter
                             )
                         )
-            switch_filters.append(switch_filter)
+            switch_filters.append(port_filter)
         return switch_filters
 
     @classmethod
     def format_filters(cls, filters):
         filter_strs = []
-        for switch_filter in filters:
+        for port_filter in filters:
             filter_properties = []
             filter_properties.append(
-                switch_filter.get('filter_type', 'allow')
+                port_filter.get('filter_type', 'allow')
             )
-            if 'ports' in switch_filter:
+            if 'ports' in port_filter:
                 filter_properties.append(
-                    'ports ' + ','.join(switch_filter['ports'])
+                    'ports ' + ','.join(port_filter['ports'])
                 )
-            if 'port_prefix' in switch_filter:
+            if 'port_prefix' in port_filter:
                 filter_properties.append(
-                    'port_prefix ' + switch_filter['port_prefix']
+                    'port_prefix ' + port_filter['port_prefix']
                 )
-            if 'port_suffix' in switch_filter:
+            if 'port_suffix' in port_filter:
                 filter_properties.append(
-                    'port_suffix ' + switch_filter['port_suffix']
+                    'port_suffix ' + port_filter['port_suffix']
                 )
-            if 'port_start' in switch_filter:
+            if 'port_start' in port_filter:
                 filter_properties.append(
-                    'port_start ' + str(switch_filter['port_start'])
+                    'port_start ' + str(port_filter['port_start'])
                 )
-            if 'port_end' in switch_filter:
+            if 'port_end' in port_filter:
                 filter_properties.append(
-                    'port_end ' + str(switch_filter['port_end'])
+                    'port_end ' + str(port_filter['port_end'])
                 )
             filter_strs.append(' '.join(filter_properties))
         return ';'.join(filter_strs)
@@ -2000,6 +2133,17 @@ class Switch(BASE, HelperMixin, TimestampMixin):
         if not value:
             return
         self._filters = self.parse_filters(value)
+        self._filters_changed = True
+
+    @property
+    def filter_matcher(self):
+        """Matcher compiled from the filters, kept until they change."""
+        filters = self._filters
+        cached = getattr(self, '_cached_filter_matcher', None)
+        if not cached or cached[0] is not filters:
+            cached = (filters, switch_filter.get_matcher(filters))
+            self._cached_filter_matcher = cached
+        return cached[1]
 
     @property
     def put_filters(self):
@@ -2010,6 +2154,7 @@ class Switch(BASE, HelperMixin, TimestampMixin):
         if not value:
             return
         self._filters = self.parse_filters(value)
+        self._filters_changed = True
 
     @property
     def patched_filters(self):
@@ -2022,7 +2167,47 @@ class Switch(BASE, HelperMixin, TimestampMixin):
         filters = list(self.filters)
         self.filters = self.parse_filters(value) + filters
 
-    def to_dict(self):
+    def update_switch_machines_filtered(self):
+        """Recompute the filtered flag of all the machines of the switch.
+
+        Each distinct port is matched once and all the flags are set
+        by a single update statement. An empty port is matched as '',
+        and no flag is left empty.
+        """
+        query = object_session(self).query(SwitchMachine).filter_by(
+            switch_id=self.id
+        )
+        ports = [
+            port for port, in query.with_entities(
+                SwitchMachine.port
+            ).distinct()
+        ]
+        if not ports:
+            return
+        filtered_ports = [
+            port for port in ports if self.filter_matcher.filtered(port)
+        ]
+        conditions = []
+        if None in filtered_ports:
+            filtered_ports.remove(None)
+            conditions.append(SwitchMachine.port.is_(None))
+        if filtered_ports:
+            conditions.append(SwitchMachine.port.in_(filtered_ports))
+        if conditions:
+            filtered = case([(or_(*conditions), True)], else_=False)
+        else:
+            filtered = False
+        query.update(
+            {'filtered': filtered}, synchronize_session='fetch'
+        )
+
+    def update(self):
+        if getattr(self, '_filters_changed', False):
+            self._filters_changed = False
+            self.update_switch_machines_filtered()
+        super(Switch, self).update()
+
+    def to_dict(self, fields=None):
         dict_info = super(Switch, self).to_dict()
         dict_info['ip'] = self.ip
         dict_info['filters'] = self.format_filters(self._filters)
@@ -2114,7 +2299,7 @@ class AdapterOS(BASE, HelperMixin):
         self.adapter_id = adapter_id
         super(AdapterOS, self).__init__(**kwargs)
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = self.os.to_dict()
         dict_info.update(super(AdapterOS, self).to_dict())
         return dict_info
@@ -2233,7 +2418,7 @@ class AdapterFlavorRole(BASE, HelperMixin):
                 )
             )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(AdapterFlavorRole, self).to_dict()
         dict_info.update(
             self.role.to_dict()
@@ -2408,7 +2593,7 @@ class AdapterFlavor(BASE, HelperMixin):
                 'template is not set in adapter flavor %s' % self.id
             )
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(AdapterFlavor, self).to_dict()
         dict_info['roles'] = [
             flavor_role.to_dict()
@@ -2706,7 +2891,7 @@ class Adapter(BASE, HelperMixin):
         else:
             return []
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(Adapter, self).to_dict()
         dict_info.update({
             'supported_oses': [
@@ -2834,7 +3019,7 @@ class Subnet(BASE, TimestampMixin, HelperMixin):
     def __str__(self):
         return 'Subnet[%s:%s]' % (self.id, self.subnet)
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         dict_info = super(Subnet, self).to_dict()
         if not self.name:
             dict_info['name'] = self.subnet
@@ -0,0 +1,191 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compiled matcher of switch port filters.
+
+Switch filters are evaluated in order and the first matching filter
+decides if a port is filtered. When no filter matches, the port is
+filtered only if the last filter is an allow filter. A matcher keeps
+the index of the first filter matching each exact port, each port
+range and each port prefix and suffix pair, so that matching a port
+is a dict lookup plus a bisect in a table of disjoint port intervals.
+"""
+import bisect
+import collections
+import heapq
+import re
+import simplejson as json
+import threading
+
+from compass.utils import setting_wrapper as setting
+
+
+PORT_PATTERN = re.compile(r'(\D*)(\d+)(\D*)')
+PORTS_PATTERN = re.compile(r'(\D*)(\d+)-(\d+)(\D*)')
+PORT_NUMBER_PATTERN = re.compile(r'\d+')
+
+
+def parse_port(port):
+    """Parse port to (prefix, number, suffix), None if it has no number."""
+    port_match = PORT_PATTERN.match(port)
+    if not port_match:
+        return None
+    return (
+        port_match.group(1), int(port_match.group(2)), port_match.group(3)
+    )
+
+
+def split_port(port):
+    """Split port to a (head, number, tail) part for each of its numbers.
+
+    head is the port before the number and tail the port after it, e.g.
+    ge1/0/3 is split to [('ge', 1, '/0/3'), ('ge1/', 0, '/3'),
+    ('ge1/0/', 3, '')]. A port without number has no parts.
+    """
+    return [
+        (port[:match.start()], int(match.group()), port[match.end():])
+        for match in PORT_NUMBER_PATTERN.finditer(port)
+    ]
+
+
+def _build_interval_table(intervals):
+    """Split (start, end, index) intervals into disjoint segments.
+
+    Returns the sorted segment starts and the smallest index of the
+    intervals covering each segment, None for uncovered segments.
+    """
+    points = sorted(set(
+        [start for start, _, _ in intervals] +
+        [end + 1 for _, end, _ in intervals]
+    ))
+    intervals = sorted(intervals)
+    starts = []
+    indexes = []
+    covering = []
+    position = 0
+    for point in points:
+        while position < len(intervals) and intervals[position][0] <= point:
+            _, end, index = intervals[position]
+            heapq.heappush(covering, (index, end))
+            position += 1
+        while covering and covering[0][1] < point:
+            heapq.heappop(covering)
+        starts.append(point)
+        indexes.append(covering[0][0] if covering else None)
+    return starts, indexes
+
+
+class SwitchFilterMatcher(object):
+    """Executable form of a list of switch filters."""
+
+    def __init__(self, filters):
+        self.denied = [
+            switch_filter.get('filter_type', 'allow') != 'allow'
+            for switch_filter in filters
+        ]
+        self.unmatched_filtered = bool(filters) and not self.denied[-1]
+        self.all_index = None
+        self.exact_indexes = {}
+        intervals = {}
+        for index, switch_filter in enumerate(filters):
+            if 'ports' in switch_filter:
+                for port_or_ports in switch_filter['ports']:
+                    if port_or_ports == 'all':
+                        if self.all_index is None:
+                            self.all_index = index
+                        continue
+                    self.exact_indexes.setdefault(port_or_ports, index)
+                    ports_match = PORTS_PATTERN.match(port_or_ports)
+                    if ports_match:
+                        intervals.setdefault(
+                            (ports_match.group(1), ports_match.group(4)), []
+                        ).append((
+                            int(ports_match.group(2)),
+                            int(ports_match.group(3)), index
+                        ))
+            else:
+                intervals.setdefault(
+                    (
+                        switch_filter.get('port_prefix', ''),
+                        switch_filter.get('port_suffix', '')
+                    ), []
+                ).append((
+                    switch_filter.get('port_start', float('-inf')),
+                    switch_filter.get('port_end', float('inf')), index
+                ))
+        self.interval_tables = dict([
+            (key, _build_interval_table(key_intervals))
+            for key, key_intervals in intervals.items()
+        ])
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def _first_index(self, port):
+        indexes = []
+        if self.all_index is not None:
+            indexes.append(self.all_index)
+        if port in self.exact_indexes:
+            indexes.append(self.exact_indexes[port])
+        parsed_port = parse_port(port)
+        if parsed_port:
+            prefix, number, suffix = parsed_port
+            table = self.interval_tables.get((prefix, suffix))
+            if table:
+                starts, table_indexes = table
+                position = bisect.bisect_right(starts, number) - 1
+                if position >= 0 and table_indexes[position] is not None:
+                    indexes.append(table_indexes[position])
+        if indexes:
+            return min(indexes)
+        return None
+
+    def filtered(self, port):
+        """Check if port is filtered, the result is cached per port."""
+        port = port or ''
+        with self.lock:
+            if port in self.results:
+                return self.results[port]
+        index = self._first_index(port)
+        if index is None:
+            result = self.unmatched_filtered
+        else:
+            result = self.denied[index]
+        with self.lock:
+            if len(self.results) < setting.SWITCH_FILTER_RESULT_CACHE_SIZE:
+                self.results[port] = result
+        return result
+
+
+MATCHERS = collections.OrderedDict()
+MATCHERS_LOCK = threading.Lock()
+
+
+def get_matcher(filters):
+    """Get the matcher compiled from filters.
+
+    Matchers are shared by the switches with the same filters and
+    kept in an LRU of setting.SWITCH_FILTER_MATCHER_CACHE_SIZE.
+    """
+    key = json.dumps(filters or [], sort_keys=True)
+    with MATCHERS_LOCK:
+        matcher = MATCHERS.pop(key, None)
+        if matcher:
+            MATCHERS[key] = matcher
+            return matcher
+    matcher = SwitchFilterMatcher(filters or [])
+    with MATCHERS_LOCK:
+        MATCHERS[key] = matcher
+        while len(MATCHERS) > setting.SWITCH_FILTER_MATCHER_CACHE_SIZE:
+            MATCHERS.popitem(last=False)
+    return matcher
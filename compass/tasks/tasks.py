@@ -17,9 +17,13 @@
    .. moduleauthor:: Xiaodong Wang <xiaodongwang@huawei.com>
 """
 import logging
+import os
+import time
 
 from celery.signals import celeryd_init
 from celery.signals import setup_logging
+from celery.signals import task_postrun
+from celery.signals import task_prerun
 
 from compass.actions import clean
 from compass.actions import delete
@@ -30,13 +34,18 @@ from compass.actions import update_progress
 from compass.db.api import adapter_holder as adapter_api
 from compass.db.api import database
 from compass.db.api import metadata_holder as metadata_api
+from compass.db.api import statement_stats
 
 from compass.tasks.client import celery
 from compass.utils import flags
 from compass.utils import logsetting
+from compass.utils import metrics
 from compass.utils import setting_wrapper as setting
 
 
+METRICS_PUSHED_TIME = 0
+
+
 @celeryd_init.connect()
 def global_celery_init(**_):
     """Initialization code."""
@@ -56,6 +65,61 @@ def tasks_setup_logging(**_):
     logsetting.init()
 
 
+@task_prerun.connect()
+def start_task_statement_stats(task=None, **_):
+    """Collect sql statement stats of the task in its request context."""
+    task.request.metrics_start_time = time.time()
+    if setting.SQL_STATS_ENABLED:
+        task.request.statement_stats = statement_stats.start(
+            'task %s' % task.name, logging.INFO
+        )
+
+
+@task_postrun.connect()
+def stop_task_statement_stats(task=None, state=None, **_):
+    stats = getattr(task.request, 'statement_stats', None)
+    if stats:
+        statement_stats.stop(stats)
+    start_time = getattr(task.request, 'metrics_start_time', None)
+    if start_time is not None:
+        metrics.REGISTRY.observe(
+            'compass_task_duration_seconds', 'Run time of celery tasks.',
+            time.time() - start_time, task=task.name, state=state
+        )
+        if stats:
+            metrics.REGISTRY.observe(
+                'compass_task_sql_statements',
+                'Sql statements executed by celery tasks.',
+                stats.count, setting.METRICS_SQL_COUNT_BUCKETS,
+                task=task.name
+            )
+        _push_task_metrics()
+
+
+def _push_task_metrics():
+    """Write the task metrics of this worker to its push file.
+
+    Each worker process writes its own file at most every
+    setting.METRICS_PUSH_INTERVAL seconds.
+    """
+    global METRICS_PUSHED_TIME
+    if not setting.METRICS_PUSH_DIR:
+        return
+    now = time.time()
+    if now - METRICS_PUSHED_TIME < setting.METRICS_PUSH_INTERVAL:
+        return
+    METRICS_PUSHED_TIME = now
+    try:
+        metrics.write_push_file(
+            metrics.REGISTRY, os.path.join(
+                setting.METRICS_PUSH_DIR,
+                'compass_tasks_%s.prom' % os.getpid()
+            )
+        )
+    except Exception as error:
+        logging.error('failed to push task metrics: %s', error)
+
+
 @celery.task(name='compass.tasks.pollswitch')
 def pollswitch(
     poller_email, ip_addr, credentials,
@@ -15,12 +15,20 @@
 # limitations under the License.
 
 """test api module."""
+import BaseHTTPServer
 import celery
 import copy
+import gzip
 import mock
 import os
 import simplejson as json
+import SocketServer
+import threading
+import time
 import unittest2
+import urlparse
+
+from cStringIO import StringIO
 
 
 os.environ['COMPASS_IGNORE_SETTING'] = 'true'
@@ -36,7 +44,9 @@ from compass.db.api import cluster as cluster_api
 from compass.db.api import database
 from compass.db.api import host as host_api
 from compass.db.api import metadata_holder as metadata_api
+from compass.db.api import statement_stats
 from compass.db.api import user as user_api
+from compass.db.api import utils as db_utils
 from compass.db.models import User
 from compass.utils import flags
 from compass.utils import logsetting
@@ -62,6 +72,7 @@ class ApiTestCase(unittest2.TestCase):
             os.path.dirname(os.path.abspath(__file__)),
             'data'
         )
+        setting.USER_LOG_ASYNC = False
         database.init('sqlite://')
         database.create_db()
         adapter_api.load_adapters()
@@ -233,6 +244,368 @@ class TestAuth(ApiTestCase):
         self.assertIn("failed to login", return_value.get_data())
 
 
+class TestStatementStatsAPI(ApiTestCase):
+    """Test sql statement stats of api requests."""
+
+    def setUp(self):
+        super(TestStatementStatsAPI, self).setUp()
+        setting.SQL_STATS_ENABLED = True
+        setting.SQL_STATS_HEADER_ENABLED = True
+        statement_stats.instrument(database.ENGINE)
+
+    def tearDown(self):
+        super(TestStatementStatsAPI, self).tearDown()
+
+    def test_stats_header(self):
+        return_value = self.get('/clusters')
+        self.assertEqual(return_value.status_code, 200)
+        self.assertIn('X-Sql-Stats', return_value.headers)
+        self.assertNotIn(
+            'count=0;', return_value.headers['X-Sql-Stats']
+        )
+
+    def test_no_stats_header(self):
+        setting.SQL_STATS_HEADER_ENABLED = False
+        return_value = self.get('/clusters')
+        self.assertNotIn('X-Sql-Stats', return_value.headers)
+
+
+class TestJsonResponseAPI(ApiTestCase):
+    """Test json format, gzip and etag of api responses."""
+
+    def setUp(self):
+        super(TestJsonResponseAPI, self).setUp()
+
+    def tearDown(self):
+        super(TestJsonResponseAPI, self).tearDown()
+
+    def test_compact_json(self):
+        return_value = self.get('/users')
+        self.assertNotIn('\n ', return_value.get_data())
+        return_value = self.get('/users?pretty')
+        self.assertIn('\n    ', return_value.get_data())
+        self.assertEqual(1, len(json.loads(return_value.get_data())))
+
+    def test_not_modified(self):
+        return_value = self.get('/clusters/1/state')
+        self.assertEqual(200, return_value.status_code)
+        etag = return_value.headers['ETag']
+        return_value = self.test_client.get(
+            '/clusters/1/state', headers={
+                setting.USER_AUTH_HEADER_NAME: self.token,
+                'If-None-Match': etag
+            }
+        )
+        self.assertEqual(304, return_value.status_code)
+        self.assertEqual('', return_value.get_data())
+
+    def test_progress_not_modified_before_loading(self):
+        return_value = self.get('/clusters/1/progress')
+        self.assertEqual(200, return_value.status_code)
+        etag = return_value.headers['ETag']
+        with mock.patch.object(
+            cluster_api, '_get_cluster_progress',
+            side_effect=AssertionError('progress loaded')
+        ):
+            return_value = self.test_client.get(
+                '/clusters/1/progress', headers={
+                    setting.USER_AUTH_HEADER_NAME: self.token,
+                    'If-None-Match': etag
+                }
+            )
+        self.assertEqual(304, return_value.status_code)
+        cluster_api.update_cluster_state(
+            1, state='INSTALLING',
+            user=user_api.get_user_object(setting.COMPASS_ADMIN_EMAIL)
+        )
+        return_value = self.test_client.get(
+            '/clusters/1/progress', headers={
+                setting.USER_AUTH_HEADER_NAME: self.token,
+                'If-None-Match': etag
+            }
+        )
+        self.assertEqual(200, return_value.status_code)
+        self.assertNotEqual(etag, return_value.headers['ETag'])
+
+    def test_gzip(self):
+        setting.API_GZIP_MIN_SIZE = 1
+        return_value = self.test_client.get(
+            '/clusters', headers={
+                setting.USER_AUTH_HEADER_NAME: self.token,
+                'Accept-Encoding': 'gzip'
+            }
+        )
+        self.assertEqual('gzip', return_value.headers['Content-Encoding'])
+        self.assertTrue(return_value.headers['ETag'].endswith('-gzip"'))
+        resp = json.loads(
+            gzip.GzipFile(
+                fileobj=StringIO(return_value.get_data())
+            ).read()
+        )
+        self.assertEqual(2, len(resp))
+
+
+class ProxyStubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stub of the proxied server."""
+
+    protocol_version = 'HTTP/1.1'
+    connections = []
+    GZIPPED_BODY = StringIO()
+    with gzip.GzipFile(fileobj=GZIPPED_BODY, mode='wb') as gzip_file:
+        gzip_file.write(json.dumps({'name': 'stub'}))
+    GZIPPED_BODY = GZIPPED_BODY.getvalue()
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connections.append(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status_code, body, headers={}):
+        self.send_response(status_code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        self._respond(200, self.GZIPPED_BODY, {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'X-Stub-Path': self.path
+        })
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self._respond(201, body, {'Content-Type': 'application/json'})
+
+
+class ProxyStubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestProxyAPI(ApiTestCase):
+    """Test proxy api passthrough to a stub server."""
+
+    def setUp(self):
+        super(TestProxyAPI, self).setUp()
+        ProxyStubHandler.connections = []
+        self.server = ProxyStubServer(('127.0.0.1', 0), ProxyStubHandler)
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever
+        )
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        setting.PROXY_URL_PREFIX = 'http://127.0.0.1:%s' % (
+            self.server.server_address[1]
+        )
+
+    def tearDown(self):
+        from compass.api import api as compass_api
+        compass_api.PROXY_SESSION.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestProxyAPI, self).tearDown()
+
+    def test_passthrough(self):
+        return_value = self.get('/proxy/stub?name=test')
+        self.assertEqual(200, return_value.status_code)
+        self.assertEqual('gzip', return_value.headers['Content-Encoding'])
+        self.assertEqual(
+            '/stub?name=test', return_value.headers['X-Stub-Path']
+        )
+        self.assertEqual(
+            ProxyStubHandler.GZIPPED_BODY, return_value.get_data()
+        )
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            return_value = self.get('/proxy/stub')
+            self.assertEqual(200, return_value.status_code)
+            # the connection is released once the body is consumed.
+            return_value.get_data()
+        self.assertEqual(1, len(ProxyStubHandler.connections))
+
+    def test_post(self):
+        return_value = self.post('/proxy/stub', {'name': 'test'})
+        self.assertEqual(201, return_value.status_code)
+        self.assertEqual({'name': 'test'}, json.loads(return_value.get_data()))
+
+    def test_timeout(self):
+        setting.PROXY_READ_TIMEOUT = 0.1
+        return_value = self.get('/proxy/slow')
+        self.assertEqual(504, return_value.status_code)
+
+
+class TestMetricsAPI(ApiTestCase):
+    """Test prometheus metrics of api requests."""
+
+    def setUp(self):
+        super(TestMetricsAPI, self).setUp()
+
+    def tearDown(self):
+        super(TestMetricsAPI, self).tearDown()
+
+    def test_request_metrics(self):
+        self.get('/clusters')
+        return_value = self.test_client.get(
+            '/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}
+        )
+        self.assertEqual(200, return_value.status_code)
+        lines = return_value.get_data().splitlines()
+        self.assertIn(
+            '# TYPE compass_api_request_duration_seconds histogram', lines
+        )
+        self.assertTrue([
+            line for line in lines
+            if line.startswith('compass_api_requests_total{') and
+            'route="/clusters"' in line and 'status="200"' in line
+        ])
+        self.assertIn('compass_api_requests_in_flight 1.0', lines)
+        self.assertIn('# TYPE compass_db_pool gauge', lines)
+
+    def test_forbidden(self):
+        setting.METRICS_ALLOWED_ADDRESSES = []
+        return_value = self.test_client.get('/metrics')
+        self.assertEqual(403, return_value.status_code)
+
+
+class TestBatchAPI(ApiTestCase):
+    """Test batch of sub requests."""
+
+    def setUp(self):
+        super(TestBatchAPI, self).setUp()
+
+    def tearDown(self):
+        super(TestBatchAPI, self).tearDown()
+
+    def _get_cluster_name(self, cluster_id):
+        return json.loads(
+            self.get('/clusters/%s' % cluster_id).get_data()
+        )['name']
+
+    def test_atomic(self):
+        return_value = self.post('/batch', {
+            'requests': [
+                {
+                    'method': 'PUT', 'path': '/clusters/1',
+                    'body': {'name': 'batch_cluster1'}
+                },
+                {'method': 'GET', 'path': '/clusters/1'}
+            ]
+        })
+        self.assertEqual(200, return_value.status_code)
+        resp = json.loads(return_value.get_data())
+        self.assertTrue(resp['committed'])
+        self.assertEqual(
+            [200, 200], [item['status'] for item in resp['responses']]
+        )
+        self.assertEqual(
+            'batch_cluster1', resp['responses'][1]['body']['name']
+        )
+        self.assertEqual('batch_cluster1', self._get_cluster_name(1))
+
+    def test_atomic_rollback(self):
+        return_value = self.post('/batch', {
+            'requests': [
+                {
+                    'method': 'PUT', 'path': '/clusters/1',
+                    'body': {'name': 'batch_cluster1'}
+                },
+                {
+                    'method': 'PUT', 'path': '/clusters/99',
+                    'body': {'name': 'batch_cluster99'}
+                },
+                {
+                    'method': 'PUT', 'path': '/clusters/2',
+                    'body': {'name': 'batch_cluster2'}
+                }
+            ]
+        })
+        resp = json.loads(return_value.get_data())
+        self.assertFalse(resp['committed'])
+        self.assertEqual(
+            [200, 404], [item['status'] for item in resp['responses']]
+        )
+        self.assertEqual('test_cluster1', self._get_cluster_name(1))
+        self.assertEqual('test_cluster2', self._get_cluster_name(2))
+
+    def test_best_effort(self):
+        return_value = self.post('/batch', {
+            'mode': 'best_effort',
+            'requests': [
+                {
+                    'method': 'PUT', 'path': '/clusters/99',
+                    'body': {'name': 'batch_cluster99'}
+                },
+                {
+                    'method': 'PUT', 'path': '/clusters/2',
+                    'body': {'name': 'batch_cluster2'}
+                }
+            ]
+        })
+        resp = json.loads(return_value.get_data())
+        self.assertEqual(
+            [404, 200], [item['status'] for item in resp['responses']]
+        )
+        self.assertEqual('batch_cluster2', self._get_cluster_name(2))
+
+    def test_invalid_requests(self):
+        for items in [
+            [{'method': 'GET', 'path': '/batch'}],
+            [{'method': 'HEAD', 'path': '/clusters'}],
+            [{'method': 'GET'}]
+        ]:
+            return_value = self.post('/batch', {'requests': items})
+            self.assertEqual(400, return_value.status_code)
+
+
+class TestReadinessAPI(ApiTestCase):
+    """Test production app warm up and readiness."""
+
+    def setUp(self):
+        super(TestReadinessAPI, self).setUp()
+        from compass.api import api as compass_api
+        self.compass_api = compass_api
+
+    def tearDown(self):
+        self.compass_api.READY = False
+        self.compass_api.WARMING_UP = False
+        self.compass_api.WARM_UP_TIME = None
+        self.compass_api.app.debug = True
+        super(TestReadinessAPI, self).tearDown()
+
+    def test_create_app(self):
+        self.assertEqual(503, self.test_client.get('/ready').status_code)
+        setting.USER_TOKEN_SECRET_KEY = 'secret'
+        app = self.compass_api.create_app()
+        self.assertFalse(app.debug)
+        return_value = self.test_client.get('/ready')
+        self.assertEqual(200, return_value.status_code)
+        resp = json.loads(return_value.get_data())
+        self.assertTrue(resp['ready'])
+        self.assertIsNotNone(resp['warm_up_time'])
+        self.assertTrue(all([
+            profile._options is not None
+            for profile in db_utils.LOADING_PROFILES
+        ]))
+
+    def test_create_app_without_secret_key(self):
+        self.assertRaises(Exception, self.compass_api.create_app)
+        self.assertFalse(self.compass_api.READY)
+
+    def test_not_ready(self):
+        self.compass_api.WARMING_UP = True
+        self.assertEqual(503, self.get('/clusters').status_code)
+        self.assertEqual(503, self.test_client.get('/ready').status_code)
+        self.compass_api.READY = True
+        self.assertEqual(200, self.get('/clusters').status_code)
+
+
 class TestUserAPI(ApiTestCase):
     """Test user api."""
 
@@ -839,6 +1212,27 @@ class TestHostAPI(ApiTestCase):
         resp = json.loads(return_value.get_data())
         self.assertEqual([], resp)
 
+    def test_list_hosts_fields(self):
+        url = '/hosts?fields=id,name&fields=networks'
+        return_value = self.get(url)
+        self.assertEqual(return_value.status_code, 200)
+        resp = json.loads(return_value.get_data())
+        for host in resp:
+            self.assertEqual(
+                sorted(host.keys()), ['id', 'name', 'networks']
+            )
+
+        # the marker key is kept when paging
+        url = '/hosts?fields=name&limit=1'
+        return_value = self.get(url)
+        resp = json.loads(return_value.get_data())
+        self.assertEqual(sorted(resp[0].keys()), ['id', 'name'])
+
+        # unsupported field
+        url = '/hosts?fields=os_config'
+        return_value = self.get(url)
+        self.assertEqual(return_value.status_code, 400)
+
     def test_show_host(self):
         # show a host successfully
         url = '/hosts/1'
@@ -954,6 +1348,53 @@ class TestSwitchMachines(ApiTestCase):
         resp = json.loads(return_value.get_data())
         self.assertEqual(resp, [])
 
+    def test_list_switch_machines_paginated(self):
+        url = '/switches/2/machines?limit=1'
+        return_value = self.get(url)
+        self.assertEqual(return_value.status_code, 200)
+        resp = json.loads(return_value.get_data())
+        self.assertEqual(len(resp), 1)
+        self.assertIn('Link', return_value.headers)
+        next_url = return_value.headers['Link'].split(';')[0].strip('<>')
+        self.assertIn(
+            'marker=%s' % resp[0]['switch_machine_id'], next_url
+        )
+        next_url = urlparse.urlsplit(next_url)
+        return_value = self.get(
+            '%s?%s' % (next_url.path, next_url.query)
+        )
+        next_resp = json.loads(return_value.get_data())
+        self.assertEqual(len(next_resp), 1)
+        self.assertNotEqual(
+            next_resp[0]['switch_machine_id'], resp[0]['switch_machine_id']
+        )
+
+        # the last page has no next page link
+        url = '/switches/2/machines?limit=3'
+        return_value = self.get(url)
+        self.assertEqual(len(json.loads(return_value.get_data())), 2)
+        self.assertNotIn('Link', return_value.headers)
+
+        # invalid limit
+        url = '/switches/2/machines?limit=xxx'
+        return_value = self.get(url)
+        self.assertEqual(return_value.status_code, 400)
+
+    def test_list_switch_machines_stream(self):
+        url = '/switches/2/machines?stream=true&limit=1'
+        return_value = self.get(url)
+        self.assertEqual(return_value.status_code, 200)
+        self.assertEqual(return_value.mimetype, 'application/json')
+        resp = json.loads(return_value.get_data())
+        self.assertEqual(
+            sorted([switch_machine['mac'] for switch_machine in resp]),
+            ['00:0c:29:bf:eb:1d', '28:6e:d4:46:c4:25']
+        )
+
+        url = '/switches/99/machines?stream=true'
+        return_value = self.get(url)
+        self.assertEqual(json.loads(return_value.get_data()), [])
+
     def test_add_switch_machine(self):
         # add a switch machine successfully
         url = '/switches/2/machines'
@@ -13,11 +13,14 @@
 # limitations under the License.
 
 
+import contextlib
 import datetime
 import logging
 import os
 import unittest2
 
+from sqlalchemy import event
+
 
 os.environ['COMPASS_IGNORE_SETTING'] = 'true'
 
@@ -36,6 +39,36 @@ from compass.utils import flags
 from compass.utils import logsetting
 
 
+@contextlib.contextmanager
+def count_statements():
+    """Collect the sql statements executed in the block."""
+    statements = []
+
+    def _record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.ENGINE, 'before_cursor_execute', _record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(
+            database.ENGINE, 'before_cursor_execute', _record_statement
+        )
+
+
+@contextlib.contextmanager
+def assert_max_statements(test_case, max_statements):
+    """Assert at most max_statements sql statements run in the block."""
+    with count_statements() as statements:
+        yield statements
+    test_case.assertLessEqual(
+        len(statements), max_statements,
+        '%s statements executed, expected at most %s:\n%s' % (
+            len(statements), max_statements, '\n'.join(statements)
+        )
+    )
+
+
 class BaseTest(unittest2.TestCase):
     """Base Class for unit test."""
 
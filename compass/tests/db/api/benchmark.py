@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks of db api hot paths.
+
+Timings depend on the machine they run on, so the unit tests only
+check behavior and the timings are reported here instead:
+
+    python -m compass.tests.db.api.benchmark
+
+Each benchmark reuses the fixtures of the matching test case.
+"""
+import time
+import unittest2
+
+from compass.tests.db.api import test_cluster
+from compass.tests.db.api import test_machine
+from compass.tests.db.api import test_metadata_holder
+from compass.tests.db.api import test_switch
+from compass.tests.db.api import test_utils
+from compass.utils import flags
+from compass.utils import logsetting
+
+
+def measure(func, repeat=3):
+    """Get the best wall clock time of func in repeat runs."""
+    durations = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+class ClusterBenchmark(test_cluster.TestClusterLargeConfig):
+    """Benchmark listing clusters with large configs."""
+
+    def benchmark_list_clusters_large_config(self):
+        encoded_config = test_cluster.models.json.dumps(self.large_config)
+
+        def list_clusters():
+            for _ in range(5):
+                test_cluster.cluster.list_clusters(user=self.user_object)
+
+        def decode_configs():
+            for _ in range(5):
+                # each listed cluster has two large configs.
+                for _ in range(4):
+                    test_cluster.models.json.loads(encoded_config)
+
+        large_duration = measure(list_clusters)
+        decoding_duration = measure(decode_configs)
+        with test_cluster.database.session() as session:
+            for cluster_object in session.query(test_cluster.models.Cluster):
+                cluster_object.os_config = {}
+                cluster_object.package_config = {}
+        small_duration = measure(list_clusters)
+        print (
+            'list clusters 5 times: large config %.4fs small config %.4fs '
+            'config decoding %.4fs' % (
+                large_duration, small_duration, decoding_duration
+            )
+        )
+
+
+class AddDbObjectsBenchmark(test_utils.TestAddDbObjects):
+    """Benchmark importing machines one by one and in batch."""
+
+    def benchmark_import_machines(self):
+        one_by_one_duration = measure(lambda: self._import_machines(
+            self._add_machines_one_by_one, 1000, 0
+        ), repeat=1)
+        batch_duration = measure(lambda: self._import_machines(
+            self._add_machines_in_batch, 10000, 1000
+        ), repeat=1)
+        print (
+            'import machines: 1000 one by one %.4fs '
+            '10000 in batch %.4fs' % (one_by_one_duration, batch_duration)
+        )
+
+
+class MachineMacBenchmark(test_machine.TestMachineMac):
+    """Benchmark looking up machines by mac among many."""
+
+    def benchmark_lookup(self):
+        count = 100000
+        macs = self._add_switch_machines(count)
+
+        def lookup():
+            for mac in macs:
+                test_machine.machine.list_machines(self.user_object, mac=mac)
+
+        def join():
+            test_machine.switch.list_switchmachines(
+                user=self.user_object, mac=macs
+            )
+
+        print (
+            'mac lookup of %s machines among %s: %.4fs, switch machines '
+            'join %.4fs' % (
+                len(macs), count, measure(lookup, repeat=1),
+                measure(join, repeat=1)
+            )
+        )
+
+
+class UIMetadataBenchmark(test_metadata_holder.TestGetUIMetadata):
+    """Benchmark getting os ui metadata from configs and snapshots."""
+
+    def benchmark_ui_metadata(self):
+        def get_ui_metadata(func):
+            def calls():
+                for _ in range(10):
+                    func()
+            return calls
+
+        print (
+            'get os ui metadata 10 times: from configs %.4fs '
+            'from snapshot %.4fs' % (
+                measure(get_ui_metadata(
+                    self._get_os_ui_metadata_by_configs
+                )),
+                measure(get_ui_metadata(
+                    lambda: test_metadata_holder.metadata.get_os_ui_metadata(
+                        self.os_id, user=self.user_object
+                    )
+                ))
+            )
+        )
+
+
+class SwitchFilterBenchmark(test_switch.TestSwitchFilterMatcher):
+    """Benchmark matching ports against many switch filters."""
+
+    def benchmark_large_filters(self):
+        filters, ports = self._get_large_filters()
+        matchers = []
+
+        def match():
+            for port in ports:
+                matchers[0].filtered(port)
+
+        compile_duration = measure(lambda: matchers.append(
+            test_switch.switch_filter.SwitchFilterMatcher(filters)
+        ), repeat=1)
+        match_duration = measure(match, repeat=1)
+        cached_duration = measure(match, repeat=1)
+        print (
+            'switch filters of %s rules on %s ports: compile %.4fs '
+            'match %.4fs cached %.4fs' % (
+                len(filters), len(ports),
+                compile_duration, match_duration, cached_duration
+            )
+        )
+
+
+class SupportedFiltersBenchmark(test_utils.TestSupportedFilters):
+    """Benchmark the call overhead of supported_filters."""
+
+    def benchmark_call_overhead(self):
+        uncompiled, compiled = self._get_filter_wrappers()
+
+        def call(func):
+            def calls():
+                for _ in range(2000):
+                    func(1, user=None, name='a', alias='b', id=1)
+            return calls
+
+        print (
+            'supported_filters 2000 calls: uncompiled %.4fs '
+            'compiled %.4fs' % (
+                measure(call(uncompiled)), measure(call(compiled))
+            )
+        )
+
+
+if __name__ == '__main__':
+    flags.init()
+    logsetting.init()
+    loader = unittest2.TestLoader()
+    loader.testMethodPrefix = 'benchmark'
+    unittest2.TextTestRunner(verbosity=2).run(
+        loader.loadTestsFromName(__name__)
+    )
@@ -13,11 +13,13 @@
 # limitations under the License.
 
 
+import copy
 import datetime
 import logging
 import mock
 import os
 import sys
+import time
 import unittest2
 
 
@@ -28,7 +30,9 @@ from compass.utils import setting_wrapper as setting
 reload(setting)
 
 
+from base import assert_max_statements
 from base import BaseTest
+from base import count_statements
 from compass.db.api import adapter as adapter_api
 from compass.db.api import adapter_holder as adapter
 from compass.db.api import cluster
@@ -41,6 +45,7 @@ from compass.db.api import network
 from compass.db.api import switch
 from compass.db.api import user as user_api
 from compass.db import exception
+from compass.db import models
 from compass.utils import flags
 from compass.utils import logsetting
 from compass.utils import util
@@ -277,6 +282,67 @@ class TestListClusters(ClusterTestCase):
             self.assertIn(expect, result)
 
 
+class TestClusterLargeConfig(ClusterTestCase):
+    """Test clusters with large configs."""
+
+    def setUp(self):
+        super(TestClusterLargeConfig, self).setUp()
+        self.large_config = dict([
+            ('key%s' % i, {'value': 'x' * 64, 'index': i})
+            for i in range(2000)
+        ])
+        with database.session() as session:
+            for cluster_object in session.query(models.Cluster):
+                cluster_object.os_config = self.large_config
+                cluster_object.package_config = self.large_config
+
+    def tearDown(self):
+        super(TestClusterLargeConfig, self).tearDown()
+
+    def test_config_decoded_once_on_access(self):
+        with database.session() as session:
+            cluster_object = session.query(models.Cluster).first()
+            with mock.patch.object(
+                models.json, 'loads', wraps=models.json.loads
+            ) as mock_loads:
+                self.assertIsNotNone(cluster_object.name)
+                self.assertEqual(mock_loads.call_count, 0)
+                os_config = cluster_object.os_config
+                self.assertIs(cluster_object.os_config, os_config)
+                self.assertEqual(mock_loads.call_count, 1)
+        self.assertEqual(os_config, self.large_config)
+
+    def test_unchanged_config_not_updated(self):
+        with database.session() as session:
+            cluster_object = session.query(models.Cluster).first()
+            cluster_object.os_config = copy.deepcopy(
+                cluster_object.os_config
+            )
+            with count_statements() as statements:
+                session.flush()
+        self.assertEqual(statements, [])
+
+    def test_list_clusters_large_config(self):
+        encoded_config = models.json.dumps(self.large_config)
+        with mock.patch.object(
+            models.json, 'loads', wraps=models.json.loads
+        ) as mock_loads:
+            with count_statements() as large_statements:
+                cluster.list_clusters(user=self.user_object)
+        # the configs are not part of the listed clusters.
+        self.assertEqual([
+            args for args, _ in mock_loads.call_args_list
+            if len(args[0]) >= len(encoded_config)
+        ], [])
+        with database.session() as session:
+            for cluster_object in session.query(models.Cluster):
+                cluster_object.os_config = {}
+                cluster_object.package_config = {}
+        with count_statements() as small_statements:
+            cluster.list_clusters(user=self.user_object)
+        self.assertEqual(len(large_statements), len(small_statements))
+
+
 class TestGetCluster(ClusterTestCase):
     """Test get cluster."""
 
@@ -681,6 +747,16 @@ class TestListClusterhosts(ClusterTestCase):
         for result in results:
             self.assertIn(result, expected)
 
+    def test_list_clusterhosts_statements(self):
+        with count_statements() as statements:
+            cluster.list_clusterhosts(user=self.user_object, limit=1)
+        # all clusterhosts are listed with the queries of one.
+        with assert_max_statements(self, len(statements)):
+            list_clusterhosts = cluster.list_clusterhosts(
+                user=self.user_object
+            )
+        self.assertEqual(len(list_clusterhosts), 2)
+
 
 class TestGetClusterHost(ClusterTestCase):
     """Test get cluster host."""
@@ -1741,6 +1817,88 @@ class TestGetClusterState(ClusterTestCase):
         self.assertEqual(cluster_state['state'], 'UNINITIALIZED')
 
 
+class TestGetClusterProgress(ClusterTestCase):
+    """Test get cluster progress."""
+
+    def setUp(self):
+        super(TestGetClusterProgress, self).setUp()
+
+    def tearDown(self):
+        super(TestGetClusterProgress, self).tearDown()
+
+    def test_get_cluster_progress(self):
+        progress = cluster.get_cluster_progress(
+            self.cluster_id,
+            user=self.user_object
+        )
+        self.assertEqual(0, progress['version'])
+        self.assertEqual('UNINITIALIZED', progress['cluster']['state'])
+        self.assertItemsEqual(
+            self.host_id,
+            [
+                clusterhost['host_id']
+                for clusterhost in progress['clusterhosts']
+            ]
+        )
+
+    def test_version_bumped(self):
+        cluster.update_clusterhost_state(
+            self.clusterhost_id[0],
+            user=self.user_object,
+            state='INSTALLING'
+        )
+        progress = cluster.get_cluster_progress(
+            self.cluster_id,
+            user=self.user_object,
+            since=0, wait=10
+        )
+        self.assertEqual(1, progress['version'])
+        host.update_host_state(
+            self.host_id[0],
+            user=self.user_object,
+            state='INSTALLING'
+        )
+        progress = cluster.get_cluster_progress(
+            self.cluster_id,
+            user=self.user_object,
+            since=1, wait=10
+        )
+        self.assertEqual(2, progress['version'])
+
+    def test_wait_timeout(self):
+        setting.CLUSTER_PROGRESS_POLL_INTERVAL = 0.1
+        start = time.time()
+        progress = cluster.get_cluster_progress(
+            self.cluster_id,
+            user=self.user_object,
+            since=0, wait=1
+        )
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertEqual(0, progress['version'])
+
+    def test_state_tag(self):
+        tag = cluster.get_cluster_state_tag(
+            self.cluster_id, user=self.user_object
+        )
+        self.assertEqual(
+            tag,
+            cluster.get_cluster_state_tag(
+                self.cluster_id, user=self.user_object
+            )
+        )
+        host.update_host_state(
+            self.host_id[0],
+            user=self.user_object,
+            state='INSTALLING'
+        )
+        self.assertNotEqual(
+            tag,
+            cluster.get_cluster_state_tag(
+                self.cluster_id, user=self.user_object
+            )
+        )
+
+
 class TestGetClusterHostState(ClusterTestCase):
     """Test get cluster host state."""
 
@@ -0,0 +1,187 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import mock
+import os
+import shutil
+import tempfile
+import unittest2
+
+from sqlalchemy.exc import OperationalError
+
+
+os.environ['COMPASS_IGNORE_SETTING'] = 'true'
+
+
+from compass.utils import setting_wrapper as setting
+reload(setting)
+
+
+from base import BaseTest
+from compass.db.api import database
+from compass.db.api import statement_stats
+from compass.db import models
+from compass.utils import flags
+from compass.utils import logsetting
+
+
+class TestReadOnlySession(BaseTest):
+    """Test read only session."""
+
+    def setUp(self):
+        super(TestReadOnlySession, self).setUp()
+
+    def tearDown(self):
+        super(TestReadOnlySession, self).tearDown()
+
+    def test_read_only_session_not_committed(self):
+        with database.session(read_only=True) as session:
+            session.add(models.Permission('test_read_only'))
+        with database.session() as session:
+            self.assertIsNone(
+                session.query(models.Permission).filter_by(
+                    name='test_read_only'
+                ).first()
+            )
+
+    def test_run_in_read_only_session(self):
+        @database.run_in_session(read_only=True)
+        def get_user(email, session=None):
+            return session.query(models.User).filter_by(
+                email=email
+            ).first().email
+
+        self.assertEqual(
+            setting.COMPASS_ADMIN_EMAIL,
+            get_user(setting.COMPASS_ADMIN_EMAIL)
+        )
+
+    def test_pool_metrics(self):
+        with database.session() as session:
+            session.query(models.User).all()
+        metrics = database.pool_metrics()
+        self.assertEqual(['default'], metrics.keys())
+        self.assertGreater(metrics['default']['checkouts'], 0)
+        self.assertEqual(0, metrics['default']['checked_out'])
+
+    def test_recreate_pools_after_fork(self):
+        pool = database.ENGINE.pool
+        with mock.patch.object(
+            database.os, 'getpid', return_value=database.ENGINE_PID + 1
+        ):
+            with database.session():
+                pass
+            self.assertIsNot(pool, database.ENGINE.pool)
+            self.assertIn(pool, database.FORKED_POOLS)
+            new_pool = database.ENGINE.pool
+            with database.session():
+                pass
+            self.assertIs(new_pool, database.ENGINE.pool)
+
+
+class TestStatementStats(BaseTest):
+    """Test sql statement stats."""
+
+    def setUp(self):
+        super(TestStatementStats, self).setUp()
+        setting.SQL_STATS_ENABLED = True
+        statement_stats.instrument(database.ENGINE)
+
+    def tearDown(self):
+        super(TestStatementStats, self).tearDown()
+
+    def test_collect_repeated_statements(self):
+        with statement_stats.collect('test') as stats:
+            for email in ['a@b.c', 'b@b.c', 'c@b.c']:
+                with database.session() as session:
+                    session.query(models.User).filter_by(
+                        email=email
+                    ).first()
+        self.assertEqual(3, stats.count)
+        self.assertEqual(3, len(stats.slowest))
+        repeated = stats.repeated()
+        self.assertEqual(1, len(repeated))
+        self.assertEqual(3, repeated[0][0])
+        self.assertIn('count=3;', stats.summary())
+
+    def test_failed_statement(self):
+        connection = database.ENGINE.connect()
+        try:
+            with statement_stats.collect('test') as stats:
+                self.assertRaises(
+                    OperationalError,
+                    connection.execute, 'select * from missing_table'
+                )
+                connection.execute('select 1')
+            self.assertEqual(1, stats.count)
+            self.assertEqual(
+                [], connection.info.get('statement_start_times', [])
+            )
+        finally:
+            connection.close()
+
+    def test_session_stats_logged(self):
+        with mock.patch.object(statement_stats.logging, 'log') as mock_log:
+            with database.session() as session:
+                session.query(models.User).all()
+        self.assertEqual(1, mock_log.call_count)
+        level, _, stats_json = mock_log.call_args[0]
+        self.assertEqual(logging.DEBUG, level)
+        self.assertEqual(1, statement_stats.json.loads(stats_json)['count'])
+
+
+class TestReplica(unittest2.TestCase):
+    """Test read only sessions routed to the replica."""
+
+    def setUp(self):
+        super(TestReplica, self).setUp()
+        reload(setting)
+        self.tmp_dir = tempfile.mkdtemp()
+        database.init(
+            'sqlite:///%s' % os.path.join(self.tmp_dir, 'primary.db'),
+            replica_url='sqlite:///%s' % os.path.join(
+                self.tmp_dir, 'replica.db'
+            )
+        )
+        models.BASE.metadata.create_all(bind=database.ENGINE)
+        models.BASE.metadata.create_all(bind=database.READ_ENGINE)
+
+    def tearDown(self):
+        models.BASE.metadata.drop_all(bind=database.READ_ENGINE)
+        database.drop_db()
+        shutil.rmtree(self.tmp_dir)
+        reload(setting)
+        super(TestReplica, self).tearDown()
+
+    def test_read_only_session_on_replica(self):
+        with database.session() as session:
+            session.add(models.Permission('test_replica'))
+        with database.session() as session:
+            self.assertEqual(
+                1, session.query(models.Permission).count()
+            )
+        with database.session(read_only=True) as session:
+            self.assertEqual(
+                0, session.query(models.Permission).count()
+            )
+        self.assertEqual(
+            ['default', 'replica'], sorted(database.pool_metrics().keys())
+        )
+
+
+if __name__ == '__main__':
+    flags.init()
+    logsetting.init()
+    unittest2.main()
@@ -28,7 +28,9 @@ from compass.utils import setting_wrapper as setting
 reload(setting)
 
 
+from base import assert_max_statements
 from base import BaseTest
+from base import count_statements
 from compass.db.api import adapter as adapter_api
 from compass.db.api import adapter_holder as adapter
 from compass.db.api import cluster
@@ -246,6 +248,33 @@ class TestListHosts(HostTestCase):
         for item in result:
             self.assertIn(item, ['newname1', 'newname2'])
 
+    def test_list_hosts_fields(self):
+        # only columns are requested.
+        list_hosts = host.list_hosts(
+            user=self.user_object, fields=['id', 'name']
+        )
+        self.assertItemsEqual(
+            [list_host['name'] for list_host in list_hosts],
+            ['newname1', 'newname2']
+        )
+        for list_host in list_hosts:
+            self.assertEqual(sorted(list_host.keys()), ['id', 'name'])
+        list_hosts = host.list_hosts(
+            user=self.user_object, fields=['name', 'mac', 'state']
+        )
+        for list_host in list_hosts:
+            self.assertEqual(
+                sorted(list_host.keys()), ['mac', 'name', 'state']
+            )
+
+    def test_list_hosts_statements(self):
+        with count_statements() as statements:
+            host.list_hosts(user=self.user_object, limit=1)
+        # all hosts are listed with the queries of one.
+        with assert_max_statements(self, len(statements)):
+            list_hosts = host.list_hosts(user=self.user_object)
+        self.assertEqual(len(list_hosts), 2)
+
 
 class TestListMachinesOrHosts(HostTestCase):
     """Test list machines or hosts."""
@@ -308,6 +337,26 @@ class TestGetHost(HostTestCase):
         self.assertIsNotNone(get_host)
         self.assertEqual(get_host['mac'], '28:6e:d4:46:c4:25')
 
+    def test_get_host_fields(self):
+        get_host = host.get_host(
+            self.host_ids[0],
+            user=self.user_object,
+            fields=['id', 'mac', 'state']
+        )
+        self.assertEqual(
+            sorted(get_host.keys()), ['id', 'mac', 'state']
+        )
+        self.assertEqual(get_host['mac'], '28:6e:d4:46:c4:25')
+
+    def test_get_host_unsupported_fields(self):
+        self.assertRaises(
+            exception.InvalidParameter,
+            host.get_host,
+            self.host_ids[0],
+            user=self.user_object,
+            fields=['os_config']
+        )
+
 
 class TestGetMachineOrHost(HostTestCase):
     """Test get machine or host."""
@@ -26,13 +26,16 @@ reload(setting)
 
 
 from base import BaseTest
+from base import count_statements
 from compass.db.api import database
 from compass.db.api import machine
 from compass.db.api import switch
 from compass.db.api import user as user_api
 from compass.db import exception
+from compass.db import models
 from compass.utils import flags
 from compass.utils import logsetting
+from compass.utils import util
 
 
 class TestGetMachine(BaseTest):
@@ -79,6 +82,54 @@ class TestListMachines(BaseTest):
         self.assertIsNotNone(list_machine)
         self.assertEqual(list_machine[0]['mac'], '28:6e:d4:46:c4:25')
 
+    def test_list_machines_paginated(self):
+        for index, mac in enumerate([
+            '28:6e:d4:46:c4:25', '28:6e:d4:46:c4:26',
+            '28:6e:d4:46:c4:27', '28:6e:d4:46:c4:28'
+        ]):
+            switch_machine = switch.add_switch_machine(
+                1,
+                mac=mac,
+                port=str(index),
+                user=self.user_object,
+            )
+            machine.update_machine(
+                switch_machine['machine_id'],
+                tag={'rack': index % 2},
+                user=self.user_object,
+            )
+        list_machine = machine.list_machines(
+            self.user_object, limit=2
+        )
+        self.assertEqual(
+            [item['mac'] for item in list_machine],
+            ['28:6e:d4:46:c4:25', '28:6e:d4:46:c4:26']
+        )
+        list_machine = machine.list_machines(
+            self.user_object, limit=2, marker=list_machine[-1]['id']
+        )
+        self.assertEqual(
+            [item['mac'] for item in list_machine],
+            ['28:6e:d4:46:c4:27', '28:6e:d4:46:c4:28']
+        )
+        # the page size is applied after the tag filter.
+        list_machine = machine.list_machines(
+            self.user_object, limit=1,
+            tag={'resp_in': [{'rack': 1}]}
+        )
+        self.assertEqual(
+            [item['mac'] for item in list_machine],
+            ['28:6e:d4:46:c4:26']
+        )
+        list_machine = machine.list_machines(
+            self.user_object, limit=1, marker=list_machine[-1]['id'],
+            tag={'resp_in': [{'rack': 1}]}
+        )
+        self.assertEqual(
+            [item['mac'] for item in list_machine],
+            ['28:6e:d4:46:c4:28']
+        )
+
 
 class TestUpdateMachine(BaseTest):
     """Test update machine."""
@@ -259,6 +310,185 @@ class TestResetMachine(BaseTest):
         )
 
 
+class TestMachineMac(BaseTest):
+    """Test macs normalized and stored as ints."""
+
+    def setUp(self):
+        super(TestMachineMac, self).setUp()
+        for mac, port in [
+            ('28-6E-D4-46-C4-25', '1'),
+            ('286e.d446.c426', '2'),
+            ('00:1B:21:00:00:01', '3'),
+            ('00:1b:22:00:00:01', '4')
+        ]:
+            switch.add_switch_machine(
+                1,
+                mac=mac,
+                port=port,
+                user=self.user_object,
+            )
+
+    def tearDown(self):
+        super(TestMachineMac, self).tearDown()
+
+    def _list_macs(self, **filters):
+        return sorted([
+            item['mac'] for item in machine.list_machines(
+                self.user_object, **filters
+            )
+        ])
+
+    def test_normalized(self):
+        self.assertEqual(
+            self._list_macs(), [
+                '00:1b:21:00:00:01', '00:1b:22:00:00:01',
+                '28:6e:d4:46:c4:25', '28:6e:d4:46:c4:26'
+            ]
+        )
+        with database.session() as session:
+            machine_object = session.query(models.Machine).filter_by(
+                mac='28:6e:d4:46:c4:26'
+            ).one()
+            self.assertEqual(
+                machine_object.mac_int,
+                util.parse_mac('28:6e:d4:46:c4:26')
+            )
+
+    def test_add_existing_in_other_format(self):
+        switch.add_switch_machine(
+            1, False,
+            mac='28:6E:D4:46:C4:25',
+            port='1',
+            user=self.user_object,
+        )
+        result = switch.add_switch_machines(
+            data=[{
+                'switch_ip': '0.0.0.0',
+                'mac': '286ed446c426',
+                'port': '5'
+            }],
+            user=self.user_object
+        )
+        self.assertEqual(
+            result['fail_switches_machines'][0]['mac'],
+            '28:6e:d4:46:c4:26'
+        )
+        self.assertEqual(len(self._list_macs()), 4)
+
+    def test_invalid_mac(self):
+        self.assertRaises(
+            exception.InvalidParameter,
+            switch.add_switch_machine,
+            1, mac='28:6e:d4:46:c4', port='5', user=self.user_object
+        )
+        self.assertRaises(
+            exception.InvalidParameter,
+            machine.list_machines, self.user_object, mac='xx'
+        )
+
+    def test_list_by_any_format(self):
+        self.assertEqual(
+            self._list_macs(mac='286E.D446.C425'),
+            ['28:6e:d4:46:c4:25']
+        )
+        self.assertEqual(
+            self._list_macs(mac=['28-6e-d4-46-c4-25', '001b21000001']),
+            ['00:1b:21:00:00:01', '28:6e:d4:46:c4:25']
+        )
+        self.assertEqual(
+            self._list_macs(mac={'ne': '28:6E:D4:46:C4:25'}), [
+                '00:1b:21:00:00:01', '00:1b:22:00:00:01',
+                '28:6e:d4:46:c4:26'
+            ]
+        )
+
+    def test_list_by_prefix_and_range(self):
+        self.assertEqual(
+            self._list_macs(mac={'startswith': '00-1B-21'}),
+            ['00:1b:21:00:00:01']
+        )
+        self.assertEqual(
+            self._list_macs(mac={'startswith': ['00:1b:21', '28:6e']}), [
+                '00:1b:21:00:00:01', '28:6e:d4:46:c4:25',
+                '28:6e:d4:46:c4:26'
+            ]
+        )
+        self.assertEqual(
+            self._list_macs(mac={
+                'between': ['00:1b:21:00:00:00', '00:1b:22:ff:ff:ff']
+            }),
+            ['00:1b:21:00:00:01', '00:1b:22:00:00:01']
+        )
+        self.assertEqual(
+            self._list_macs(mac={'endswith': 'C4:26'}),
+            ['28:6e:d4:46:c4:26']
+        )
+
+    def test_list_switch_machines_by_mac(self):
+        switch_machines = switch.list_switch_machines(
+            1, mac='28-6E-D4-46-C4-26', user=self.user_object
+        )
+        self.assertEqual(
+            [item['mac'] for item in switch_machines],
+            ['28:6e:d4:46:c4:26']
+        )
+
+    def test_migrate_machine_macs(self):
+        with database.session() as session:
+            session.query(models.Machine).update(
+                {'mac_int': None}, synchronize_session=False
+            )
+        self.assertEqual(machine.migrate_machine_macs(), 4)
+        self.assertEqual(machine.migrate_machine_macs(), 0)
+        self.assertEqual(
+            self._list_macs(mac='286ed446c425'), ['28:6e:d4:46:c4:25']
+        )
+
+    def _add_switch_machines(self, count):
+        """Add count machines on switch 1 and get a sample of their macs."""
+        base_mac_int = util.parse_mac('52:54:00:00:00:00')
+        with database.session() as session:
+            session.execute(models.Machine.__table__.insert(), [
+                {
+                    'mac': util.format_mac(base_mac_int + index),
+                    'mac_int': base_mac_int + index
+                }
+                for index in range(count)
+            ])
+            machine_ids = [
+                machine_id for machine_id, in session.query(
+                    models.Machine.id
+                ).filter(models.Machine.mac_int >= base_mac_int)
+            ]
+            session.execute(models.SwitchMachine.__table__.insert(), [
+                {
+                    'switch_id': 1, 'machine_id': machine_id,
+                    'port': str(index)
+                }
+                for index, machine_id in enumerate(machine_ids)
+            ])
+        return [
+            util.format_mac(base_mac_int + index).upper()
+            for index in range(0, count, count / 100)
+        ]
+
+    def test_lookup_by_mac_int(self):
+        macs = self._add_switch_machines(1000)
+        for mac in macs[:10]:
+            with count_statements() as statements:
+                self.assertEqual(
+                    len(machine.list_machines(self.user_object, mac=mac)), 1
+                )
+            # the mac is looked up by its indexed int.
+            self.assertTrue([
+                statement for statement in statements
+                if 'mac_int' in statement.partition('WHERE')[2]
+            ])
+        switch_machines = switch.list_switchmachines(
+            user=self.user_object, mac=macs
+        )
+        self.assertEqual(len(switch_machines), len(macs))
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
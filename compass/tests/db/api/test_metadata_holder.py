@@ -359,6 +359,80 @@ class TestGetFlavors(MetadataTestCase):
         )
 
 
+class TestGetUIMetadata(MetadataTestCase):
+    def setUp(self):
+        super(TestGetUIMetadata, self).setUp()
+
+    def tearDown(self):
+        super(TestGetUIMetadata, self).tearDown()
+
+    def _get_os_ui_metadata_by_configs(self):
+        """Get os ui metadata as the api did before snapshots."""
+        os_metadata = metadata.get_os_metadata(
+            self.os_id, user=self.user_object
+        )
+        configs = util.load_configs(setting.OS_MAPPING_DIR)
+        return metadata.get_ui_metadata(
+            os_metadata['os_config'], configs[0]['OS_CONFIG_MAPPING']
+        )
+
+    def test_get_os_ui_metadata(self):
+        ui_metadata, ui_metadata_json = metadata.get_os_ui_metadata(
+            self.os_id, user=self.user_object
+        )
+        self.assertEqual(self._get_os_ui_metadata_by_configs(), ui_metadata)
+        self.assertEqual(ui_metadata, metadata.json.loads(ui_metadata_json))
+        self.assertIs(
+            ui_metadata_json,
+            metadata.get_os_ui_metadata(
+                self.os_id, user=self.user_object
+            )[1]
+        )
+
+    def test_get_flavor_ui_metadata(self):
+        ui_metadata, _ = metadata.get_flavor_ui_metadata(
+            self.flavor_id, user=self.user_object
+        )
+        self.assertEqual(
+            [
+                child['category']
+                for child in ui_metadata['flavor_config']
+            ],
+            ['service_credentials', 'console_credentials', 'ha']
+        )
+        self.assertEqual(
+            ui_metadata['flavor_config'][2]['data'][0]['label'], 'VIP'
+        )
+
+    def test_snapshot_rebuilt_after_reload(self):
+        _, ui_metadata_json = metadata.get_os_ui_metadata(
+            self.os_id, user=self.user_object
+        )
+        with database.session() as session:
+            metadata.load_os_metadatas_internal(session)
+        _, new_ui_metadata_json = metadata.get_os_ui_metadata(
+            self.os_id, user=self.user_object
+        )
+        self.assertIsNot(ui_metadata_json, new_ui_metadata_json)
+        self.assertEqual(ui_metadata_json, new_ui_metadata_json)
+
+    def test_snapshot_not_rebuilt(self):
+        ui_metadata, _ = metadata.get_os_ui_metadata(
+            self.os_id, user=self.user_object
+        )
+        with mock.patch.object(
+            metadata, 'get_ui_metadata',
+            side_effect=AssertionError('ui metadata rebuilt')
+        ):
+            for _ in range(3):
+                self.assertIs(
+                    ui_metadata,
+                    metadata.get_os_ui_metadata(
+                        self.os_id, user=self.user_object
+                    )[0]
+                )
+
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
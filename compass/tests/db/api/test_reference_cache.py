@@ -0,0 +1,115 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest2
+
+
+os.environ['COMPASS_IGNORE_SETTING'] = 'true'
+
+
+from compass.utils import setting_wrapper as setting
+reload(setting)
+
+
+from base import BaseTest
+from base import count_statements
+from compass.db.api import database
+from compass.db.api import reference_cache
+from compass.db.api import utils
+from compass.db import exception
+from compass.db import models
+from compass.utils import flags
+from compass.utils import logsetting
+
+
+class TestReferenceCache(BaseTest):
+    """Test reference cache."""
+
+    def setUp(self):
+        super(TestReferenceCache, self).setUp()
+        self.cache = reference_cache.PERMISSION_CACHE
+
+    def tearDown(self):
+        super(TestReferenceCache, self).tearDown()
+
+    def test_read_through(self):
+        stats = self.cache.stats()
+        with database.session() as session:
+            permission = self.cache.get(session, name='list_permissions')
+        with database.session() as session:
+            with count_statements() as statements:
+                cached_permission = self.cache.get(
+                    session, name='list_permissions'
+                )
+        self.assertEqual([], statements)
+        self.assertEqual(permission, cached_permission)
+        self.assertEqual('list_permissions', permission['name'])
+        new_stats = reference_cache.cache_stats()['Permission']
+        self.assertEqual(stats['hits'] + 1, new_stats['hits'])
+        self.assertEqual(stats['misses'] + 1, new_stats['misses'])
+
+    def test_missing(self):
+        with database.session() as session:
+            self.assertIsNone(self.cache.get(session, False, name='test'))
+            self.assertRaises(
+                exception.RecordNotExists,
+                self.cache.get, session, name='test'
+            )
+
+    def test_not_cached_keys(self):
+        with database.session() as session:
+            self.assertRaises(
+                exception.InvalidParameter,
+                self.cache.get, session, alias='test'
+            )
+
+    def test_invalidate_after_commit(self):
+        with database.session() as session:
+            self.assertIsNone(self.cache.get(session, False, name='test'))
+        with database.session() as session:
+            utils.add_db_object(
+                session, models.Permission, True, 'test', alias='test'
+            )
+        with database.session() as session:
+            self.assertEqual(
+                'test', self.cache.get(session, name='test')['alias']
+            )
+        with database.session() as session:
+            utils.del_db_objects(session, models.Permission, name='test')
+        with database.session() as session:
+            self.assertIsNone(self.cache.get(session, False, name='test'))
+
+    def test_lru_eviction(self):
+        setting.REFERENCE_CACHE_SIZE = 2
+        stats = self.cache.stats()
+        with database.session() as session:
+            for name in [
+                'list_permissions', 'list_switches', 'list_permissions',
+                'list_machines'
+            ]:
+                self.cache.get(session, name=name)
+        self.assertEqual(
+            ['list_machines', 'list_permissions'],
+            sorted([row['name'] for _, row in self.cache.rows.values()])
+        )
+        self.assertEqual(
+            stats['evictions'] + 1, self.cache.stats()['evictions']
+        )
+
+
+if __name__ == '__main__':
+    flags.init()
+    logsetting.init()
+    unittest2.main()
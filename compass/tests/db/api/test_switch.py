@@ -26,11 +26,15 @@ from compass.utils import setting_wrapper as setting
 reload(setting)
 
 
+from base import assert_max_statements
 from base import BaseTest
+from base import count_statements
 from compass.db.api import database
 from compass.db.api import switch
 from compass.db.api import user as user_api
 from compass.db import exception
+from compass.db import models
+from compass.db import switch_filter
 from compass.utils import flags
 from compass.utils import logsetting
 
@@ -495,6 +499,223 @@ class TestListSwitchMachines(BaseTest):
             all(item in list_switch_machines[0].items()
                 for item in expected.items()))
 
+    def test_list_switch_machines_statements(self):
+        switch.add_switch(
+            ip='2887583784',
+            user=self.user_object,
+        )
+        switch.add_switch_machine(
+            2,
+            mac='28:6e:d4:46:c4:25',
+            port='1',
+            user=self.user_object,
+        )
+        with count_statements() as statements:
+            switch.list_switch_machines(2, user=self.user_object)
+        for index, mac in enumerate([
+            '28:6e:d4:46:c4:26', '28:6e:d4:46:c4:27', '28:6e:d4:46:c4:28'
+        ]):
+            switch.add_switch_machine(
+                2,
+                mac=mac,
+                port=str(index + 2),
+                user=self.user_object,
+            )
+        # more switch machines do not cost more queries.
+        with assert_max_statements(self, len(statements)):
+            list_switch_machines = switch.list_switch_machines(
+                2, user=self.user_object
+            )
+        self.assertEqual(len(list_switch_machines), 4)
+
+
+class TestListSwitchMachinesFilters(BaseTest):
+    """Test switch machines filters pushed down into the query."""
+
+    def setUp(self):
+        super(TestListSwitchMachinesFilters, self).setUp()
+        switch.add_switch(
+            ip='2887583784',
+            user=self.user_object,
+        )
+        switch.add_switch(
+            ip='2887583785',
+            user=self.user_object,
+        )
+        for mac, port, vlans in [
+            ('28:6e:d4:46:c4:25', 'ae1', [1]),
+            ('28:6e:d4:46:c4:26', 'ae5', [2]),
+            ('28:6e:d4:46:c4:27', 'ae10', [1, 2]),
+            ('28:6e:d4:46:c4:28', 'eth5', [1])
+        ]:
+            switch.add_switch_machine(
+                2,
+                mac=mac,
+                port=port,
+                vlans=vlans,
+                user=self.user_object,
+            )
+        switch.add_switch_machine(
+            3,
+            mac='28:6e:d4:46:c4:29',
+            port='ae5',
+            user=self.user_object,
+        )
+
+    def tearDown(self):
+        super(TestListSwitchMachinesFilters, self).tearDown()
+
+    def _list_ports(self, **filters):
+        return sorted([
+            switch_machine['port']
+            for switch_machine in switch.list_switch_machines(
+                2, user=self.user_object, **filters
+            )
+        ])
+
+    def test_port_range(self):
+        self.assertEqual(
+            self._list_ports(
+                port={'startswith': 'ae', 'resp_range': [(2, 10)]}
+            ),
+            ['ae10', 'ae5']
+        )
+
+    def test_port_ge_lt(self):
+        self.assertEqual(
+            self._list_ports(
+                port={'startswith': 'ae', 'resp_ge': 5, 'resp_lt': 10}
+            ),
+            ['ae5']
+        )
+
+    def test_port_eq(self):
+        self.assertEqual(
+            self._list_ports(port={'eq': ['ae1', 'eth5']}),
+            ['ae1', 'eth5']
+        )
+
+    def test_port_parts(self):
+        for mac, port in [
+            ('28:6e:d4:46:c4:31', 'ge1/0/3'),
+            ('28:6e:d4:46:c4:32', 'ge1/0/12'),
+            ('28:6e:d4:46:c4:33', 'ge2/0/3')
+        ]:
+            switch.add_switch_machine(
+                2,
+                mac=mac,
+                port=port,
+                user=self.user_object,
+            )
+        with database.session() as session:
+            switch_machine = session.query(
+                models.SwitchMachine
+            ).filter_by(port='ge1/0/12').one()
+            self.assertEqual(
+                [
+                    (part.port_head, part.port_number, part.port_tail)
+                    for part in switch_machine.port_parts
+                ],
+                [('ge', 1, '/0/12'), ('ge1/', 0, '/12'), ('ge1/0/', 12, '')]
+            )
+        self.assertEqual(
+            self._list_ports(port={
+                'startswith': 'ge', 'endswith': '/0/3', 'resp_le': 1
+            }),
+            ['ge1/0/3']
+        )
+        self.assertEqual(
+            self._list_ports(port={'startswith': 'ge1/0/', 'resp_gt': 3}),
+            ['ge1/0/12']
+        )
+        self.assertEqual(
+            self._list_ports(port={'resp_lt': 10}), []
+        )
+        self.assertEqual(
+            self._list_ports(port={'startswith': 'ge1/', 'resp_lt': 1}),
+            ['ge1/0/12', 'ge1/0/3']
+        )
+        self.assertEqual(switch_filter.split_port('eth'), [])
+
+    def test_migrate_switch_machine_ports(self):
+        with database.session() as session:
+            count = session.query(models.SwitchMachinePortPart).delete(
+                synchronize_session=False
+            )
+        self.assertEqual(switch.migrate_switch_machine_ports(), count)
+        self.assertEqual(switch.migrate_switch_machine_ports(), 0)
+        self.assertEqual(
+            self._list_ports(
+                port={'startswith': 'ae', 'resp_range': [(2, 10)]}
+            ),
+            ['ae10', 'ae5']
+        )
+
+    def test_vlans(self):
+        self.assertEqual(
+            self._list_ports(vlans={'resp_in': [2]}),
+            ['ae10', 'ae5']
+        )
+
+    def test_mac(self):
+        self.assertEqual(
+            self._list_ports(mac='28:6e:d4:46:c4:26'),
+            ['ae5']
+        )
+
+    def test_switch_ip_int(self):
+        switch_machines = switch.list_switchmachines(
+            switch_ip_int=2887583785,
+            user=self.user_object,
+        )
+        self.assertEqual(
+            [
+                switch_machine['mac']
+                for switch_machine in switch_machines
+            ],
+            ['28:6e:d4:46:c4:29']
+        )
+
+    def test_query_plan(self):
+        query_plan = switch._plan_switch_machines_query({
+            'switch_id': 2,
+            'port': {'startswith': 'ae', 'resp_range': [(2, 10)]},
+            'vlans': {'resp_in': [2]}
+        })
+        self.assertItemsEqual(
+            query_plan.pushed_down, ['switch_id', 'port']
+        )
+        self.assertEqual(query_plan.filters, {'switch_id': 2})
+        self.assertEqual(len(query_plan.conditions), 2)
+        self.assertItemsEqual(
+            query_plan.output_filters.keys(), ['vlans']
+        )
+
+    def test_query_plan_port_prefix_with_numbers(self):
+        query_plan = switch._plan_switch_machines_query({
+            'port': {'startswith': 'ge1/0/', 'resp_range': [(2, 10)]}
+        })
+        self.assertEqual(query_plan.pushed_down, ['port'])
+        self.assertEqual(query_plan.output_filters, {})
+
+    def test_query_plan_port_parts(self):
+        query_plan = switch._plan_switch_machines_query({
+            'port': {'startswith': 'ge-', 'endswith': '/0/3', 'resp_le': 1}
+        })
+        self.assertEqual(query_plan.pushed_down, ['port'])
+        self.assertEqual(query_plan.output_filters, {})
+        query_plan = switch._plan_switch_machines_query({
+            'port': {'startswith': 'ae', 'endswith': '.0', 'resp_le': 1}
+        })
+        self.assertEqual(query_plan.output_filters.keys(), ['port'])
+
+    def test_query_plan_port_without_numbers(self):
+        query_plan = switch._plan_switch_machines_query({
+            'port': {'startswith': 'ae'}
+        })
+        self.assertEqual(query_plan.pushed_down, ['port'])
+        self.assertEqual(query_plan.output_filters, {})
+
 
 class TestListSwitchmachines(BaseTest):
     """Test list switch machines."""
@@ -599,6 +820,34 @@ class TestListSwitchMachinesHosts(BaseTest):
             all(item in list_hosts[0].items()
                 for item in expected.items()))
 
+    def test_list_hosts_statements(self):
+        switch.add_switch(
+            ip='2887583784',
+            user=self.user_object,
+        )
+        switch.add_switch_machine(
+            2,
+            mac='28:6e:d4:46:c4:25',
+            port='1',
+            user=self.user_object,
+        )
+        with count_statements() as statements:
+            switch.list_switch_machines_hosts(2, user=self.user_object)
+        for index, mac in enumerate([
+            '28:6e:d4:46:c4:26', '28:6e:d4:46:c4:27', '28:6e:d4:46:c4:28'
+        ]):
+            switch.add_switch_machine(
+                2,
+                mac=mac,
+                port=str(index + 2),
+                user=self.user_object,
+            )
+        with assert_max_statements(self, len(statements)):
+            list_hosts = switch.list_switch_machines_hosts(
+                2, user=self.user_object
+            )
+        self.assertEqual(len(list_hosts), 4)
+
 
 class TestListSwitchmachinesHosts(BaseTest):
     """Test list switch machines hosts."""
@@ -960,6 +1209,339 @@ class TestUpdateSwitchMachines(BaseTest):
         self.assertEqual([], update_remove)
 
 
+class TestSwitchMachineFilteredFlag(BaseTest):
+    """Test materialized filtered flag of switch machines."""
+
+    def setUp(self):
+        super(TestSwitchMachineFilteredFlag, self).setUp()
+        switch.add_switch(
+            ip='2887583784',
+            user=self.user_object,
+        )
+        for mac, port in [
+            ('28:6e:d4:46:c4:25', 'ae1'),
+            ('28:6e:d4:46:c4:26', 'ae5'),
+            ('28:6e:d4:46:c4:27', 'ae10'),
+            ('28:6e:d4:46:c4:28', 'eth5')
+        ]:
+            switch.add_switch_machine(
+                2,
+                mac=mac,
+                port=port,
+                user=self.user_object,
+            )
+
+    def tearDown(self):
+        super(TestSwitchMachineFilteredFlag, self).tearDown()
+
+    def _get_filtered_ports(self):
+        with database.session() as session:
+            return sorted([
+                port for port, in session.query(
+                    models.SwitchMachine.port
+                ).filter_by(switch_id=2, filtered=True)
+            ])
+
+    def _list_ports(self, **filters):
+        return sorted([
+            switch_machine['port']
+            for switch_machine in switch.list_switch_machines(
+                2, user=self.user_object, **filters
+            )
+        ])
+
+    def test_update_filters(self):
+        self.assertEqual([], self._get_filtered_ports())
+        with count_statements() as statements:
+            switch.update_switch_filters(
+                2, user=self.user_object, filters='deny ports ae1-5'
+            )
+        self.assertEqual(['ae1', 'ae5'], self._get_filtered_ports())
+        self.assertEqual(1, len([
+            statement for statement in statements
+            if statement.startswith('UPDATE switch_machine')
+        ]))
+        self.assertEqual(['ae10', 'eth5'], self._list_ports())
+        switch.patch_switch_filter(
+            2, user=self.user_object, filters='allow ports ae1'
+        )
+        self.assertEqual(['ae5'], self._get_filtered_ports())
+
+    def test_update_port(self):
+        switch.update_switch_filters(
+            2, user=self.user_object, filters='deny ports ae1-5'
+        )
+        machine_id = [
+            switch_machine['machine_id']
+            for switch_machine in switch.list_switch_machines(
+                2, user=self.user_object, port='ae10'
+            )
+        ][0]
+        switch.update_switch_machine(
+            2, machine_id, user=self.user_object, port='ae3'
+        )
+        self.assertEqual(['ae1', 'ae3', 'ae5'], self._get_filtered_ports())
+        switch.add_switch_machine(
+            2, mac='28:6e:d4:46:c4:29', port='ae2', user=self.user_object
+        )
+        self.assertIn('ae2', self._get_filtered_ports())
+
+    def test_limit_in_sql(self):
+        switch.update_switch_filters(
+            2, user=self.user_object, filters='deny ports ae1-5'
+        )
+        self.assertEqual(1, len(self._list_ports(limit=1)))
+        self.assertEqual(2, len(self._list_ports(limit=3)))
+
+    def test_refresh_all(self):
+        with database.session() as session:
+            session.query(models.SwitchMachine).update(
+                {'filtered': True}, synchronize_session=False
+            )
+        switch.update_switch_machines_filtered()
+        self.assertEqual([], self._get_filtered_ports())
+
+    def test_migrate_filtered(self):
+        switch.update_switch_filters(
+            2, user=self.user_object, filters='deny ports ae1-5'
+        )
+        with database.session() as session:
+            session.query(models.SwitchMachine).update(
+                {'filtered': None}, synchronize_session=False
+            )
+        switch.migrate_switch_machines_filtered()
+        with database.session() as session:
+            self.assertEqual(
+                0,
+                session.query(models.SwitchMachine).filter(
+                    models.SwitchMachine.filtered.is_(None)
+                ).count()
+            )
+        self.assertEqual(['ae1', 'ae5'], self._get_filtered_ports())
+        self.assertEqual(['ae10', 'eth5'], self._list_ports())
+
+
+class TestSwitchFilterMatcher(BaseTest):
+    """Test compiled switch filter matcher."""
+
+    def setUp(self):
+        super(TestSwitchFilterMatcher, self).setUp()
+
+    def tearDown(self):
+        super(TestSwitchFilterMatcher, self).tearDown()
+
+    def _filtered(self, filters, ports):
+        matcher = switch_filter.SwitchFilterMatcher(
+            models.Switch.parse_filters(filters)
+        )
+        return [port for port in ports if matcher.filtered(port)]
+
+    def test_first_match(self):
+        self.assertEqual(
+            self._filtered(
+                'allow ports ae1-5;deny ports ae3-10;allow ports all',
+                ['ae1', 'ae3', 'ae5', 'ae6', 'ae10', 'ae11', 'eth1']
+            ),
+            ['ae6', 'ae10']
+        )
+
+    def test_unmatched(self):
+        self.assertEqual(
+            self._filtered('deny ports ae1', ['ae1', 'ae2']), ['ae1']
+        )
+        self.assertEqual(
+            self._filtered('allow ports ae1', ['ae1', 'ae2']), ['ae2']
+        )
+        self.assertEqual(self._filtered([], ['ae1']), [])
+
+    def test_prefix_suffix(self):
+        self.assertEqual(
+            self._filtered(
+                'deny port_prefix ge port_suffix / port_start 2 port_end 4',
+                ['ge1/0', 'ge2/0', 'ge4/1', 'ge5/0', 'ge3', 'xe3/0']
+            ),
+            ['ge2/0', 'ge4/1']
+        )
+
+    def test_exact_port_without_number(self):
+        self.assertEqual(
+            self._filtered('deny ports mgmt', ['mgmt', 'ae1']), ['mgmt']
+        )
+
+    def test_matcher_shared_and_recompiled(self):
+        switch.update_switch_filters(
+            1, user=self.user_object, filters='deny ports ae1'
+        )
+        with database.session() as session:
+            switch_object = session.query(models.Switch).get(1)
+            matcher = switch_object.filter_matcher
+            self.assertIs(matcher, switch_object.filter_matcher)
+            self.assertTrue(matcher.filtered('ae1'))
+            switch_object.filters = 'deny ports ae2'
+            self.assertIsNot(matcher, switch_object.filter_matcher)
+            self.assertTrue(switch_object.filter_matcher.filtered('ae2'))
+        self.assertIs(
+            switch_filter.get_matcher(
+                models.Switch.parse_filters('deny ports ae1')
+            ), matcher
+        )
+
+    def _get_large_filters(self):
+        """Get 2000 filter rules and the ports to match them on."""
+        filters = []
+        for index in range(1000):
+            filters.append({
+                'filter_type': 'deny' if index % 2 else 'allow',
+                'ports': ['ae%s-%s' % (index * 10, index * 10 + 4)]
+            })
+            filters.append({
+                'filter_type': 'allow',
+                'port_prefix': 'ge',
+                'port_start': index * 48 + 1, 'port_end': index * 48 + 24
+            })
+        ports = ['ae%s' % index for index in range(10000)] + [
+            'ge%s' % index for index in range(1, 48000, 5)
+        ]
+        return filters, ports
+
+    def test_large_filters(self):
+        filters, ports = self._get_large_filters()
+        matcher = switch_filter.SwitchFilterMatcher(filters)
+        filtered = [matcher.filtered(port) for port in ports]
+        self.assertEqual(
+            [matcher.filtered(port) for port in ports], filtered
+        )
+        self.assertFalse(matcher.filtered('ae2'))
+        self.assertTrue(matcher.filtered('ae15'))
+        self.assertTrue(matcher.filtered('ae7'))
+        self.assertFalse(matcher.filtered('ge24'))
+        self.assertTrue(matcher.filtered('ge25'))
+        self.assertFalse(matcher.filtered('ge49'))
+
+
+class TestSyncSwitchMachines(BaseTest):
+    """Test reconciling switch machines with a poll."""
+
+    def setUp(self):
+        super(TestSyncSwitchMachines, self).setUp()
+        switch.add_switch(
+            ip='2887583784',
+            user=self.user_object,
+        )
+        self.machines = [
+            {'mac': '28:6e:d4:46:c4:25', 'port': '1', 'vlans': [88]},
+            {'mac': '28:6e:d4:46:c4:26', 'port': '2', 'vlans': []}
+        ]
+        switch.sync_switch_machines(
+            2, machines=self.machines, state='under_monitoring',
+            user=self.user_object
+        )
+
+    def tearDown(self):
+        super(TestSyncSwitchMachines, self).tearDown()
+
+    def _get_switch_machines(self):
+        return dict([
+            (switch_machine['mac'], switch_machine)
+            for switch_machine in switch.list_switch_machines(
+                2, user=self.user_object
+            )
+        ])
+
+    def _sync(self, machines, **kwargs):
+        return switch.sync_switch_machines(
+            2, machines=machines, user=self.user_object, **kwargs
+        )
+
+    def test_added(self):
+        switch_machines = self._get_switch_machines()
+        self.assertEqual(
+            sorted(switch_machines.keys()),
+            ['28:6e:d4:46:c4:25', '28:6e:d4:46:c4:26']
+        )
+        self.assertEqual(switch_machines['28:6e:d4:46:c4:25']['vlans'], [88])
+        self.assertEqual(
+            switch.get_switch(2, user=self.user_object)['state'],
+            'under_monitoring'
+        )
+
+    def test_unchanged_not_written(self):
+        with count_statements() as statements:
+            counts = self._sync(
+                list(reversed(self.machines)), state='under_monitoring'
+            )
+        self.assertEqual(counts['unchanged'], 2)
+        self.assertEqual(
+            sum([count for key, count in counts.items()
+                 if key != 'unchanged']), 0
+        )
+        self.assertEqual([
+            statement for statement in statements
+            if statement.split()[0] in ['INSERT', 'UPDATE', 'DELETE']
+        ], [])
+
+    def test_diff(self):
+        counts = self._sync([
+            {'mac': '28-6E-D4-46-C4-25', 'port': '3', 'vlans': [88]},
+            {'mac': '28:6e:d4:46:c4:27', 'port': '4', 'vlans': []}
+        ])
+        self.assertEqual(counts['added'], 1)
+        self.assertEqual(counts['updated'], 1)
+        self.assertEqual(counts['missing'], 1)
+        switch_machines = self._get_switch_machines()
+        self.assertEqual(switch_machines['28:6e:d4:46:c4:25']['port'], '3')
+        self.assertEqual(switch_machines['28:6e:d4:46:c4:27']['port'], '4')
+        self.assertIn('missing_since', switch_machines['28:6e:d4:46:c4:26'])
+        self.assertNotIn(
+            'missing_since', switch_machines['28:6e:d4:46:c4:25']
+        )
+        counts = self._sync(self.machines)
+        self.assertEqual(counts['reappeared'], 1)
+        self.assertEqual(counts['missing'], 1)
+        self.assertNotIn(
+            'missing_since',
+            self._get_switch_machines()['28:6e:d4:46:c4:26']
+        )
+
+    def test_failed_poll_keeps_machines(self):
+        counts = self._sync(None, state='unreachable')
+        self.assertEqual(counts['switch_updated'], 1)
+        self.assertEqual(counts['missing'], 0)
+        self.assertEqual(len(self._get_switch_machines()), 2)
+        self.assertEqual(
+            switch.get_switch(2, user=self.user_object)['state'],
+            'unreachable'
+        )
+
+    def test_err_msg(self):
+        self._sync(None, state='unreachable', err_msg='timeout')
+        self.assertEqual(
+            switch.get_switch(2, user=self.user_object)['err_msg'],
+            'timeout'
+        )
+        counts = self._sync(
+            self.machines, state='under_monitoring', err_msg=None
+        )
+        self.assertEqual(counts['switch_updated'], 1)
+        self.assertNotIn(
+            'err_msg', switch.get_switch(2, user=self.user_object)
+        )
+
+    def test_statements(self):
+        machines = [
+            {'mac': '00:00:00:00:01:%02x' % index, 'port': str(index)}
+            for index in range(100)
+        ]
+        with count_statements() as statements:
+            self._sync(machines)
+        self.assertLess(
+            len([
+                statement for statement in statements
+                if statement.startswith('SELECT')
+            ]), 10
+        )
+
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
@@ -26,9 +26,12 @@ reload(setting)
 
 
 from base import BaseTest
+from base import count_statements
 from compass.db.api import database
+from compass.db.api import permission
 from compass.db.api import user as user_api
 from compass.db import exception
+from compass.db import models
 from compass.utils import flags
 from compass.utils import logsetting
 
@@ -104,6 +107,63 @@ class TestGetRecordCleanToken(BaseTest):
             'token'
         )
 
+    def test_bad_signature_without_queries(self):
+        with count_statements() as statements:
+            self.assertRaises(
+                exception.Unauthorized,
+                user_api.get_user_object_from_token,
+                self.user_object.token + 'x'
+            )
+        self.assertEqual([], statements)
+
+    def test_get_user_object_from_cached_token(self):
+        user_api.record_user_token(
+            self.user_object.token,
+            datetime.datetime.now() + datetime.timedelta(seconds=10000),
+            user=self.user_object,
+        )
+        user_object = user_api.get_user_object_from_token(
+            self.user_object.token
+        )
+        with count_statements() as statements:
+            cached_user_object = user_api.get_user_object_from_token(
+                self.user_object.token
+            )
+        self.assertEqual([], statements)
+        self.assertEqual(user_object.id, cached_user_object.id)
+        self.assertEqual(
+            user_object.expire_timestamp,
+            cached_user_object.expire_timestamp
+        )
+        user_api.clean_user_token(
+            self.user_object.token, user=self.user_object
+        )
+        self.assertRaises(
+            exception.Unauthorized,
+            user_api.get_user_object_from_token,
+            self.user_object.token
+        )
+
+    def test_clean_expired_user_tokens(self):
+        now = datetime.datetime.now()
+        for token, expire_timestamp in [
+            ('expired_token1', now - datetime.timedelta(seconds=10)),
+            ('expired_token2', now - datetime.timedelta(seconds=10)),
+            ('test_token', now + datetime.timedelta(seconds=10000))
+        ]:
+            user_api.record_user_token(
+                token, expire_timestamp, user=self.user_object
+            )
+        self.assertEqual(2, user_api.clean_expired_user_tokens(1))
+        with database.session() as session:
+            self.assertEqual(
+                ['test_token'],
+                [
+                    user_token.token
+                    for user_token in session.query(models.UserToken)
+                ]
+            )
+
 
 class TestGetUser(BaseTest):
     """Test get user."""
@@ -314,9 +374,9 @@ class TestAddDelUserPermission(BaseTest):
             user=self.user_object,
         )
         result = None
-        for permission in permissions:
-            if permission['id'] == 2:
-                result = permission['name']
+        for user_permission in permissions:
+            if user_permission['id'] == 2:
+                result = user_permission['name']
         self.assertEqual(result, 'list_switches')
 
     def test_add_permission_position(self):
@@ -331,9 +391,9 @@ class TestAddDelUserPermission(BaseTest):
             user=self.user_object,
         )
         result = None
-        for permission in permissions:
-            if permission['id'] == 2:
-                result = permission['name']
+        for user_permission in permissions:
+            if user_permission['id'] == 2:
+                result = user_permission['name']
         self.assertEqual(result, 'list_switches')
 
     def test_add_permission_session(self):
@@ -349,9 +409,9 @@ class TestAddDelUserPermission(BaseTest):
             user=self.user_object,
         )
         result = None
-        for permission in permissions:
-            if permission['id'] == 2:
-                result = permission['name']
+        for user_permission in permissions:
+            if user_permission['id'] == 2:
+                result = user_permission['name']
         self.assertEqual(result, 'list_switches')
 
     def test_del_permission(self):
@@ -399,12 +459,89 @@ class TestUpdatePermissions(BaseTest):
             user=self.user_object,
         )
         result = None
-        for permission in permissions:
-            if permission['id'] == 2:
-                result = permission['name']
+        for user_permission in permissions:
+            if user_permission['id'] == 2:
+                result = user_permission['name']
         self.assertEqual(result, 'list_switches')
 
 
+class TestUserPermissionSet(BaseTest):
+    """Test permission set of non admin users."""
+
+    def setUp(self):
+        super(TestUserPermissionSet, self).setUp()
+        user_api.add_user(
+            email='test@huawei.com',
+            password='password',
+            user=self.user_object
+        )
+        self.test_user = user_api.get_user_object('test@huawei.com')
+
+    def tearDown(self):
+        super(TestUserPermissionSet, self).tearDown()
+
+    def test_permissions_loaded(self):
+        self.assertEqual(
+            frozenset(['list_permissions']), self.test_user.permissions
+        )
+
+    def test_check_reads_only_version(self):
+        with database.session() as session:
+            with count_statements() as statements:
+                user_api.check_user_permission_internal(
+                    session, self.test_user,
+                    permission.PERMISSION_LIST_PERMISSIONS
+                )
+        self.assertEqual(1, len(statements))
+        self.assertIn('permission_version', statements[0])
+
+    def test_permission_changed_by_other_process(self):
+        with database.session() as session:
+            session.add(models.UserPermission(
+                user_id=self.test_user.id, permission_id=2
+            ))
+            session.query(models.User).filter_by(
+                id=self.test_user.id
+            ).update({
+                models.User.permission_version: (
+                    models.User.permission_version + 1
+                )
+            }, synchronize_session=False)
+        with database.session() as session:
+            user_api.check_user_permission_internal(
+                session, self.test_user, permission.PERMISSION_LIST_SWITCHES
+            )
+
+    def test_permission_version_bumped(self):
+        with database.session() as session:
+            self.assertRaises(
+                exception.Forbidden,
+                user_api.check_user_permission_internal,
+                session, self.test_user, permission.PERMISSION_LIST_SWITCHES
+            )
+        user_api.update_permissions(
+            self.test_user.id,
+            user=self.user_object,
+            add_permissions=2
+        )
+        with database.session() as session:
+            user_api.check_user_permission_internal(
+                session, self.test_user, permission.PERMISSION_LIST_SWITCHES
+            )
+        self.assertIn('list_switches', self.test_user.permissions)
+        user_api.update_permissions(
+            self.test_user.id,
+            user=self.user_object,
+            set_permissions=[]
+        )
+        with database.session() as session:
+            self.assertRaises(
+                exception.Forbidden,
+                user_api.check_user_permission_internal,
+                session, self.test_user, permission.PERMISSION_LIST_PERMISSIONS
+            )
+
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
@@ -146,6 +146,67 @@ class TestDelActions(BaseTest):
         self.assertEqual([], del_action)
 
 
+class TestUserLogWriter(BaseTest):
+    """Test buffered user log writer."""
+
+    def setUp(self):
+        super(TestUserLogWriter, self).setUp()
+
+    def tearDown(self):
+        super(TestUserLogWriter, self).tearDown()
+
+    def test_flush(self):
+        writer = user_log.UserLogWriter(batch_size=2)
+        for action in ['/action1', '/action2', '/action3']:
+            writer.put(self.user_object.id, action)
+        self.assertEqual([], user_log.list_actions(user=self.user_object))
+        writer.flush()
+        self.assertEqual(
+            ['/action1', '/action2', '/action3'],
+            [
+                action['action']
+                for action in user_log.list_actions(user=self.user_object)
+            ]
+        )
+        self.assertEqual(3, writer.stats()['written'])
+        self.assertEqual(0, writer.stats()['queued'])
+
+    def test_drop_when_full(self):
+        writer = user_log.UserLogWriter(queue_size=1)
+        writer.put(self.user_object.id, '/action1')
+        writer.put(self.user_object.id, '/action2')
+        self.assertEqual(1, writer.stats()['dropped'])
+        writer.flush()
+        self.assertEqual(
+            ['/action1'],
+            [
+                action['action']
+                for action in user_log.list_actions(user=self.user_object)
+            ]
+        )
+
+    def test_invalid_overflow_policy(self):
+        self.assertRaises(
+            exception.InvalidParameter,
+            user_log.UserLogWriter, overflow_policy='test'
+        )
+
+    def test_clean_user_logs(self):
+        writer = user_log.UserLogWriter()
+        writer.put(self.user_object.id, '/action1')
+        writer.queue.queue[0]['timestamp'] -= datetime.timedelta(days=2)
+        writer.put(self.user_object.id, '/action2')
+        writer.flush()
+        self.assertEqual(1, user_log.clean_user_logs('1d'))
+        self.assertEqual(
+            ['/action2'],
+            [
+                action['action']
+                for action in user_log.list_actions(user=self.user_object)
+            ]
+        )
+
+
 if __name__ == '__main__':
     flags.init()
     logsetting.init()
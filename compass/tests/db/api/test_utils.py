@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import inspect
 import logging
+import mock
+import netaddr
 import os
 import unittest2
 
@@ -24,6 +27,7 @@ from compass.utils import setting_wrapper as setting
 reload(setting)
 
 
+from base import count_statements
 from compass.db.api import database
 from compass.db.api import utils
 from compass.db import exception
@@ -272,6 +276,90 @@ class TestModelFilter(unittest2.TestCase):
             )
 
 
+class TestPlanQuery(unittest2.TestCase):
+    """Test query plan."""
+
+    def test_plan_query(self):
+        query_plan = utils.plan_query(
+            models.Machine,
+            {
+                'mac': '00:01:02:03:04:05',
+                'tag': {'resp_in': [{'a': 'b'}]},
+                'id': {'ge': 1, 'resp_lt': 3},
+                'unknown': {'resp_eq': 1}
+            }
+        )
+        self.assertItemsEqual(query_plan.pushed_down, ['mac', 'id.ge'])
+        self.assertEqual(
+            query_plan.filters,
+            {'mac': '00:01:02:03:04:05', 'id': {'ge': 1}}
+        )
+        self.assertItemsEqual(
+            query_plan.output_filters.keys(), ['tag', 'id', 'unknown']
+        )
+
+    def test_plan_query_pagination(self):
+        query_plan = utils.plan_query(
+            models.Machine, {'mac': 'a', 'limit': 2, 'marker': 1}
+        )
+        self.assertEqual(
+            query_plan.filters, {'mac': 'a', 'limit': 2, 'marker': 1}
+        )
+        self.assertIsNone(query_plan.limit)
+        query_plan = utils.plan_query(
+            models.Machine,
+            {'tag': {'resp_in': ['a']}, 'limit': 2, 'marker': 1}
+        )
+        self.assertEqual(query_plan.filters, {'marker': 1})
+        self.assertEqual(query_plan.limit, 2)
+        query_plan = utils.plan_query(
+            models.Machine, {'tag': {'resp_in': ['a']}, 'limit': 2}
+        )
+        self.assertEqual(
+            query_plan.filters, {'order_by': [models.Machine.id]}
+        )
+        self.assertEqual(query_plan.limit, 2)
+
+    def test_plan_query_translator(self):
+        query_plan = utils.plan_query(
+            models.Machine,
+            {'mac': 'a', 'tag': 'b'},
+            mac=lambda col_attr, value: (col_attr == value, None),
+            tag=lambda col_attr, value: (None, value)
+        )
+        self.assertEqual(query_plan.pushed_down, ['mac'])
+        self.assertEqual(len(query_plan.conditions), 1)
+        self.assertEqual(query_plan.filters, {})
+        self.assertEqual(query_plan.output_filters, {'tag': 'b'})
+
+
+class TestLoadingProfile(unittest2.TestCase):
+    """Test loading profile compilation."""
+
+    def test_options(self):
+        machine_profile = utils.LoadingProfile(
+            models.Machine, switch_machines={'switch': {}}, host={}
+        )
+        loading_profile = utils.LoadingProfile(
+            models.SwitchMachine, switch={}, machine=machine_profile
+        )
+        # one option for each leaf of the tree.
+        self.assertEqual(len(loading_profile.options), 3)
+        self.assertIs(
+            loading_profile.options, loading_profile.options
+        )
+
+    def test_without(self):
+        loading_profile = utils.LoadingProfile(
+            models.Machine, switch_machines={'switch': {}}, host={}
+        )
+        self.assertEqual(
+            loading_profile.without('host').tree,
+            {'switch_machines': {'switch': {}}}
+        )
+        self.assertIn('host', loading_profile.tree)
+
+
 class TestGetDbObject(unittest2.TestCase):
     def setUp(self):
         super(TestGetDbObject, self).setUp()
@@ -420,6 +508,142 @@ class TestAddDbObject(unittest2.TestCase):
             self.assertEqual('test1', db_objs.alias)
 
 
+class TestAddDbObjects(unittest2.TestCase):
+    def setUp(self):
+        super(TestAddDbObjects, self).setUp()
+        reload(setting)
+        setting.CONFIG_DIR = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'data'
+        )
+        database.init('sqlite://')
+        database.create_db()
+
+    def tearDown(self):
+        database.drop_db()
+        reload(setting)
+        super(TestAddDbObjects, self).tearDown()
+
+    def test_add_db_objects(self):
+        with database.session() as session:
+            db_objs = utils.add_db_objects(
+                session, models.Permission, True,
+                data=[
+                    {'name': 'test1', 'alias': 'alias1'},
+                    {'name': 'test2'}
+                ]
+            )
+            self.assertEqual(
+                [('test1', 'alias1'), ('test2', None)],
+                [(db_obj.name, db_obj.alias) for db_obj in db_objs]
+            )
+            self.assertIsNotNone(db_objs[0].id)
+
+    def test_add_duplicate_with_flag(self):
+        with self.assertRaises(exception.DuplicatedRecord):
+            with database.session() as session:
+                utils.add_db_object(
+                    session, models.Permission, True, 'test'
+                )
+                utils.add_db_objects(
+                    session, models.Permission, True,
+                    data=[{'name': 'test1'}, {'name': 'test'}]
+                )
+
+    def test_add_duplicate_in_data_with_flag(self):
+        with self.assertRaises(exception.DuplicatedRecord):
+            with database.session() as session:
+                utils.add_db_objects(
+                    session, models.Permission, True,
+                    data=[{'name': 'test'}, {'name': 'test'}]
+                )
+
+    def test_upsert_db_objects(self):
+        with database.session() as session:
+            db_obj = utils.add_db_object(
+                session, models.Permission, True, 'test', alias='test'
+            )
+            db_objs = utils.upsert_db_objects(
+                session, models.Permission,
+                data=[
+                    {'name': 'test', 'alias': 'updated'},
+                    {'name': 'test1', 'alias': 'test1'}
+                ]
+            )
+            self.assertIs(db_objs[0], db_obj)
+            self.assertEqual('updated', db_obj.alias)
+            self.assertEqual('test1', db_objs[1].alias)
+
+    def test_add_with_missing_args(self):
+        with self.assertRaises(exception.InvalidParameter):
+            with database.session() as session:
+                utils.add_db_objects(
+                    session, models.AdapterRole, True,
+                    data=[{'name': 'test1', 'alias': 'test1'}]
+                )
+
+    def test_add_db_objects_statements(self):
+        with database.session() as session:
+            with count_statements() as statements:
+                utils.upsert_db_objects(
+                    session, models.Machine,
+                    data=[
+                        {'mac': '00:00:00:00:00:%02x' % i}
+                        for i in range(100)
+                    ]
+                )
+            # one prefetch query, then only the inserts.
+            self.assertEqual(
+                1, len([
+                    statement for statement in statements
+                    if statement.startswith('SELECT')
+                ])
+            )
+
+    def _import_machines(self, import_func, count, offset):
+        """Import count machines with import_func(session, macs)."""
+        macs = [
+            str(netaddr.EUI(offset + i, dialect=netaddr.mac_unix_expanded))
+            for i in range(count)
+        ]
+        with database.session() as session:
+            import_func(session, macs)
+
+    def _add_machines_one_by_one(self, session, macs):
+        for mac in macs:
+            utils.add_db_object(
+                session, models.Machine, False, mac
+            )
+
+    def _add_machines_in_batch(self, session, macs):
+        utils.upsert_db_objects(
+            session, models.Machine,
+            data=[{'mac': mac} for mac in macs]
+        )
+
+    def test_import_machines(self):
+        with count_statements() as one_by_one_statements:
+            self._import_machines(self._add_machines_one_by_one, 100, 0)
+        with count_statements() as batch_statements:
+            self._import_machines(self._add_machines_in_batch, 1000, 100)
+        # one prefetch query per chunk of keys.
+        self.assertEqual(
+            (1000 + utils.BULK_QUERY_CHUNK_SIZE - 1) /
+            utils.BULK_QUERY_CHUNK_SIZE,
+            len([
+                statement for statement in batch_statements
+                if statement.startswith('SELECT')
+            ])
+        )
+        self.assertLess(
+            len(batch_statements), len(one_by_one_statements) * 10
+        )
+        with database.session() as session:
+            self.assertEqual(
+                1100, utils.model_query(session, models.Machine).count()
+            )
+
+
 class TestListDbObjects(unittest2.TestCase):
     def setUp(self):
         super(TestListDbObjects, self).setUp()
@@ -472,6 +696,30 @@ class TestListDbObjects(unittest2.TestCase):
             )
             self.assertListEqual([], db_objs)
 
+    def test_list_objs_fields(self):
+        with database.session() as session:
+            db_objs = utils.list_db_objects(
+                session,
+                models.Permission,
+                fields=['id', 'name'],
+                name='list_permissions'
+            )
+            self.assertEqual(len(db_objs), 1)
+            self.assertEqual(
+                sorted(db_objs[0].keys()), ['id', 'name']
+            )
+            self.assertEqual(db_objs[0]['name'], 'list_permissions')
+
+    def test_list_objs_fields_not_column(self):
+        with database.session() as session:
+            db_objs = utils.list_db_objects(
+                session,
+                models.Permission,
+                fields=['id', 'user_permissions'],
+                name='list_permissions'
+            )
+            self.assertEqual(db_objs[0].name, 'list_permissions')
+
     def test_list_none_table(self):
         with self.assertRaises(exception.DatabaseException):
             with database.session() as session:
@@ -480,6 +728,42 @@ class TestListDbObjects(unittest2.TestCase):
                     models.Dummy,
                 )
 
+    def test_list_paginated_objs(self):
+        with database.session() as session:
+            all_ids = [
+                obj.id for obj in utils.list_db_objects(
+                    session, models.Permission, order_by=['id']
+                )
+            ]
+            first_page = utils.list_db_objects(
+                session, models.Permission, limit=2
+            )
+            second_page = utils.list_db_objects(
+                session, models.Permission,
+                limit=2, marker=first_page[-1].id
+            )
+            self.assertEqual(
+                [obj.id for obj in first_page + second_page],
+                all_ids[:4]
+            )
+            last_page = utils.list_db_objects(
+                session, models.Permission, marker=all_ids[-2]
+            )
+            self.assertEqual([obj.id for obj in last_page], all_ids[-1:])
+
+    def test_list_invalid_limit(self):
+        with database.session() as session:
+            self.assertRaises(
+                exception.InvalidParameter,
+                utils.list_db_objects,
+                session, models.Permission, limit=0
+            )
+            self.assertRaises(
+                exception.InvalidParameter,
+                utils.list_db_objects,
+                session, models.Permission, marker='1'
+            )
+
 
 class TestDelDbObjects(unittest2.TestCase):
     def setUp(self):
@@ -607,6 +891,237 @@ class TestDelDbObject(unittest2.TestCase):
                 )
 
 
+class TestSupportedFilters(unittest2.TestCase):
+    """Test supported filters decorator."""
+
+    def setUp(self):
+        super(TestSupportedFilters, self).setUp()
+
+        @utils.supported_filters(
+            ['name'],
+            optional_support_keys=['alias'],
+            ignore_support_keys=['id']
+        )
+        @utils.wrap_to_dict(['name', 'alias', 'id'])
+        def get_object(object_id, user=None, **kwargs):
+            kwargs['id'] = object_id
+            return kwargs
+
+        self.get_object = get_object
+
+    def test_supported_filters(self):
+        self.assertEqual(
+            self.get_object(1, name='a', alias='b', id=3),
+            {'id': 1, 'name': 'a', 'alias': 'b'}
+        )
+
+    def test_wrapped_args_accepted(self):
+        self.assertEqual(
+            self.get_object(object_id=1, user='user', name='a'),
+            {'id': 1, 'name': 'a'}
+        )
+
+    def test_unsupported_filter(self):
+        self.assertRaises(
+            exception.InvalidParameter,
+            self.get_object, 1, name='a', unknown='b'
+        )
+
+    def test_missing_filter(self):
+        self.assertRaises(
+            exception.InvalidParameter,
+            self.get_object, 1, alias='b'
+        )
+
+    def test_no_reflection_per_call(self):
+        with mock.patch.object(
+            utils.inspect, 'getargspec',
+            side_effect=AssertionError('getargspec called')
+        ):
+            with mock.patch.object(
+                utils, 'get_wrapped_func',
+                side_effect=AssertionError('get_wrapped_func called')
+            ):
+                for _ in range(3):
+                    self.get_object(1, name='a')
+
+    def _get_filter_wrappers(self):
+        """Get uncompiled and compiled supported_filters of a function.
+
+        The uncompiled one reflects on every call as done before the
+        decorators were compiled.
+        """
+        support_keys = set(['name'])
+        optional_support_keys = set(['alias'])
+        ignore_support_keys = set(['id'])
+
+        def get_object(object_id, user=None, **kwargs):
+            return kwargs
+
+        def uncompiled_supported_filters(*args, **filters):
+            argspec = inspect.getargspec(
+                utils.get_wrapped_func(get_object)
+            )
+            wrapped_args = set(argspec.args)
+            all_support_keys = support_keys | optional_support_keys
+            filter_keys = set(filters) - wrapped_args
+            unsupported_keys = (
+                filter_keys - all_support_keys - ignore_support_keys
+            )
+            if unsupported_keys:
+                raise exception.InvalidParameter(unsupported_keys)
+            missing_keys = support_keys - (set(filters) | wrapped_args)
+            if missing_keys:
+                raise exception.InvalidParameter(missing_keys)
+            return get_object(*args, **dict([
+                (key, value) for key, value in filters.items()
+                if key not in ignore_support_keys
+            ]))
+
+        compiled_supported_filters = utils.supported_filters(
+            list(support_keys),
+            optional_support_keys=list(optional_support_keys),
+            ignore_support_keys=list(ignore_support_keys)
+        )(get_object)
+        return uncompiled_supported_filters, compiled_supported_filters
+
+    def test_same_as_uncompiled(self):
+        uncompiled, compiled = self._get_filter_wrappers()
+        for filters in [
+            {'name': 'a', 'alias': 'b', 'id': 1},
+            {'name': 'a', 'user': None}
+        ]:
+            self.assertEqual(
+                compiled(1, **filters), uncompiled(1, **filters)
+            )
+        for filters in [{'alias': 'b'}, {'name': 'a', 'unknown': 'b'}]:
+            self.assertRaises(
+                exception.InvalidParameter, uncompiled, 1, **filters
+            )
+            self.assertRaises(
+                exception.InvalidParameter, compiled, 1, **filters
+            )
+
+
+class TestWrapToDict(unittest2.TestCase):
+    """Test wrap to dict decorator."""
+
+    def test_wrap_to_dict(self):
+        @utils.wrap_to_dict(
+            ['id', 'name', 'clusters', 'owner'],
+            clusters=['id'],
+            owner={'email': ['address']}
+        )
+        def get_object():
+            return [{
+                'id': 1,
+                'name': 'a',
+                'password': 'b',
+                'clusters': [{'id': 2, 'name': 'c'}],
+                'owner': {
+                    'email': {'address': 'a@b.c', 'valid': True},
+                    'id': 3
+                }
+            }]
+
+        self.assertEqual(
+            get_object(),
+            [{
+                'id': 1,
+                'name': 'a',
+                'clusters': [{'id': 2}],
+                'owner': {'email': {'address': 'a@b.c'}}
+            }]
+        )
+
+    def test_wrap_to_dict_fields(self):
+        @utils.wrap_to_dict(
+            ['id', 'name', 'clusters'],
+            clusters=['id']
+        )
+        def get_object(fields=None):
+            self.assertEqual(fields, frozenset(['id', 'clusters']))
+            return {
+                'id': 1,
+                'name': 'a',
+                'clusters': [{'id': 2, 'name': 'c'}],
+            }
+
+        self.assertEqual(
+            get_object(fields=['id', 'clusters']),
+            {'id': 1, 'clusters': [{'id': 2}]}
+        )
+        self.assertRaises(
+            exception.InvalidParameter,
+            get_object, fields=['id', 'password']
+        )
+
+    def test_wrap_to_dict_to_dict_fields(self):
+        db_object = mock.Mock(spec=models.HelperMixin)
+        db_object.to_dict.return_value = {'id': 1, 'name': 'a'}
+
+        @utils.wrap_to_dict(['id', 'name'])
+        def get_object():
+            return db_object
+
+        self.assertEqual(get_object(fields=['id']), {'id': 1})
+        db_object.to_dict.assert_called_once_with(frozenset(['id']))
+
+    def test_output_filters_fields(self):
+        @utils.output_filters(name=utils.general_filter_callback)
+        @utils.wrap_to_dict(['id', 'name'])
+        def list_objects(**filters):
+            return [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+
+        self.assertEqual(
+            list_objects(fields=['id'], name={'resp_eq': 'b'}),
+            [{'id': 2}]
+        )
+
+    def test_output_filters_only_given_filters(self):
+        name_callback = mock.Mock(return_value=True)
+        os_callback = mock.Mock(return_value=True)
+
+        @utils.output_filters(name=name_callback, os=os_callback)
+        def list_objects(**filters):
+            return [{'name': 'a', 'os': 'b'}]
+
+        self.assertEqual(list_objects(), [{'name': 'a', 'os': 'b'}])
+        self.assertFalse(name_callback.called)
+        list_objects(name='a')
+        name_callback.assert_called_once_with('a', 'a')
+        self.assertFalse(os_callback.called)
+
+    def test_replace_filters(self):
+        @utils.replace_filters(name='alias')
+        def get_object(**filters):
+            return filters
+
+        self.assertEqual(get_object(name='a', id=1), {'alias': 'a', 'id': 1})
+        self.assertEqual(get_object(id=1), {'id': 1})
+
+    def test_input_validates(self):
+        name_validator = mock.Mock()
+
+        @utils.input_validates(None, name=name_validator, alias=None)
+        def get_object(object_id, **kwargs):
+            return kwargs
+
+        get_object(1, alias='b')
+        self.assertFalse(name_validator.called)
+        get_object(1, name='a', alias='b')
+        name_validator.assert_called_once_with('a')
+
+    def test_wrap_to_dict_invalid_response(self):
+        @utils.wrap_to_dict(['id'])
+        def get_object():
+            return 'a'
+
+        self.assertRaises(
+            exception.InvalidResponse, get_object
+        )
+
+
 class TestCheckIp(unittest2.TestCase):
     def setUp(self):
         super(TestCheckIp, self).setUp()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import unittest2
+
+
+os.environ['COMPASS_IGNORE_SETTING'] = 'true'
+
+
+from compass.utils import setting_wrapper as setting
+reload(setting)
+
+
+from compass.utils import flags
+from compass.utils import logsetting
+from compass.utils import metrics
+
+
+class TestRegistry(unittest2.TestCase):
+    """Test metrics registry."""
+
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.registry = metrics.Registry()
+
+    def tearDown(self):
+        super(TestRegistry, self).tearDown()
+
+    def test_counter(self):
+        self.registry.inc('requests_total', 'Requests.', route='/a')
+        self.registry.inc('requests_total', 'Requests.', 2, route='/a')
+        self.assertEqual(
+            '# HELP requests_total Requests.\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{route="/a"} 3.0\n',
+            self.registry.render()
+        )
+
+    def test_histogram(self):
+        for value in [0.5, 1.5, 3]:
+            self.registry.observe(
+                'duration_seconds', 'Duration.', value, [1, 2], task='t'
+            )
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE duration_seconds histogram', lines)
+        self.assertIn('duration_seconds_bucket{task="t",le="1.0"} 1', lines)
+        self.assertIn('duration_seconds_bucket{task="t",le="2.0"} 2', lines)
+        self.assertIn('duration_seconds_bucket{task="t",le="+Inf"} 3', lines)
+        self.assertIn('duration_seconds_sum{task="t"} 5.0', lines)
+        self.assertIn('duration_seconds_count{task="t"} 3', lines)
+
+    def test_escape_labels(self):
+        self.registry.add('in_flight', 'In flight.', 1, key='a"b')
+        self.assertIn('in_flight{key="a\\"b"} 1.0', self.registry.render())
+
+    def test_write_push_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'tasks.prom')
+            self.registry.inc('tasks_total', 'Tasks.')
+            metrics.write_push_file(self.registry, path)
+            self.assertEqual(['tasks.prom'], os.listdir(tmp_dir))
+            with open(path) as push_file:
+                self.assertEqual(self.registry.render(), push_file.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    flags.init()
+    logsetting.init()
+    unittest2.main()
@@ -209,6 +209,45 @@ class TestParseTimeInterval(unittest2.TestCase):
         super(TestParseTimeInterval, self).tearDown()
 
 
+class TestParseMac(unittest2.TestCase):
+    """Test parse mac."""
+
+    def setUp(self):
+        super(TestParseMac, self).setUp()
+
+    def tearDown(self):
+        super(TestParseMac, self).tearDown()
+
+    def test_formats(self):
+        for mac in [
+            'AA:BB:CC:DD:EE:FF', 'aa-bb-cc-dd-ee-ff',
+            'aabb.ccdd.eeff', 'AABBCCDDEEFF'
+        ]:
+            self.assertEqual(util.parse_mac(mac), 0xaabbccddeeff)
+        self.assertEqual(
+            util.normalize_mac('0:1:2:3:4:5'), '00:01:02:03:04:05'
+        )
+
+    def test_invalid(self):
+        for mac in [
+            'aa:bb:cc:dd:ee', 'aa:bb:cc:dd:ee:fg', 'aa::cc:dd:ee:ff',
+            'aa:bb-cc:dd:ee:ff', '', None
+        ]:
+            self.assertRaises(ValueError, util.parse_mac, mac, ValueError)
+
+    def test_prefix(self):
+        self.assertEqual(
+            util.parse_mac_prefix('00-1B-21'),
+            (0x001b21000000, 0x001b21ffffff)
+        )
+        self.assertEqual(
+            util.parse_mac_prefix(''), (0, 0xffffffffffff)
+        )
+        self.assertRaises(
+            ValueError, util.parse_mac_prefix, '00:1b:zz', ValueError
+        )
+
+
 class TestLoadConfigs(unittest2.TestCase):
     """Test load configs."""
 
@@ -0,0 +1,170 @@
+# Copyright 2014 Huawei Technologies Co. Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process local counters, gauges and histograms.
+
+Metrics are rendered in the prometheus text exposition format, either
+served by the api or written to a push file which is picked up by the
+textfile collector of the node exporter.
+"""
+import os
+import threading
+
+from compass.utils import setting_wrapper as setting
+
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join([
+        '%s="%s"' % (
+            key,
+            str(value).replace(
+                '\\', '\\\\'
+            ).replace('"', '\\"').replace('\n', '\\n')
+        )
+        for key, value in labels
+    ])
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        lines = []
+        for bound, count in zip(
+            self.buckets + [float('inf')], self.counts + [self.count]
+        ):
+            lines.append('%s_bucket%s %s' % (
+                name, _format_labels(labels + (('le', _format_value(bound)),)),
+                count
+            ))
+        lines.append('%s_sum%s %s' % (
+            name, _format_labels(labels), _format_value(self.sum)
+        ))
+        lines.append('%s_count%s %s' % (
+            name, _format_labels(labels), self.count
+        ))
+        return lines
+
+
+class Registry(object):
+    """Metrics of a process keyed by name and label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+
+    def _get_family(self, name, metric_type, description):
+        family = self.families.get(name)
+        if not family:
+            family = self.families[name] = (metric_type, description, {})
+        return family[2]
+
+    def inc(self, name, description, value=1, **labels):
+        """Increase a counter."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self._get_family(name, COUNTER, description)
+            samples[key] = samples.get(key, 0) + value
+
+    def add(self, name, description, value, **labels):
+        """Add value to a gauge, the value may be negative."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self._get_family(name, GAUGE, description)
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, description, value, buckets=None, **labels):
+        """Observe a value into a histogram."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self._get_family(name, HISTOGRAM, description)
+            if key not in samples:
+                samples[key] = Histogram(
+                    buckets or setting.METRICS_DURATION_BUCKETS
+                )
+            samples[key].observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.families.clear()
+
+    def render(self):
+        """Render all the metrics in prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, (metric_type, description, samples) in sorted(
+                self.families.items()
+            ):
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                for labels, sample in sorted(samples.items()):
+                    if metric_type == HISTOGRAM:
+                        lines.extend(sample.lines(name, labels))
+                    else:
+                        lines.append('%s%s %s' % (
+                            name, _format_labels(labels),
+                            _format_value(sample)
+                        ))
+        return '\n'.join(lines) + '\n'
+
+
+def render_gauges(name, description, samples):
+    """Render a gauge family from a list of (labels dict, value)."""
+    lines = [
+        '# HELP %s %s' % (name, description),
+        '# TYPE %s %s' % (name, GAUGE)
+    ]
+    for labels, value in samples:
+        lines.append('%s%s %s' % (
+            name, _format_labels(tuple(sorted(labels.items()))),
+            _format_value(value)
+        ))
+    return '\n'.join(lines) + '\n'
+
+
+def write_push_file(registry, path):
+    """Atomically replace the push file at path with registry metrics."""
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as push_file:
+        push_file.write(registry.render())
+    os.rename(tmp_path, path)
+
+
+REGISTRY = Registry()
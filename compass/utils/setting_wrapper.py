@@ -27,6 +27,16 @@ import os.path
 CONFIG_DIR = '/etc/compass'
 SQLALCHEMY_DATABASE_URI = 'sqlite://'
 SQLALCHEMY_DATABASE_POOL_TYPE = 'static'
+SQLALCHEMY_DATABASE_POOL_RECYCLE = 3600
+SQLALCHEMY_DATABASE_POOL_PRE_PING = True
+SQLALCHEMY_DATABASE_REPLICA_URI = ''
+SQL_STATS_ENABLED = False
+SQL_STATS_SLOWEST_COUNT = 5
+SQL_STATS_REPEATED_THRESHOLD = 3
+SQL_STATS_HEADER_ENABLED = False
+REFERENCE_CACHE_SIZE = 1000
+REFERENCE_CACHE_TTL = 60
+USER_PERMISSION_CACHE_TTL = 60
 COBBLER_INSTALLATION_LOGDIR = '/var/log/cobbler/anamon'
 CHEF_INSTALLATION_LOGDIR = '/var/log/chef'
 INSTALLATION_LOGDIR = {
@@ -53,6 +63,49 @@ SWITCHES = [
 
 USER_AUTH_HEADER_NAME = 'X-Auth-Token'
 USER_TOKEN_DURATION = '2h'
+USER_TOKEN_REFRESH_THRESHOLD = '1h'
+# generated per deployment by the installer, the api refuses to start
+# without it.
+USER_TOKEN_SECRET_KEY = ''
+USER_TOKEN_CACHE_SIZE = 1000
+# tokens cleaned by logout in another process are still accepted by
+# this process until their cache entries expire.
+USER_TOKEN_CACHE_TTL = 5
+USER_TOKEN_CLEAN_BATCH_SIZE = 500
+USER_LOG_ASYNC = True
+USER_LOG_QUEUE_SIZE = 10000
+USER_LOG_BATCH_SIZE = 200
+USER_LOG_FLUSH_INTERVAL = 0.5
+USER_LOG_OVERFLOW_POLICY = 'drop'
+USER_LOG_BLOCK_TIMEOUT = 1.0
+USER_LOG_STOP_TIMEOUT = 10.0
+USER_LOG_RETENTION = '30d'
+USER_LOG_CLEAN_BATCH_SIZE = 1000
+LIST_STREAM_PAGE_SIZE = 500
+API_GZIP_MIN_SIZE = 1024
+API_GZIP_LEVEL = 6
+CLUSTER_PROGRESS_MAX_WAIT = 60
+CLUSTER_PROGRESS_POLL_INTERVAL = 1.0
+PROXY_POOL_CONNECTIONS = 10
+PROXY_POOL_MAXSIZE = 10
+PROXY_CONNECT_TIMEOUT = 5.0
+PROXY_READ_TIMEOUT = 60.0
+PROXY_CHUNK_SIZE = 8192
+PROXY_LOG_BODY_SIZE = 256
+METRICS_ALLOWED_ADDRESSES = ['127.0.0.1']
+METRICS_DURATION_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 300.0
+]
+METRICS_SQL_COUNT_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+METRICS_PUSH_DIR = ''
+METRICS_PUSH_INTERVAL = 10.0
+BATCH_MAX_REQUESTS = 500
+API_WARM_UP_IN_BACKGROUND = False
+SWITCH_FILTER_MATCHER_CACHE_SIZE = 100
+SWITCH_FILTER_RESULT_CACHE_SIZE = 65536
+MACHINE_MAC_MIGRATION_CHUNK_SIZE = 1000
+SWITCH_MACHINE_PORT_MIGRATION_CHUNK_SIZE = 1000
 COMPASS_ADMIN_EMAIL = 'admin@huawei.com'
 COMPASS_ADMIN_PASSWORD = 'admin'
 COMPASS_DEFAULT_PERMISSIONS = [
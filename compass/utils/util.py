@@ -80,6 +80,68 @@ def format_datetime(date_time):
     return date_time.strftime("%Y-%m-%d %H:%M:%S")
 
 
+MAC_BITS = 48
+HEX_PATTERN = re.compile(r'^[0-9a-fA-F]+$')
+# separator, max hex digits per group and number of groups of mac formats.
+MAC_FORMATS = [(':', 2, 6), ('-', 2, 6), ('.', 4, 3)]
+
+
+def parse_mac(mac, exception_class=Exception):
+    """Parse mac str to the 48 bit int.
+
+    Colon and dash separated octets, cisco dotted words and bare hex
+    digits are accepted in any case.
+    """
+    if isinstance(mac, basestring):
+        mac = mac.strip()
+        for separator, group_size, groups in MAC_FORMATS:
+            if separator not in mac:
+                continue
+            parts = mac.split(separator)
+            if len(parts) == groups and all([
+                len(part) <= group_size and HEX_PATTERN.match(part)
+                for part in parts
+            ]):
+                return int(''.join([
+                    part.zfill(group_size) for part in parts
+                ]), 16)
+            break
+        else:
+            if len(mac) == MAC_BITS / 4 and HEX_PATTERN.match(mac):
+                return int(mac, 16)
+    raise exception_class('mac address %s format is invalid' % mac)
+
+
+def format_mac(mac_int):
+    """Generate lower case colon separated mac str from 48 bit int."""
+    mac_hex = '%012x' % mac_int
+    return ':'.join([mac_hex[i:i + 2] for i in range(0, len(mac_hex), 2)])
+
+
+def normalize_mac(mac, exception_class=Exception):
+    """Convert mac str in any accepted format to the canonical format."""
+    return format_mac(parse_mac(mac, exception_class))
+
+
+def parse_mac_prefix(mac_prefix, exception_class=Exception):
+    """Parse mac prefix str like an OUI to the (first, last) mac ints.
+
+    The prefix is the leading hex digits of the mac, separators are
+    ignored, e.g. 00:1B:21 matches 00:1b:21:00:00:00-00:1b:21:ff:ff:ff.
+    """
+    prefix_hex = re.sub(r'[:.-]', '', str(mac_prefix).strip())
+    if not (
+        len(prefix_hex) <= MAC_BITS / 4 and
+        (not prefix_hex or HEX_PATTERN.match(prefix_hex))
+    ):
+        raise exception_class(
+            'mac address prefix %s format is invalid' % mac_prefix
+        )
+    shift = MAC_BITS - 4 * len(prefix_hex)
+    first = int(prefix_hex or '0', 16) << shift
+    return first, first + (1 << shift) - 1
+
+
 def merge_dict(lhs, rhs, override=True):
     """Merge nested right dict into left nested dict recursively.
 
@@ -101,6 +101,8 @@ sudo sed -i "s/\$hostname/$HOSTNAME/g" /etc/compass/setting
 sudo sed -i "s/\$gateway/$OPTION_ROUTER/g" /etc/compass/setting
 domains=$(echo $NAMESERVER_DOMAINS | sed "s/,/','/g")
 sudo sed -i "s/\$domains/$domains/g" /etc/compass/setting
+token_secret=$(head -c 32 /dev/urandom | od -An -tx1 | tr -d ' \n')
+sudo sed -i "s/\$token_secret/$token_secret/g" /etc/compass/setting
 
 sudo sed -i "s/\$cobbler_ip/$IPADDR/g" /etc/compass/os_installer/cobbler.conf
 sudo sed -i "s/\$chef_ip/$IPADDR/g" /etc/compass/package_installer/chef-icehouse.conf